@@ -0,0 +1,182 @@
+"""
+API benchmark suite: seed a throwaway database with the `seed_polls` command
+and run every main endpoint against it, reporting per endpoint the latency
+percentiles, SQL queries per request and peak (Python) memory of a request.
+
+Save the JSON of a run and hand it to a later run with --compare to see the
+change of every endpoint between two commits:
+
+    python -m benchmarks.bench_api --users 20000 --polls 100000 --votes 1000000 --json > before.json
+    python -m benchmarks.bench_api --users 20000 --polls 100000 --votes 1000000 --compare before.json
+"""
+import io
+import json
+import platform
+import resource
+import subprocess
+import tracemalloc
+
+from benchmarks.common import (
+    Timer, argument_parser, benchmark_database, count_queries, percentiles, report, setup_django,
+)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenarios(hot_poll, creator, choices, voters):
+    """
+    (name, method, path, token, before) per endpoint; the path, token and
+    `before` hook (run outside the timing) are functions of the request number
+    """
+    from polls.cache import bump_poll_version
+
+    poll_url = f'/api/polls/{hot_poll.id}/'
+
+    def uncached(n):
+        bump_poll_version(hot_poll.id)
+
+    def creator_token(n):
+        return creator.auth_token.key
+
+    def voter_token(n):
+        return voters[n % len(voters)].auth_token.key
+
+    def vote_path(n):
+        # every round through the voters moves each vote to the next choice, so no vote is a no-op
+        return f'{poll_url}choices/{choices[n // len(voters) % len(choices)].id}/vote/'
+
+    return [
+        ('poll list', 'get', lambda n: '/api/polls/', voter_token, None),
+        ('poll list ?fields=id,question', 'get', lambda n: '/api/polls/?fields=id,question', voter_token, None),
+        ('poll detail (cached)', 'get', lambda n: poll_url, voter_token, None),
+        ('poll detail (uncached)', 'get', lambda n: poll_url, voter_token, uncached),
+        ('poll results (uncached)', 'get', lambda n: f'{poll_url}results/', voter_token, uncached),
+        ('choices list', 'get', lambda n: f'{poll_url}choices/', creator_token, None),
+        ('choice votes list', 'get', lambda n: f'{poll_url}choices/{choices[0].id}/votes/', voter_token, None),
+        ('cast vote', 'post', vote_path, voter_token, None),
+    ]
+
+
+def run_scenario(client, scenario, requests, measured):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    name, method, path, token, before = scenario
+
+    def call(n):
+        if before:
+            before(n)
+
+        with Timer() as timer:
+            response = getattr(client, method)(path(n), HTTP_AUTHORIZATION=f'Token {token(n)}')
+
+        return response.status_code, timer.elapsed
+
+    # warm up: url resolver, token and ownership caches
+    warm_up = min(requests, 20)
+    for n in range(warm_up):
+        call(n)
+
+    outcomes = [call(n) for n in range(warm_up, warm_up + requests)]
+
+    # queries and memory in a separate pass, tracing would distort the timings
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        for n in range(warm_up + requests, warm_up + requests + measured):
+            call(n)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    counts = count_queries(queries)
+
+    return {
+        **percentiles([elapsed for _, elapsed in outcomes]),
+        'errors': sum(1 for status, _ in outcomes if status >= 400),
+        'queries_per_request': counts['queries'] / measured,
+        'peak_memory_kib': peak / 1024,
+    }
+
+
+def compare(results, baseline):
+    """Add the change against the results of an earlier run"""
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if not isinstance(old, dict) or name == 'meta':
+            continue
+
+        for key in ('p50_ms', 'p99_ms', 'peak_memory_kib'):
+            if old.get(key):
+                stats[f'{key}_change_pct'] = (stats[key] - old[key]) / old[key] * 100
+
+        stats['queries_change'] = stats['queries_per_request'] - old.get('queries_per_request', 0)
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--requests', type=int, default=500, help='timed requests per endpoint')
+    parser.add_argument('--measured', type=int, default=20, help='requests per endpoint to count queries and memory on')
+    parser.add_argument('--users', type=int, default=2000, help='seeded users')
+    parser.add_argument('--polls', type=int, default=10000, help='seeded polls')
+    parser.add_argument('--choices', type=int, default=4, help='choices per seeded poll')
+    parser.add_argument('--votes', type=int, default=100000, help='seeded votes')
+    parser.add_argument('--hot-polls', type=int, default=10, help='seeded hot polls')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the data')
+    parser.add_argument('--compare', metavar='JSON', help='results of an earlier run (--json output) to compare with')
+    args = parser.parse_args()
+
+    setup_django()
+
+    import django
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+
+    from polls.models import Poll
+
+    with benchmark_database():
+        seed_output = io.StringIO()
+        with Timer() as seeding:
+            call_command(
+                'seed_polls', users=args.users, polls=args.polls, choices=args.choices, votes=args.votes,
+                hot_polls=args.hot_polls, seed=args.seed, stdout=seed_output
+            )
+
+        hot_poll = Poll.objects.select_related('creator__auth_token').order_by('-total_votes', 'id').first()
+        choices = list(hot_poll.choices.order_by('id'))
+        voters = [vote.voter for vote in hot_poll.votes.select_related('voter__auth_token').order_by('id')[:100]]
+
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'users': args.users,
+                'polls': args.polls,
+                'votes': args.votes,
+                'requests': args.requests,
+                'seed_seconds': seeding.elapsed,
+            },
+        }
+
+        client = APIClient()
+        for scenario in scenarios(hot_poll, hot_poll.creator, choices, voters):
+            results[scenario[0]] = run_scenario(client, scenario, args.requests, args.measured)
+
+        # ru_maxrss is in KiB on Linux
+        results['meta']['max_rss_mib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Sync vs async serving benchmark: requests/sec and latency percentiles of the
+poll list, detail and results endpoints with many concurrent clients, for
+
+  - the DRF views behind the WSGI handler (one thread per client),
+  - the same DRF views behind the ASGI handler (sync views run in a thread),
+  - the ASGI-native views under /api/async/.
+
+The handlers are driven in-process (no HTTP server or sockets), so the numbers
+compare the request handling itself.
+
+    python -m benchmarks.bench_async --concurrency 64 --requests 2000
+"""
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import argument_parser, benchmark_database, create_users, percentiles, report, setup_django
+
+
+def wsgi_get(handler, path, token):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'testserver',
+        'HTTP_AUTHORIZATION': f'Token {token}',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+    }
+    statuses = []
+
+    body = b''.join(handler(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+
+    return int(statuses[0].split()[0]), body
+
+
+async def asgi_get(application, path, token):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Token {token}'.encode())],
+        'server': ('testserver', 80),
+    }
+    messages = []
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        # the client stays connected until the response is complete
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+        if message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    await application(scope, receive, send)
+
+    return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+
+def run_wsgi(handler, requests, concurrency):
+    def timed(request):
+        start = time.perf_counter()
+        status, _ = wsgi_get(handler, *request)
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        outcomes = list(executor.map(timed, requests))
+
+    return outcomes, time.perf_counter() - start
+
+
+def run_asgi(application, requests, concurrency):
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(request):
+            async with semaphore:
+                start = time.perf_counter()
+                status, _ = await asgi_get(application, *request)
+                return status, time.perf_counter() - start
+
+        return await asyncio.gather(*(timed(request) for request in requests))
+
+    start = time.perf_counter()
+    outcomes = asyncio.run(main())
+
+    return outcomes, time.perf_counter() - start
+
+
+def summarize(outcomes, elapsed):
+    errors = sum(1 for status, _ in outcomes if status >= 400)
+
+    return {
+        'requests_per_sec': len(outcomes) / elapsed,
+        **percentiles([latency for _, latency in outcomes]),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+    parser.add_argument('--concurrency', type=int, default=64, help='concurrent clients')
+    parser.add_argument('--polls', type=int, default=50, help='polls in the database')
+    parser.add_argument('--choices', type=int, default=4, help='choices per poll')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.core.handlers.asgi import ASGIHandler
+    from django.core.handlers.wsgi import WSGIHandler
+
+    from polls.models import Poll, Choice
+
+    with benchmark_database():
+        users = create_users(args.concurrency)
+        polls = Poll.objects.bulk_create(
+            Poll(question=f'Poll {i}', creator=users[0]) for i in range(args.polls)
+        )
+        Choice.objects.bulk_create(
+            Choice(poll=poll, body=f'Choice {i}', vote_count=i) for poll in polls for i in range(args.choices)
+        )
+
+        # list, detail and results in turn, every client with its own token
+        paths = ['/api/polls/', *(f'/api/polls/{poll.id}/{suffix}' for poll in polls for suffix in ('', 'results/'))]
+        requests = [
+            (paths[n % len(paths)], users[n % len(users)].auth_token.key)
+            for n in range(args.requests)
+        ]
+        async_requests = [(path.replace('/api/', '/api/async/', 1), token) for path, token in requests]
+
+        wsgi, asgi = WSGIHandler(), ASGIHandler()
+
+        # warm up caches (tokens, responses) the same way for every variant
+        run_wsgi(wsgi, requests[:len(paths) + len(users)], args.concurrency)
+        run_asgi(asgi, async_requests[:len(paths) + len(users)], args.concurrency)
+
+        results = {
+            'sync views, WSGI': summarize(*run_wsgi(wsgi, requests, args.concurrency)),
+            'sync views, ASGI': summarize(*run_asgi(asgi, requests, args.concurrency)),
+            'async views, ASGI': summarize(*run_asgi(asgi, async_requests, args.concurrency)),
+        }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
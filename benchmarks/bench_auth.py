@@ -0,0 +1,75 @@
+"""
+Token authentication benchmark: per-request latency and queries of
+GET /api/polls/ with DRF's TokenAuthentication against CachedTokenAuthentication.
+
+    python -m benchmarks.bench_auth --requests 2000
+"""
+from unittest.mock import patch
+
+from benchmarks.common import (
+    Timer, argument_parser, benchmark_database, count_queries, create_users, percentiles, report, setup_django,
+)
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+    parser.add_argument('--users', type=int, default=50, help='distinct tokens the requests rotate through')
+    parser.add_argument('--polls', type=int, default=20, help='polls in the database')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+
+    from polls import authentication
+    from polls.authentication import CachedTokenAuthentication
+    from polls.models import Poll
+    from polls.views import PollViewSets
+
+    with benchmark_database():
+        users = create_users(args.users)
+        Poll.objects.bulk_create(Poll(question=f'Poll {i}', creator=users[0]) for i in range(args.polls))
+
+        client = Client()
+        headers = [f'Token {user.auth_token.key}' for user in users]
+
+        results = {}
+
+        for name, auth_class in (('TokenAuthentication', TokenAuthentication),
+                                 ('CachedTokenAuthentication', CachedTokenAuthentication)):
+            authentication.reset_token_cache()
+
+            with patch.object(PollViewSets, 'authentication_classes', [auth_class, SessionAuthentication]):
+                # warm up: imports, url resolver, and for the cached class one lookup per token
+                for header in headers:
+                    client.get('/api/polls/', HTTP_AUTHORIZATION=header)
+
+                samples = []
+                with CaptureQueriesContext(connection) as queries:
+                    for n in range(args.requests):
+                        with Timer() as timer:
+                            client.get('/api/polls/', HTTP_AUTHORIZATION=headers[n % len(headers)])
+                        samples.append(timer.elapsed)
+
+            counts = count_queries(queries)
+            results[name] = {
+                **percentiles(samples),
+                'queries_per_request': counts['queries'] / args.requests,
+            }
+
+        results['CachedTokenAuthentication']['cache'] = authentication.stats()
+        results['saved per request'] = {
+            'mean_ms': results['TokenAuthentication']['mean_ms'] - results['CachedTokenAuthentication']['mean_ms'],
+            'queries': (results['TokenAuthentication']['queries_per_request']
+                        - results['CachedTokenAuthentication']['queries_per_request']),
+        }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Bulk vote ingestion benchmark: votes/sec of the bulk endpoint and of the
+cast_votes() service, against one CreateVote request per vote.
+
+    python -m benchmarks.bench_bulk_votes --votes 5000
+"""
+from benchmarks.common import (
+    Timer, argument_parser, benchmark_database, count_queries, create_users, report, setup_django,
+)
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--votes', type=int, default=5000, help='votes per run')
+    parser.add_argument('--single-votes', type=int, default=500, help='votes cast through CreateVote (slower)')
+    parser.add_argument('--choices', type=int, default=4, help='choices of the poll')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='votes per upsert chunk')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    from polls.models import Poll, Choice
+    from polls import services
+
+    with benchmark_database():
+        users = create_users(max(args.votes, args.single_votes))
+        users[0].is_staff = True
+        users[0].save()
+
+        def new_poll():
+            poll = Poll.objects.create(question='Benchmark poll', creator=users[0])
+            choices = Choice.objects.bulk_create(Choice(poll=poll, body=f'Choice {i}') for i in range(args.choices))
+            return poll, choices
+
+        results = {}
+
+        # one request per vote
+        poll, choices = new_poll()
+
+        with Timer() as timer:
+            for n, user in enumerate(users[:args.single_votes]):
+                Client().post(
+                    f'/api/polls/{poll.id}/choices/{choices[n % len(choices)].id}/vote/',
+                    HTTP_AUTHORIZATION=f'Token {user.auth_token.key}'
+                )
+
+        results['CreateVote, one request per vote'] = {
+            'votes': args.single_votes,
+            'seconds': timer.elapsed,
+            'votes_per_sec': args.single_votes / timer.elapsed,
+        }
+
+        # the service function, no HTTP
+        poll, choices = new_poll()
+        items = [(user.pk, choices[n % len(choices)].id) for n, user in enumerate(users[:args.votes])]
+
+        with Timer() as timer, CaptureQueriesContext(connection) as queries:
+            services.cast_votes(poll.id, items, chunk_size=args.chunk_size)
+
+        results['services.cast_votes'] = {
+            'votes': args.votes,
+            'seconds': timer.elapsed,
+            'votes_per_sec': args.votes / timer.elapsed,
+            **count_queries(queries),
+        }
+
+        # the bulk endpoint, one request
+        poll, choices = new_poll()
+        payload = {
+            'votes': [
+                {'voter': user.pk, 'choice': str(choices[n % len(choices)].id)}
+                for n, user in enumerate(users[:args.votes])
+            ]
+        }
+
+        with Timer() as timer:
+            response = Client().post(
+                f'/api/polls/{poll.id}/votes/bulk/',
+                payload,
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Token {users[0].auth_token.key}'
+            )
+
+        results['bulk endpoint, one request'] = {
+            'votes': args.votes,
+            'status_code': response.status_code,
+            'seconds': timer.elapsed,
+            'votes_per_sec': args.votes / timer.elapsed,
+        }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Poll deletion benchmark: delete one large seeded poll through the ORM
+(Django's Collector, one transaction) and through polls.deletion (marked
+deleted, then purged in batches). Reported per method: the time until the
+poll is gone for the API, the time until its rows are gone, the longest
+transaction (how long the write lock is held at once) and the peak (Python)
+memory. Both run under tracemalloc, which slows them alike.
+
+    python -m benchmarks.bench_deletion --votes 500000
+"""
+import io
+import time
+import tracemalloc
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from benchmarks.common import Timer, argument_parser, benchmark_database, report, setup_django
+
+
+class TransactionTimer:
+    """
+    Time the transactions of a connection: from their first statement (an
+    execute_wrapper() hook) to the commit (commit() wrapped in place)
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.start = None
+        self.longest = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.start is None and self.connection.in_atomic_block:
+            self.start = time.perf_counter()
+
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def timing(self):
+        commit = self.connection.commit
+
+        def timed_commit():
+            commit()
+
+            if self.start is not None:
+                self.longest = max(self.longest, time.perf_counter() - self.start)
+                self.start = None
+
+        with self.connection.execute_wrapper(self), patch.object(self.connection, 'commit', timed_commit):
+            yield
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--votes', type=int, default=200000, help='votes of the deleted poll')
+    parser.add_argument('--choices', type=int, default=10, help='choices of the deleted poll')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per DELETE of the batched purge')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.core.management import call_command
+    from django.db import connection, transaction
+    from django.test.utils import override_settings
+
+    from polls import deletion
+    from polls.models import Poll
+
+    def orm(poll):
+        with transaction.atomic():
+            poll.delete()
+
+        return 0.0
+
+    def batched(poll):
+        # the request returns once the poll is marked (ASYNC), the purge comes after
+        with patch.object(deletion, 'get_purger'), Timer() as marking:
+            deletion.delete_poll(poll.id, poll.creator_id)
+
+        deletion.purge_poll(poll.id)
+
+        return marking.elapsed
+
+    results = {}
+
+    for name, delete in (('ORM delete (Collector)', orm), ('delete_poll (batched purge)', batched)):
+        with benchmark_database():
+            # the same poll for both methods: one poll with a vote from every user
+            call_command(
+                'seed_polls', users=args.votes, polls=1, choices=args.choices, votes=args.votes, hot_polls=1,
+                hot_share=1, stdout=io.StringIO()
+            )
+            poll = Poll.objects.get()
+
+            transactions = TransactionTimer(connection)
+
+            with override_settings(POLLS_POLL_DELETION={'ASYNC': True, 'BATCH_SIZE': args.batch_size}):
+                tracemalloc.start()
+                with transactions.timing(), Timer() as timer:
+                    hidden = delete(poll)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+            assert not Poll.all_objects.exists()
+
+            results[name] = {
+                'hidden_after_ms': (hidden or timer.elapsed) * 1000,
+                'purged_after_ms': timer.elapsed * 1000,
+                'longest_transaction_ms': transactions.longest * 1000,
+                'peak_memory_kib': peak / 1024,
+            }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Vote export benchmark: time, throughput and peak (Python) memory of
+GET /api/polls/<pk>/votes/export/ for polls of growing size, per format.
+The peak memory should stay flat as the number of votes grows.
+
+    python -m benchmarks.bench_export --votes 10000 100000 500000
+"""
+import io
+import tracemalloc
+
+from benchmarks.common import Timer, argument_parser, benchmark_database, report, setup_django
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--votes', type=int, nargs='+', default=[10000, 100000], help='votes of the exported polls')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.core.management import call_command
+    from rest_framework.test import APIClient
+
+    from polls.models import Poll
+
+    results = {}
+
+    for votes in args.votes:
+        with benchmark_database():
+            # one poll with a vote from every user
+            call_command(
+                'seed_polls', users=votes, polls=1, choices=4, votes=votes, hot_polls=1, hot_share=1,
+                stdout=io.StringIO()
+            )
+            poll = Poll.objects.select_related('creator').get()
+
+            client = APIClient()
+            client.force_authenticate(poll.creator)
+
+            for format, headers in (('csv', {}), ('ndjson', {}), ('csv', {'HTTP_ACCEPT_ENCODING': 'gzip'})):
+                name = f'{votes} votes {format}' + (' gzip' if headers else '')
+
+                def export():
+                    response = client.get(f'/api/polls/{poll.id}/votes/export/', {'format': format}, **headers)
+                    return sum(len(chunk) for chunk in response.streaming_content)
+
+                with Timer() as timer:
+                    size = export()
+
+                # memory in a separate pass, tracing would distort the timing
+                tracemalloc.start()
+                export()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                results[name] = {
+                    'seconds': timer.elapsed,
+                    'rows_per_second': votes / timer.elapsed,
+                    'response_mib': size / 2 ** 20,
+                    'peak_memory_kib': peak / 1024,
+                }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Request profiler overhead: latency of GET /api/polls/<pk>/ with the
+profiling middleware disabled, enabled but not sampling, sampling 1% and
+profiling every request. The unsampled run is the cost every production
+request pays and should stay within the noise of the disabled run.
+
+The middleware's own cost on an unsampled request is measured separately,
+around a response function that does nothing.
+
+    python -m benchmarks.bench_profiling --requests 2000
+"""
+import shutil
+import tempfile
+import time
+
+from benchmarks.common import Timer, argument_parser, benchmark_database, create_users, percentiles, report, setup_django
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+    parser.add_argument('--calls', type=int, default=1000000, help='calls of the bare middleware')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+    from rest_framework.test import APIClient
+
+    from polls.models import Poll
+    from polls.profiling import ProfilingMiddleware
+
+    directory = tempfile.mkdtemp(prefix='polls-profiles-')
+
+    runs = (
+        ('disabled', {'ENABLED': False}),
+        ('enabled, unsampled', {'ENABLED': True, 'SAMPLE_RATE': 0}),
+        ('enabled, 1% sampled', {'ENABLED': True, 'SAMPLE_RATE': 0.01}),
+        ('every request profiled', {'ENABLED': True, 'SAMPLE_RATE': 1}),
+    )
+
+    try:
+        with benchmark_database():
+            user = create_users(1)[0]
+            poll = Poll.objects.create(question='Benchmark poll', creator=user)
+
+            results = {}
+
+            for name, config in runs:
+                with override_settings(POLLS_PROFILING={'DIRECTORY': directory, 'MAX_PROFILES': 100, **config}):
+                    client = APIClient()
+                    client.credentials(HTTP_AUTHORIZATION=f'Token {user.auth_token.key}')
+
+                    # warm up: middleware chain, url resolver, token and response caches
+                    for _ in range(50):
+                        client.get(f'/api/polls/{poll.id}/')
+
+                    samples = []
+                    for _ in range(args.requests):
+                        with Timer() as timer:
+                            client.get(f'/api/polls/{poll.id}/')
+                        samples.append(timer.elapsed)
+
+                results[name] = percentiles(samples)
+
+            baseline = results['disabled']['p50_ms']
+            for name, _ in runs[1:]:
+                results[name]['p50_overhead_pct'] = (results[name]['p50_ms'] - baseline) / baseline * 100
+
+        with override_settings(POLLS_PROFILING={'ENABLED': True, 'SAMPLE_RATE': 0, 'DIRECTORY': directory}):
+            middleware = ProfilingMiddleware(lambda request: None)
+
+        request = RequestFactory().get('/api/polls/')
+
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            middleware(request)
+        results['unsampled middleware call'] = {'ns_per_call': (time.perf_counter() - start) / args.calls * 1e9}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+JSON renderer/parser microbenchmark: DRF's JSONRenderer and JSONParser
+against polls.renderers.FastJSONRenderer and polls.parsers.FastJSONParser on
+large pages of serialized polls (what GET /api/polls/?page_size=... renders).
+
+    python -m benchmarks.bench_renderers --sizes 100 1000 10000
+"""
+import io
+import timeit
+
+from benchmarks.common import argument_parser, benchmark_database, create_users, report, setup_django
+
+
+def best_of(function, repeat):
+    """Best time of one call, in milliseconds"""
+    runs = max(1, repeat)
+    return min(timeit.repeat(function, number=1, repeat=runs)) * 1000
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='polls per page')
+    parser.add_argument('--choices', type=int, default=4, help='choices per poll')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per measurement, the best one counts')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from polls.models import Poll, Choice
+    from polls.parsers import FastJSONParser
+    from polls.renderers import FastJSONRenderer, orjson
+    from polls.serializers import PollSerializer
+
+    results = {'orjson': {'installed': orjson is not None}}
+
+    with benchmark_database():
+        user = create_users(1)[0]
+        polls = Poll.objects.bulk_create(
+            Poll(question=f'Poll number {i}, which option do you prefer?', creator=user) for i in range(max(args.sizes))
+        )
+        Choice.objects.bulk_create(
+            Choice(poll=poll, body=f'Choice {i}', vote_count=i) for poll in polls for i in range(args.choices)
+        )
+
+        for size in args.sizes:
+            page = Poll.objects.order_by('-pub_date', '-id').prefetch_related('choices')[:size]
+            data = {'next': None, 'previous': None, 'results': PollSerializer(page, many=True).data}
+
+            rendered = JSONRenderer().render(data)
+            if FastJSONRenderer().render(data) != rendered:
+                raise AssertionError('FastJSONRenderer output differs from JSONRenderer')
+
+            repeat = args.repeat if size <= 1000 else max(3, args.repeat // 5)
+
+            drf_render = best_of(lambda: JSONRenderer().render(data), repeat)
+            fast_render = best_of(lambda: FastJSONRenderer().render(data), repeat)
+            drf_parse = best_of(lambda: JSONParser().parse(io.BytesIO(rendered), 'application/json', {}), repeat)
+            fast_parse = best_of(lambda: FastJSONParser().parse(io.BytesIO(rendered), 'application/json', {}), repeat)
+
+            results[f'{size} polls ({len(rendered) / 1024:.0f} KiB)'] = {
+                'JSONRenderer_ms': drf_render,
+                'FastJSONRenderer_ms': fast_render,
+                'render_speedup': drf_render / fast_render,
+                'JSONParser_ms': drf_parse,
+                'FastJSONParser_ms': fast_parse,
+                'parse_speedup': drf_parse / fast_parse,
+            }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Read serializer benchmark: ModelSerializer (PollSerializer with nested
+choices, VoteSerializer) against polls.fast_serializers.FastReadSerializer,
+loading and serializing 1k/10k/100k rows, queries included. For polls a row
+is a poll or one of its choices (1k rows = 200 polls with 4 choices each).
+
+    python -m benchmarks.bench_serializers --sizes 1000 10000 100000
+"""
+from benchmarks.common import Timer, argument_parser, benchmark_database, create_users, report, setup_django
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='rows per run')
+    parser.add_argument('--choices', type=int, default=4, help='choices per poll')
+    parser.add_argument('--voters', type=int, default=1000, help='users casting the votes')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+
+    from polls.fast_serializers import FastReadSerializer
+    from polls.models import Poll, Choice, Vote
+    from polls.serializers import PollSerializer, VoteSerializer
+
+    largest = max(args.sizes)
+    results = {}
+
+    def poll_count(rows):
+        return max(1, rows // (1 + args.choices))
+
+    with benchmark_database():
+        users = create_users(args.voters)
+        polls = Poll.objects.bulk_create(
+            Poll(question=f'Poll number {i}, which option do you prefer?', creator=users[0])
+            for i in range(max(poll_count(largest), largest // len(users) + 1))
+        )
+        choices = Choice.objects.bulk_create(
+            Choice(poll=poll, body=f'Choice {i}', vote_count=i) for poll in polls for i in range(args.choices)
+        )
+        # one vote per (poll, voter)
+        Vote.objects.bulk_create(
+            Vote(poll=polls[n // len(users)], choice=choices[(n // len(users)) * args.choices], voter=users[n % len(users)])
+            for n in range(largest)
+        )
+
+        for size in args.sizes:
+            for name, serializer_class, queryset in (
+                ('poll rows', PollSerializer, Poll.objects.order_by('id').prefetch_related('choices')[:poll_count(size)]),
+                ('votes', VoteSerializer, Vote.objects.order_by('id')[:size]),
+            ):
+                with Timer() as model_timer:
+                    model_data = serializer_class(queryset.all(), many=True).data
+
+                fast = FastReadSerializer(serializer_class)
+                with Timer() as fast_timer:
+                    fast_data = fast.to_representation(fast.values(queryset.prefetch_related(None)))
+
+                if JSONRenderer().render(fast_data) != JSONRenderer().render(model_data):
+                    raise AssertionError(f'FastReadSerializer output differs for {name}')
+
+                results[f'{size} {name}'] = {
+                    'ModelSerializer_ms': model_timer.elapsed * 1000,
+                    'FastReadSerializer_ms': fast_timer.elapsed * 1000,
+                    'speedup': model_timer.elapsed / fast_timer.elapsed,
+                }
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
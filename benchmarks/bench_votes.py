@@ -0,0 +1,81 @@
+"""
+Vote casting benchmark: queries per vote and votes/sec under concurrent clients.
+
+    python -m benchmarks.bench_votes --clients 8 --votes 200
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import (
+    Timer, argument_parser, benchmark_database, count_queries, create_users, percentiles, report, setup_django,
+)
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--votes', type=int, default=200, help='votes per client')
+    parser.add_argument('--choices', type=int, default=4, help='choices of the poll')
+    args = parser.parse_args()
+
+    setup_django()
+
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    from polls.models import Poll, Choice
+
+    with benchmark_database():
+        users = create_users(args.clients * args.votes)
+        poll = Poll.objects.create(question='Benchmark poll', creator=users[0])
+        choices = Choice.objects.bulk_create(Choice(poll=poll, body=f'Choice {i}') for i in range(args.choices))
+        urls = [f'/api/polls/{poll.id}/choices/{choice.id}/vote/' for choice in choices]
+
+        results = {}
+
+        # queries per vote for each outcome, on a single client
+        client = Client(HTTP_AUTHORIZATION=f'Token {users[0].auth_token.key}')
+
+        for outcome, url in [('new vote', urls[0]), ('changed vote', urls[1]), ('same vote', urls[1])]:
+            with CaptureQueriesContext(connection) as queries:
+                client.post(url)
+
+            results[f'queries per vote ({outcome})'] = count_queries(queries)
+
+        # throughput, every client casts votes for its own users
+        def run_client(index):
+            latencies, errors = [], 0
+            client_users = users[index * args.votes:(index + 1) * args.votes]
+
+            for n, user in enumerate(client_users):
+                with Timer() as timer:
+                    response = Client(raise_request_exception=False).post(urls[n % len(urls)], HTTP_AUTHORIZATION=f'Token {user.auth_token.key}')
+
+                latencies.append(timer.elapsed)
+                errors += response.status_code >= 400
+
+            connection.close()
+            return latencies, errors
+
+        with Timer() as wall, ThreadPoolExecutor(max_workers=args.clients) as pool:
+            runs = list(pool.map(run_client, range(args.clients)))
+
+        latencies = [latency for run, _ in runs for latency in run]
+        errors = sum(errors for _, errors in runs)
+
+        results['concurrent votes'] = {
+            'clients': args.clients,
+            'votes': len(latencies),
+            'errors': errors,
+            'votes_per_sec': len(latencies) / wall.elapsed,
+            **percentiles(latencies),
+        }
+
+        poll.refresh_from_db()
+        results['concurrent votes']['counted_votes'] = poll.total_votes
+
+    report(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Shared scaffolding for the benchmark scripts.
+
+Run the scripts from the repository root as modules, e.g.
+
+    python -m benchmarks.bench_votes
+
+Each script works on a throwaway database created the same way as the test
+database (a file next to the project for SQLite, so that concurrent clients
+each get their own connection to it). The development database is never
+touched.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pollsAppApi.settings')
+
+    import django
+    django.setup()
+
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+
+def argument_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+
+    return parser
+
+
+@contextmanager
+def benchmark_database():
+    """Create a fresh test database for the duration of the block"""
+    from django.db import connection
+
+    if connection.vendor == 'sqlite':
+        # a file rather than the shared in-memory database, so every thread
+        # works with a real connection of its own, like separate workers would
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(prefix='polls-bench-'), 'bench.sqlite3')
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def create_users(count, prefix='bench'):
+    """Bulk create users with a shared password hash and an auth token each"""
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+
+    password = make_password('bench-password')
+
+    users = User.objects.bulk_create(
+        User(username=f'{prefix}{i}', email=f'{prefix}{i}@bench.test', password=password)
+        for i in range(count)
+    )
+
+    # bulk_create does not return the ids on every backend
+    users = list(User.objects.filter(username__startswith=prefix).order_by('id'))
+    Token.objects.bulk_create(Token(key=Token.generate_key(), user=user) for user in users)
+
+    return list(User.objects.filter(pk__in=[u.pk for u in users]).select_related('auth_token').order_by('id'))
+
+
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def count_queries(captured):
+    """
+    Count captured statements as {'queries': ..., 'statements': ...}:
+    queries leave out transaction control (BEGIN, COMMIT, savepoints), statements include them
+    """
+    statements = [q['sql'] for q in captured]
+    queries = [sql for sql in statements if not sql.upper().startswith(TRANSACTION_CONTROL)]
+
+    return {'queries': len(queries), 'statements': len(statements)}
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return {}
+
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': pick(0.50),
+        'p90_ms': pick(0.90),
+        'p99_ms': pick(0.99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def report(results, as_json=False):
+    if as_json:
+        json.dump(results, sys.stdout, indent=2, default=str)
+        sys.stdout.write('\n')
+        return
+
+    for name, values in results.items():
+        print(name)
+
+        if isinstance(values, dict):
+            for key, value in values.items():
+                print(f'    {key:<24} {value:.2f}' if isinstance(value, float) else f'    {key:<24} {value}')
+        else:
+            print(f'    {values}')
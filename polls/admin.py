@@ -1,6 +1,18 @@
 from django.contrib import admin
 from .models import Poll, Choice, Vote
+from . import services
+
+
+class VoteAdmin(admin.ModelAdmin):
+    """Deleting votes here takes them off the vote counters"""
+
+    def delete_model(self, request, obj):
+        services.delete_votes(Vote.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        services.delete_votes(queryset)
+
 
 admin.site.register(Poll)
 admin.site.register(Choice)
-admin.site.register(Vote)
+admin.site.register(Vote, VoteAdmin)
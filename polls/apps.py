@@ -1,6 +1,34 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
 
 
 class PollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from rest_framework.authtoken.models import Token
+
+        from .authentication import evict_token, evict_user
+        from .db import configure_sqlite
+        from .models import Poll
+        from .ownership import poll_deleted, poll_saved
+        from .services import voter_deleted
+
+        connection_created.connect(configure_sqlite, dispatch_uid='polls.configure_sqlite')
+
+        # keep the token cache in step with token rotation and user changes
+        User = get_user_model()
+        post_save.connect(evict_token, sender=Token, dispatch_uid='polls.evict_token_saved')
+        post_delete.connect(evict_token, sender=Token, dispatch_uid='polls.evict_token_deleted')
+        post_save.connect(evict_user, sender=User, dispatch_uid='polls.evict_user_saved')
+        post_delete.connect(evict_user, sender=User, dispatch_uid='polls.evict_user_deleted')
+
+        # the votes of a deleted user cascade away, take them off the vote counters
+        pre_delete.connect(voter_deleted, sender=User, dispatch_uid='polls.voter_deleted')
+
+        # keep the cached poll ownership sets in step with poll creation and deletion
+        post_save.connect(poll_saved, sender=Poll, dispatch_uid='polls.ownership_poll_saved')
+        post_delete.connect(poll_deleted, sender=Poll, dispatch_uid='polls.ownership_poll_deleted')
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from . import async_views
+
+# ASGI-native endpoints, mounted under /api/async/ (see polls.async_views)
+urlpatterns = [
+    path('polls/', async_views.poll_list, name='async-polls-list'),
+    path('polls/<uuid:pk>/', async_views.poll_detail, name='async-polls-detail'),
+    path('polls/<uuid:pk>/results/', async_views.poll_results, name='async-polls-results'),
+    path('polls/<uuid:poll_pk>/choices/<uuid:choice_pk>/vote/', async_views.create_vote, name='async-create-vote'),
+]
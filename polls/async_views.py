@@ -0,0 +1,189 @@
+"""
+ASGI-native variants of the poll read endpoints and of casting a vote,
+mounted under /api/async/ (see polls.async_urls).
+
+Under ASGI the DRF views run in a worker thread per request; these views run
+on the event loop and only go to the database through the async ORM. They
+answer with the same payloads as their DRF counterparts and share their
+response cache, but authenticate with tokens only (polls.authentication.aauthenticate).
+The poll list is keyset paginated over (pub_date, id) like PollCursorPagination,
+with forward-only `?cursor=` links.
+"""
+import base64
+import functools
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+
+from .authentication import CachedTokenAuthentication, aauthenticate
+from .cache import acached_poll_response
+from .models import Poll, Choice
+from .pagination import PollCursorPagination
+from .querysets import optimize_for_serializer
+from .renderers import FastJSONRenderer
+from .results import aget_results
+from .serializers import PollSerializer, VoteSerializer
+from . import services
+from . import vote_buffer
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, headers=headers, content_type='application/json')
+
+
+def error_response(exc):
+    headers = None
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers = {'WWW-Authenticate': CachedTokenAuthentication.keyword}
+
+    return json_response({'detail': exc.detail}, status=exc.status_code, headers=headers)
+
+
+def async_api_view(methods):
+    """
+    Turn an async function into a token authenticated JSON view:
+    other methods get a 405, anonymous requests a 401 and APIExceptions
+    are rendered like DRF does
+    """
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+
+                auth = await aauthenticate(request)
+                if auth is None:
+                    raise exceptions.NotAuthenticated()
+
+                request.user, request.auth = auth
+
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return error_response(exc)
+
+        return wrapper
+
+    return decorator
+
+
+def poll_queryset():
+    return optimize_for_serializer(Poll.objects.all(), PollSerializer)
+
+
+def encode_cursor(poll):
+    position = f'{poll.pub_date.isoformat()}|{poll.id}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        pub_date, poll_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        pub_date = parse_datetime(pub_date)
+        poll_id = uuid.UUID(poll_id)
+    except (ValueError, UnicodeError):
+        pub_date = None
+
+    if pub_date is None:
+        raise exceptions.NotFound('Invalid cursor')
+
+    return pub_date, poll_id
+
+
+def get_page_size(request):
+    pagination = PollCursorPagination
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE') or pagination.max_page_size
+
+    try:
+        requested = int(request.GET[pagination.page_size_query_param])
+    except (KeyError, ValueError):
+        return page_size
+
+    return min(requested, pagination.max_page_size) if requested > 0 else page_size
+
+
+@async_api_view(['GET', 'HEAD'])
+async def poll_list(request):
+    """Newest polls first, same payload as PollViewSets.list but forward-only links"""
+    page_size = get_page_size(request)
+    queryset = poll_queryset().order_by(*PollCursorPagination.ordering)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        pub_date, poll_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=poll_id))
+
+    polls = [poll async for poll in queryset[:page_size + 1]]
+
+    next_url = None
+    if len(polls) > page_size:
+        polls = polls[:page_size]
+        query = request.GET.copy()
+        query['cursor'] = encode_cursor(polls[-1])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    return json_response({
+        'next': next_url,
+        'results': PollSerializer(polls, many=True).data,
+    })
+
+
+@async_api_view(['GET', 'HEAD'])
+async def poll_detail(request, pk):
+    async def build():
+        try:
+            poll = await poll_queryset().aget(pk=pk)
+        except Poll.DoesNotExist:
+            raise exceptions.NotFound('No Poll matches the given query.')
+
+        return PollSerializer(poll).data, poll.modified_date
+
+    return await acached_poll_response(request, pk, 'detail', build)
+
+
+@async_api_view(['GET', 'HEAD'])
+async def poll_results(request, pk):
+    async def build():
+        results = await aget_results([pk])
+
+        if pk not in results:
+            raise exceptions.NotFound('No Poll matches the given query.')
+
+        return results[pk]
+
+    return await acached_poll_response(request, pk, 'results', build)
+
+
+@async_api_view(['POST'])
+async def create_vote(request, poll_pk, choice_pk):
+    """
+    Cast the vote like CreateVote does; the vote itself is written by the
+    (transactional, synchronous) vote service in a worker thread
+    """
+    if vote_buffer.is_enabled():
+        if not await Choice.objects.filter(pk=choice_pk, poll_id=poll_pk, poll__deleted_at__isnull=True).aexists():
+            raise exceptions.NotFound('No such choice in this poll.')
+
+        try:
+            await sync_to_async(vote_buffer.get_vote_buffer().put)(poll_pk, request.user.pk, choice_pk)
+        except vote_buffer.BufferFull:
+            pass
+        else:
+            return json_response({"details": "vote accepted"}, status=status.HTTP_202_ACCEPTED)
+
+    try:
+        vote, outcome = await sync_to_async(services.cast_vote)(poll_pk, choice_pk, request.user.pk)
+    except Choice.DoesNotExist:
+        raise exceptions.NotFound('No such choice in this poll.')
+
+    if outcome == services.VOTE_UNCHANGED:
+        return json_response({"details": "vote already exists"})
+
+    return json_response(VoteSerializer(vote).data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,217 @@
+"""
+Token authentication with an in-process cache of token -> user lookups.
+
+DRF's TokenAuthentication joins the token and user tables on every request.
+CachedTokenAuthentication keeps the result of that lookup in a bounded LRU
+cache for POLLS_TOKEN_CACHE['TTL'] seconds. Deleting a token (logout, token
+rotation) or saving/deleting its user evicts the entry through model signals
+in this process; other processes pick the change up once the entry expires,
+so the TTL bounds how long a revoked token can still be used.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_TOKEN_CACHE', {})}
+
+
+class TokenCache:
+    """Bounded, thread safe LRU cache of token key -> (user, token) with a TTL"""
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._lock = threading.Lock()
+        # bumped by every eviction, see set()
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, user, token, generation=None):
+        """
+        Cache a lookup. With the `generation` read before the lookup started, the entry is
+        dropped when an eviction happened in between (it may be the eviction of this very token)
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl, (user, token))
+            self._user_keys.setdefault(user.pk, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def evict(self, key):
+        with self._lock:
+            self.generation += 1
+            self._remove(key)
+
+    def evict_user(self, user_id):
+        with self._lock:
+            self.generation += 1
+            for key in list(self._user_keys.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        user_id = entry[1][0].pk
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_config()
+                _cache = TokenCache(config['MAX_SIZE'], config['TTL'])
+
+    return _cache
+
+
+def reset_token_cache():
+    """Drop the cache, the next lookup creates it again from the current settings"""
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+
+
+def stats():
+    return get_token_cache().stats()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that caches the token -> user lookup"""
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        generation = cache.generation
+        user, token = super().authenticate_credentials(key)
+        cache.set(key, user, token, generation)
+
+        return user, token
+
+
+async def aauthenticate(request):
+    """
+    Token authentication for the async views (polls.async_views): the same
+    header, cache and errors as CachedTokenAuthentication, with the async ORM.
+    Returns (user, token), or None when the request has no token.
+    """
+    keyword = CachedTokenAuthentication.keyword
+    auth = get_authorization_header(request).split()
+
+    if not auth or auth[0].lower() != keyword.lower().encode():
+        return None
+
+    if len(auth) == 1:
+        raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+    if len(auth) > 2:
+        raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed(
+            _('Invalid token header. Token string should not contain invalid characters.')
+        )
+
+    cache = get_token_cache()
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    generation = cache.generation
+
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+    cache.set(key, token.user, token, generation)
+
+    return token.user, token
+
+
+def evict_token(sender, instance, **kwargs):
+    get_token_cache().evict(instance.key)
+
+
+def evict_user(sender, instance, **kwargs):
+    get_token_cache().evict_user(instance.pk)
@@ -0,0 +1,168 @@
+"""
+Versioned response cache for poll reads.
+
+Every poll owns a version number stored in the cache. Cached responses are
+keyed by (poll id, version, variant), so bumping the version after a write
+makes every cached response of that poll unreachable at once; the stale
+entries simply expire. Works with any Django cache backend.
+
+Cache entries are built from the primary database: a replica lagging behind
+a write would otherwise get its stale copy cached under the new version.
+
+Responses carry an ETag derived from the version and a Last-Modified header
+taken from `Poll.modified_date`, and conditional requests are answered with
+`304 Not Modified` without touching the database.
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .db_routers import read_from_primary
+from .renderers import FastJSONRenderer
+
+
+def get_cache():
+    return caches[getattr(settings, 'POLLS_RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'POLLS_RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def version_key(poll_id):
+    return f'polls:poll:{uuid.UUID(str(poll_id))}:version'
+
+
+def response_key(poll_id, version, variant):
+    return f'polls:poll:{uuid.UUID(str(poll_id))}:v{version}:{variant}'
+
+
+def new_version():
+    # Time based rather than starting from 1: if the version key gets evicted,
+    # the version it is recreated with can not collide with one that still has
+    # responses cached under it.
+    return time.time_ns()
+
+
+def get_poll_version(poll_id):
+    cache = get_cache()
+    key = version_key(poll_id)
+
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, new_version(), timeout=None)
+        version = cache.get(key)
+
+    return version
+
+
+async def aget_poll_version(poll_id):
+    """Async version of get_poll_version()"""
+    cache = get_cache()
+    key = version_key(poll_id)
+
+    version = await cache.aget(key)
+
+    if version is None:
+        await cache.aadd(key, new_version(), timeout=None)
+        version = await cache.aget(key)
+
+    return version
+
+
+def bump_poll_version(poll_id):
+    """Invalidate every cached response of the poll"""
+    cache = get_cache()
+    key = version_key(poll_id)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # key is missing (never read or evicted)
+        cache.set(key, new_version(), timeout=None)
+
+
+def make_etag(poll_id, version, variant):
+    digest = hashlib.md5(f'{poll_id}:{version}:{variant}'.encode(), usedforsecurity=False).hexdigest()
+
+    return f'W/"{digest}"'
+
+
+def cached_poll_response(request, poll_id, variant, build):
+    """
+    Return the (possibly conditional) response for a read of the poll.
+
+    `build()` is only called on a cache miss and must return a tuple of
+    (response data, last modified datetime). Exceptions raised by it (404s,
+    permission errors) propagate and nothing gets cached.
+    """
+    try:
+        # URL kwargs are plain strings, every spelling of the id must share one key
+        poll_id = uuid.UUID(str(poll_id))
+    except ValueError:
+        # not a poll id at all, let build() raise the 404
+        data, last_modified = build()
+        return Response(data)
+
+    cache = get_cache()
+    version = get_poll_version(poll_id)
+    key = response_key(poll_id, version, variant)
+
+    entry = cache.get(key)
+
+    if entry is None:
+        with read_from_primary():
+            entry = make_entry(poll_id, version, variant, *build())
+        cache.set(key, entry, timeout=get_timeout())
+
+    return conditional_response(request, entry, Response(entry['data']))
+
+
+async def acached_poll_response(request, poll_id, variant, abuild):
+    """
+    Async version of cached_poll_response() for the async views, sharing its
+    cache entries. `abuild` is a coroutine function, the response is rendered as JSON.
+    """
+    cache = get_cache()
+    version = await aget_poll_version(poll_id)
+    key = response_key(poll_id, version, variant)
+
+    entry = await cache.aget(key)
+
+    if entry is None:
+        with read_from_primary():
+            entry = make_entry(poll_id, version, variant, *(await abuild()))
+        await cache.aset(key, entry, timeout=get_timeout())
+
+    response = HttpResponse(FastJSONRenderer().render(entry['data']), content_type='application/json')
+
+    return conditional_response(request, entry, response)
+
+
+def make_entry(poll_id, version, variant, data, last_modified):
+    return {
+        'data': data,
+        'etag': make_etag(poll_id, version, variant),
+        'last_modified': int(last_modified.timestamp()),
+    }
+
+
+def conditional_response(request, entry, response):
+    """Add the validators of the cache entry, answer conditional requests with a 304"""
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+
+    return get_conditional_response(
+        request,
+        etag=entry['etag'],
+        last_modified=entry['last_modified'],
+        response=response
+    )
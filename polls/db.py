@@ -0,0 +1,49 @@
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply POLLS_SQLITE_PRAGMAS to each new SQLite connection
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = getattr(settings, 'POLLS_SQLITE_PRAGMAS', {})
+    for name, value in pragmas.items():
+        # an in-memory database (the test database) silently keeps its own
+        # journal mode, the other pragmas still apply
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    transaction.atomic() for a transaction that reads, then writes (vote
+    casting). On SQLite the outermost block begins with BEGIN IMMEDIATE: it
+    takes the write lock up front, waiting for it up to the busy timeout,
+    where a deferred transaction that writes after reading fails at once with
+    "database is locked" when another writer got in between. The other
+    transactions stay deferred, so reads never queue behind writers.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    # connecting sets transaction_mode from the settings again
+    connection.ensure_connection()
+    mode, connection.transaction_mode = connection.transaction_mode, 'IMMEDIATE'
+
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(transaction.atomic(using=using))
+        finally:
+            # only this BEGIN is immediate
+            connection.transaction_mode = mode
+
+        yield
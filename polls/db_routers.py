@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_use_replica = ContextVar('polls_use_replica', default=False)
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Route the reads made inside the block to the read replica
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Route the reads made inside the block to the primary, also within
+    read_from_replica(), for reads that must not lag behind the writes
+    """
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReadReplicaRouter:
+    """
+    Send reads to the 'replica' database inside read_from_replica(),
+    everything else (and every write) goes to 'default'
+    """
+    replica_alias = 'replica'
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and self.replica_alias in settings.DATABASES:
+            return self.replica_alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication
+        return db != self.replica_alias
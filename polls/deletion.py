@@ -0,0 +1,167 @@
+"""
+Poll deletion without loading the cascade.
+
+Deleting a poll through the ORM has Django's deletion Collector fetch its
+choices (and the votes too, as soon as anything listens to Vote deletions)
+and remove every vote of the poll in the request's transaction, holding the
+write lock for as long as that takes on a large poll. Instead delete_poll() only marks the poll deleted
+(Poll.deleted_at; Poll.objects hides it from then on) and purge_poll()
+removes its votes, then its choices, with set-based DELETEs of at most
+BATCH_SIZE rows, each batch in a short transaction of its own, and the poll
+row last.
+
+The purge runs right after the marking commits, or with ASYNC on a
+background thread while the request returns. Polls left marked by a restart
+are purged by `manage.py purge_deleted_polls`.
+"""
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.db.models.functions import Now
+
+from .models import Poll, Choice, Vote
+from .db import write_transaction
+from .ownership import forget_owned_polls
+from . import services
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ASYNC': False,
+    'BATCH_SIZE': 5000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_POLL_DELETION', {})}
+
+
+def delete_poll(poll_id, creator_id):
+    """
+    Mark the poll deleted and purge its rows once that commits, in the
+    background with ASYNC. Return False if there is no such poll.
+    """
+    with transaction.atomic():
+        if not Poll.objects.filter(pk=poll_id).update(deleted_at=Now()):
+            return False
+
+        services.invalidate_poll(poll_id)
+        transaction.on_commit(lambda: forget_owned_polls(creator_id))
+
+        if get_config()['ASYNC']:
+            transaction.on_commit(lambda: get_purger().submit(poll_id))
+        else:
+            transaction.on_commit(lambda: purge_poll(poll_id))
+
+    return True
+
+
+def _raw_delete(queryset):
+    """A plain DELETE of the queryset's rows: no Collector, nothing listens to these deletions"""
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def _delete_votes_batch(poll_id, batch_size):
+    """DELETE the next `batch_size` votes of the poll, in voter order, return the number deleted"""
+    votes = Vote.objects.filter(poll_id=poll_id)
+
+    # a range of the (poll, voter) unique index rather than a list of ids
+    last_voter = list(votes.order_by('voter_id').values_list('voter_id', flat=True)[batch_size - 1:batch_size])
+    if last_voter:
+        votes = votes.filter(voter_id__lte=last_voter[0])
+
+    return _raw_delete(votes)
+
+
+def purge_poll(poll_id, batch_size=None):
+    """
+    Remove a deleted poll with its votes and choices in batches.
+    Return the number of (votes, choices) removed.
+    """
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    votes = choices = 0
+
+    while True:
+        with write_transaction():
+            deleted = _delete_votes_batch(poll_id, batch_size)
+
+        votes += deleted
+        if deleted < batch_size:
+            break
+
+    while True:
+        with write_transaction():
+            ids = list(Choice.objects.filter(poll_id=poll_id).values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                # the poll row last, only if it was marked deleted
+                _raw_delete(Poll.all_objects.filter(pk=poll_id, deleted_at__isnull=False))
+                break
+
+            # a vote that raced the marking
+            votes += _raw_delete(Vote.objects.filter(choice_id__in=ids))
+            choices += _raw_delete(Choice.objects.filter(pk__in=ids))
+
+    return votes, choices
+
+
+def purge_deleted_polls(batch_size=None):
+    """Purge every poll marked deleted, return the number of polls purged"""
+    poll_ids = list(Poll.all_objects.filter(deleted_at__isnull=False).values_list('pk', flat=True))
+
+    for poll_id in poll_ids:
+        purge_poll(poll_id, batch_size)
+
+    return len(poll_ids)
+
+
+class Purger:
+    """Purge deleted polls one after the other on a background thread"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='poll-purge')
+
+    def submit(self, poll_id):
+        return self._executor.submit(self._purge, poll_id)
+
+    @staticmethod
+    def _purge(poll_id):
+        try:
+            votes, choices = purge_poll(poll_id)
+            logger.info('Purged poll %s: %d votes, %d choices', poll_id, votes, choices)
+        except Exception:
+            logger.exception('Purging poll %s failed, purge_deleted_polls will retry', poll_id)
+        finally:
+            close_old_connections()
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+_lock = threading.Lock()
+_purger = None
+
+
+def get_purger():
+    global _purger
+
+    if _purger is None:
+        with _lock:
+            if _purger is None:
+                _purger = Purger()
+
+                atexit.register(shutdown)
+
+    return _purger
+
+
+def shutdown():
+    global _purger
+
+    with _lock:
+        if _purger:
+            _purger.shutdown()
+            _purger = None
@@ -0,0 +1,137 @@
+"""
+Password hashing on a bounded pool of worker threads.
+
+Hashing a password (sign-up) or verifying one (login) costs hundreds of
+milliseconds of CPU with PBKDF2. The hashers below run that work on a small
+process wide pool (POLLS_PASSWORD_HASHING['WORKERS']) instead of the request
+thread, so however many sign-ups and logins arrive at once, at most WORKERS
+hashes compete with the rest of the API for the CPU. hashlib releases the
+GIL while hashing, so the pool threads really run in parallel.
+
+At most MAX_PENDING more requests wait for a worker; beyond that, or after
+waiting TIMEOUT seconds, the request fails fast with a 503 (HashingUnavailable).
+
+The hashers keep the algorithm names of Django's, so they read and write the
+same password hashes; list them in PASSWORD_HASHERS.
+"""
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+DEFAULTS = {
+    'WORKERS': 2,
+    'MAX_PENDING': 64,
+    'TIMEOUT': 10,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_PASSWORD_HASHING', {})}
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ups and logins at the moment, please retry shortly.'
+    default_code = 'hashing_unavailable'
+
+
+class HashingPool:
+    """A thread pool that refuses work once `workers + max_pending` jobs are in flight"""
+
+    def __init__(self, workers, max_pending, timeout):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hashing')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._local = threading.local()
+
+    def run(self, function, *args):
+        # a hasher calling itself (verify() -> encode()) is already on a worker
+        if getattr(self._local, 'worker', False):
+            return function(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingUnavailable()
+
+        try:
+            future = self._executor.submit(self._call, function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HashingUnavailable()
+
+    def _call(self, function, *args):
+        self._local.worker = True
+
+        try:
+            return function(*args)
+        finally:
+            # released before the caller gets the result
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_lock = threading.Lock()
+_pool = None
+
+
+def get_pool():
+    global _pool
+
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                config = get_config()
+                _pool = HashingPool(config['WORKERS'], config['MAX_PENDING'], config['TIMEOUT'])
+
+                atexit.register(shutdown)
+
+    return _pool
+
+
+def shutdown():
+    global _pool
+
+    with _lock:
+        if _pool:
+            _pool.shutdown()
+            _pool = None
+
+
+class PooledHasherMixin:
+    """Run encode() and verify() of a Django hasher on the hashing pool"""
+
+    def encode(self, *args, **kwargs):
+        return get_pool().run(lambda: super(PooledHasherMixin, self).encode(*args, **kwargs))
+
+    def verify(self, *args, **kwargs):
+        return get_pool().run(lambda: super(PooledHasherMixin, self).verify(*args, **kwargs))
+
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    pass
+
+
+class ScryptPasswordHasher(PooledHasherMixin, hashers.ScryptPasswordHasher):
+    """
+    scrypt with N=2**17, r=8, p=1, the first of OWASP's equivalent scrypt
+    settings. Django's (N=2**14, r=8, p=5) costs the same CPU but only needs
+    16 MiB; with p=1 a hash needs 128 MiB at once, which is what makes GPU
+    attacks expensive. It costs about as much CPU as 1,000,000 PBKDF2 rounds,
+    the pool bounds the memory to WORKERS * 128 MiB.
+    """
+    work_factor = 2 ** 17
+    block_size = 8
+    parallelism = 1
+    # 128 * r * N bytes plus OpenSSL's overhead, above its 32 MiB default
+    maxmem = 256 * 2 ** 20
@@ -0,0 +1,335 @@
+"""
+Per-request performance instrumentation (optional, POLLS_INSTRUMENTATION).
+
+InstrumentationMiddleware measures every request:
+
+  - db: number of SQL queries and the time spent in them, through an
+    execute wrapper on every database connection (record_query()),
+  - serialize: the time the DRF handler spends outside the database (the
+    handler starts after authentication and permissions, see
+    InstrumentedViewMixin), i.e. mostly building and serializing objects,
+  - render: turning the response data into bytes (renderers),
+  - total: the whole request as seen by the middleware.
+
+The numbers go out as a `Server-Timing` header (shown by browser dev tools),
+as one JSON log line per request on the `polls.instrumentation` logger, and
+into per-route histograms exposed in the Prometheus text format by
+views.RequestMetrics. The histograms are kept per process.
+
+When disabled the middleware removes itself at startup (MiddlewareNotUsed)
+and the view hooks cost one context variable lookup.
+
+The middleware is sync and async capable, so under ASGI the async views stay
+async. The metrics of a request live in a context variable, which
+sync_to_async carries over to the thread it runs the code in: the queries of
+the async ORM and of sync views under ASGI are counted as well.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SERVER_TIMING': True,
+    'LOG': True,
+    # seconds
+    'DURATION_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_BUCKETS': (0, 1, 2, 3, 5, 10, 20, 50, 100),
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_INSTRUMENTATION', {})}
+
+
+_current = ContextVar('polls_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one request spent where, in seconds"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = None
+        self.render = None
+        self.total = None
+        self._handler = None
+        self._render_start = None
+
+    def record_query(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def handler_started(self):
+        self._handler = (time.perf_counter(), self.db)
+
+    def handler_finished(self):
+        if self._handler is None:
+            return
+
+        start, db = self._handler
+        self.serialize = (time.perf_counter() - start) - (self.db - db)
+        self._handler = None
+
+    def render_started(self):
+        self._render_start = time.perf_counter()
+
+    def render_finished(self, response):
+        # post render callback of the template response
+        if self._render_start is not None:
+            self.render = time.perf_counter() - self._render_start
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+
+    def timings(self):
+        """{name: seconds} of the phases that were measured"""
+        phases = {'db': self.db, 'serialize': self.serialize, 'render': self.render, 'total': self.total}
+        return {name: value for name, value in phases.items() if value is not None}
+
+    def server_timing(self):
+        entries = []
+
+        for name, value in self.timings().items():
+            entry = f'{name};dur={value * 1000:.2f}'
+            if name == 'db':
+                entry += f';desc="{self.queries} queries"'
+            entries.append(entry)
+
+        return ', '.join(entries)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) per bucket, the last bound being +Inf"""
+        total = 0
+
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            total += count
+            yield bound, total
+
+
+METRICS = {
+    'polls_request_duration_seconds': 'Time spent handling the request',
+    'polls_request_db_seconds': 'Time spent in SQL queries per request',
+    'polls_request_serialize_seconds': 'Time the DRF handler spent outside the database per request',
+    'polls_request_render_seconds': 'Time spent rendering the response per request',
+    'polls_request_queries': 'SQL queries per request',
+}
+
+
+class Registry:
+    """Histograms per (metric, route, method), thread safe"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format"""
+        lines = []
+
+        with self._lock:
+            series = sorted(self._histograms.items())
+
+            for name, help_text in METRICS.items():
+                histograms = [(labels, histogram) for (metric, labels), histogram in series if metric == name]
+                if not histograms:
+                    continue
+
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+
+                for labels, histogram in histograms:
+                    label_text = ','.join(f'{key}="{escape_label(value)}"' for key, value in labels)
+
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append(f'{name}_bucket{{{label_text},le="{le}"}} {count}')
+
+                    lines.append(f'{name}_sum{{{label_text}}} {histogram.sum!r}')
+                    lines.append(f'{name}_count{{{label_text}}} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def route_name(request):
+    """A low cardinality name of the route: the URL name, never the URL itself"""
+    match = getattr(request, 'resolver_match', None)
+
+    if match is None:
+        return 'unmatched'
+
+    return match.view_name or match.route
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper of every connection: count the query for the current request, if any"""
+    metrics = _current.get()
+
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    return metrics.record_query(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    """connection_created receiver, also run for the connections open already"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class InstrumentationMiddleware:
+    """Measure every request, see the module docstring; put it first in MIDDLEWARE"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.config = get_config()
+
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+        connection_created.connect(install_query_recorder, dispatch_uid='polls.install_query_recorder')
+        for connection in connections.all():
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        metrics.finish()
+        self.report(request, response, metrics)
+
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        metrics.finish()
+        self.report(request, response, metrics)
+
+        return response
+
+    def process_template_response(self, request, response):
+        # runs right before the (DRF) response is rendered, being the first middleware
+        metrics = _current.get()
+
+        if metrics is not None:
+            metrics.render_started()
+            response.add_post_render_callback(metrics.render_finished)
+
+        return response
+
+    def report(self, request, response, metrics):
+        route = route_name(request)
+        labels = (('method', request.method), ('route', route))
+        durations = self.config['DURATION_BUCKETS']
+
+        for name, value in metrics.timings().items():
+            metric = 'polls_request_duration_seconds' if name == 'total' else f'polls_request_{name}_seconds'
+            registry.observe(metric, labels, value, durations)
+
+        registry.observe('polls_request_queries', labels, metrics.queries, self.config['QUERY_BUCKETS'])
+
+        if self.config['SERVER_TIMING']:
+            response['Server-Timing'] = metrics.server_timing()
+
+        if self.config['LOG']:
+            logger.info(json.dumps({
+                'method': request.method,
+                'route': route,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': metrics.queries,
+                **{f'{name}_ms': round(value * 1000, 3) for name, value in metrics.timings().items()},
+            }))
+
+
+class InstrumentedViewMixin:
+    """Mark the start and end of the DRF handler for the instrumentation middleware"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.handler_started()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.handler_finished()
+
+        return super().finalize_response(request, response, *args, **kwargs)
+
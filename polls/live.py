@@ -0,0 +1,412 @@
+"""
+Live poll results for the Server-Sent Events stream (views.ResultsStream).
+
+Writes to a poll publish a "poll changed" notification once their
+transaction commits (services.invalidate_poll). The notifications reach the
+LiveResultsHub of every process through a pluggable backend
+(POLLS_LIVE_RESULTS['BACKEND']):
+
+  - MemoryBackend delivers them inside the process (single process
+    deployments, tests),
+  - CacheVersionBackend notices them through the poll versions kept in the
+    response cache (polls.cache), which works across processes and hosts as
+    long as that cache is shared (Redis, Memcached, database cache).
+
+The hub keeps one feed per poll with subscribers. At most MAX_RATE times per
+second it recomputes the results of the changed polls, all of them with a
+single query, diffs them against the last results and hands the delta to
+every subscriber of the poll: N subscribers cost one computation. Deltas a
+subscriber has not picked up yet are merged, so slow clients receive the
+latest counts rather than a backlog.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'polls.live.MemoryBackend',
+    'MAX_RATE': 2,
+    'HEARTBEAT': 15,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_LIVE_RESULTS', {})}
+
+
+def diff_results(old, new):
+    """
+    Delta between two results payloads (see results.build_results): the new
+    total, the choices that are new or whose body or votes changed, and the
+    ids of the choices that are gone. None when nothing changed.
+    """
+    def state(choice):
+        return choice['body'], choice['votes']
+
+    old_choices = {choice['id']: state(choice) for choice in old['choices']} if old else {}
+    new_ids = {choice['id'] for choice in new['choices']}
+
+    changed = [choice for choice in new['choices'] if old_choices.get(choice['id']) != state(choice)]
+    removed = [choice_id for choice_id in old_choices if choice_id not in new_ids]
+
+    if old and not changed and not removed and old['total_votes'] == new['total_votes']:
+        return None
+
+    return {
+        'poll': new['poll'],
+        'total_votes': new['total_votes'],
+        'choices': changed,
+        'removed': removed,
+    }
+
+
+def merge_deltas(pending, delta):
+    """Fold `delta` into the delta a subscriber has not received yet"""
+    if pending is None:
+        return delta
+
+    choices = {choice['id']: choice for choice in pending['choices']}
+    removed = set(pending['removed'])
+
+    for choice_id in delta['removed']:
+        choices.pop(choice_id, None)
+        removed.add(choice_id)
+
+    for choice in delta['choices']:
+        choices[choice['id']] = choice
+        removed.discard(choice['id'])
+
+    return {
+        'poll': delta['poll'],
+        'total_votes': delta['total_votes'],
+        'choices': list(choices.values()),
+        'removed': sorted(removed),
+    }
+
+
+class Subscription:
+    """The updates of one poll for one client"""
+
+    def __init__(self, poll_id):
+        self.poll_id = poll_id
+        self.closed = False
+        self._pending = None
+        self._condition = threading.Condition()
+        # (event loop, asyncio.Event) of the aget() calls waiting
+        self._waiters = set()
+
+    def push(self, delta):
+        with self._condition:
+            self._pending = merge_deltas(self._pending, delta)
+            self._condition.notify()
+            self._wake_waiters()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        # called by the hub thread, the events belong to the event loops
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the loop is closed
+                pass
+
+    def get(self, timeout=None):
+        """Wait for the next delta, None on timeout or once closed"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is not None or self.closed, timeout)
+
+            delta, self._pending = self._pending, None
+            return delta
+
+    async def aget(self, timeout=None):
+        """get() for async code: waits on the event loop instead of blocking a thread"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+
+        with self._condition:
+            if self._pending is None and not self.closed:
+                self._waiters.add(waiter)
+            else:
+                waiter[1].set()
+
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            # not the builtin TimeoutError before Python 3.11
+            pass
+        finally:
+            with self._condition:
+                self._waiters.discard(waiter)
+
+        with self._condition:
+            delta, self._pending = self._pending, None
+            return delta
+
+
+class BaseBackend:
+    """Carries "poll changed" notifications to the hubs listening to it"""
+
+    # whether the hub has to ask for changes with poll() instead of being notified
+    polling = False
+
+    def __init__(self):
+        self.listeners = []
+
+    def listen(self, callback):
+        self.listeners.append(callback)
+
+    def unlisten(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def publish(self, poll_id):
+        raise NotImplementedError
+
+    def poll(self, poll_ids):
+        """Return the ids among `poll_ids` that changed since the last call"""
+        return set()
+
+
+class MemoryBackend(BaseBackend):
+    """Notifications within this process"""
+
+    def publish(self, poll_id):
+        for callback in list(self.listeners):
+            callback(poll_id)
+
+
+class CacheVersionBackend(BaseBackend):
+    """
+    Notice changes through the poll versions of the response cache, which every
+    write bumps already: one get_many() per tick for all the watched polls
+    """
+    polling = True
+
+    def __init__(self):
+        super().__init__()
+        self._versions = {}
+
+    def publish(self, poll_id):
+        # services.invalidate_poll has bumped the version
+        pass
+
+    def poll(self, poll_ids):
+        from .cache import get_cache, version_key
+
+        keys = {version_key(poll_id): poll_id for poll_id in poll_ids}
+        versions = get_cache().get_many(list(keys))
+
+        changed = set()
+        for key, poll_id in keys.items():
+            version = versions.get(key)
+            if poll_id in self._versions and self._versions[poll_id] != version:
+                changed.add(poll_id)
+            self._versions[poll_id] = version
+
+        for poll_id in set(self._versions) - set(poll_ids):
+            del self._versions[poll_id]
+
+        return changed
+
+
+class Feed:
+    def __init__(self):
+        self.subscribers = set()
+        self.results = None
+
+
+class LiveResultsHub:
+    """
+    Fan-out of result updates to the subscribers of each poll.
+
+    `refresh()` sends the updates of the polls changed so far synchronously;
+    `start()` runs it from a daemon thread at most `max_rate` times per second.
+    """
+
+    def __init__(self, backend=None, max_rate=2):
+        self.backend = backend or get_backend()
+        self.interval = 1 / max_rate
+
+        self._feeds = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.backend.listen(self.notify)
+
+    def subscribe(self, poll_id):
+        subscription = Subscription(uuid.UUID(str(poll_id)))
+        poll_id = subscription.poll_id
+
+        with self._lock:
+            self._feeds.setdefault(poll_id, Feed()).subscribers.add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            feed = self._feeds.get(subscription.poll_id)
+
+            if feed:
+                feed.subscribers.discard(subscription)
+                if not feed.subscribers:
+                    del self._feeds[subscription.poll_id]
+
+    def prime(self, poll_id, results):
+        """Results the first delta of a new feed is computed against"""
+        poll_id = uuid.UUID(str(poll_id))
+
+        with self._lock:
+            feed = self._feeds.get(poll_id)
+            if feed and feed.results is None:
+                feed.results = results
+
+    def notify(self, poll_id):
+        poll_id = uuid.UUID(str(poll_id))
+
+        with self._lock:
+            if poll_id not in self._feeds:
+                return
+
+            self._dirty.add(poll_id)
+
+        self._wake.set()
+
+    def refresh(self):
+        """Send the updates of the changed polls, return the number of polls refreshed"""
+        from .results import get_results
+
+        with self._lock:
+            watched = set(self._feeds)
+            dirty, self._dirty = self._dirty & watched, set()
+
+        if self.backend.polling and watched:
+            dirty |= self.backend.poll(watched)
+
+        if not dirty:
+            return 0
+
+        results = get_results(dirty)
+
+        with self._lock:
+            for poll_id in dirty:
+                feed = self._feeds.get(poll_id)
+                if feed is None:
+                    continue
+
+                if poll_id not in results:
+                    # the poll is gone
+                    for subscription in feed.subscribers:
+                        subscription.close()
+                    continue
+
+                new = results[poll_id][0]
+                delta = diff_results(feed.results, new)
+                feed.results = new
+
+                if delta is not None:
+                    for subscription in feed.subscribers:
+                        subscription.push(delta)
+
+        return len(dirty)
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval if self.backend.polling else None)
+            self._wake.clear()
+
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Refreshing live results failed')
+                connection.close()
+            finally:
+                close_old_connections()
+
+            # updates arriving meanwhile are coalesced into the next refresh
+            self._stop.wait(self.interval)
+
+        connection.close()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='live-results', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def close(self):
+        """Stop the thread and detach from the backend"""
+        self.stop()
+        self.backend.unlisten(self.notify)
+
+
+# process wide backend and hub
+
+_lock = threading.Lock()
+_backend = None
+_hub = None
+
+
+def get_backend():
+    global _backend
+
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = import_string(get_config()['BACKEND'])()
+
+    return _backend
+
+
+def get_hub():
+    """Return the hub of this process, starting its thread on first use"""
+    global _hub
+
+    if _hub is None:
+        backend = get_backend()
+
+        with _lock:
+            if _hub is None:
+                hub = LiveResultsHub(backend, max_rate=get_config()['MAX_RATE'])
+                hub.start()
+                _hub = hub
+
+                atexit.register(shutdown)
+
+    return _hub
+
+
+def shutdown():
+    global _hub
+
+    with _lock:
+        if _hub:
+            _hub.close()
+            _hub = None
+
+
+def publish(poll_id):
+    """Tell the hubs that the poll changed (called once the write has committed)"""
+    get_backend().publish(poll_id)
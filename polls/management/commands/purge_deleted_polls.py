@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from polls.deletion import purge_deleted_polls
+
+
+class Command(BaseCommand):
+    help = 'Remove the polls marked deleted, with their choices and votes, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help="Rows per DELETE (default POLLS_POLL_DELETION['BATCH_SIZE'])"
+        )
+
+    def handle(self, *args, **options):
+        polls = purge_deleted_polls(options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {polls} deleted poll(s)'))
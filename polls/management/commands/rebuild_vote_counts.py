@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from polls.services import rebuild_vote_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Choice.vote_count and Poll.total_votes from the Vote table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll',
+            action='append',
+            dest='polls',
+            metavar='POLL_ID',
+            help='Only rebuild the given poll (can be repeated)'
+        )
+
+    def handle(self, *args, **options):
+        polls, choices = rebuild_vote_counters(options['polls'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt vote counters for {polls} poll(s) and {choices} choice(s)')
+        )
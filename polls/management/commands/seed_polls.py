@@ -0,0 +1,157 @@
+import itertools
+import random
+import time
+import uuid
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from polls.models import Poll, Choice, Vote
+
+
+def split(total, weights, rng):
+    """Deal `total` items out over len(weights) buckets, proportionally to the weights on average"""
+    if not weights or total <= 0:
+        return [0] * len(weights)
+
+    counts = Counter(rng.choices(range(len(weights)), weights=weights, k=total))
+    return [counts[i] for i in range(len(weights))]
+
+
+def votes_per_poll(votes, polls, hot_polls, hot_share, skew, voters, rng):
+    """
+    Votes of every poll: `hot_share` of them on the first `hot_polls` polls,
+    the rest over all polls with a Zipf-like popularity (`skew` 0 is uniform).
+    A poll gets at most one vote per voter.
+    """
+    hot_polls = min(hot_polls, polls)
+    hot_votes = int(votes * hot_share) if hot_polls else 0
+
+    counts = split(votes - hot_votes, [1 / (rank + 1) ** skew for rank in range(polls)], rng)
+
+    for i in range(hot_polls):
+        counts[i] += hot_votes // hot_polls + (1 if i < hot_votes % hot_polls else 0)
+
+    return [min(count, voters) for count in counts]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with generated users, polls, choices and votes for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='users to create (default 1000)')
+        parser.add_argument('--polls', type=int, default=10000, help='polls to create (default 10000)')
+        parser.add_argument('--choices', type=int, default=4, help='choices per poll (default 4)')
+        parser.add_argument('--votes', type=int, default=100000, help='votes to cast (default 100000)')
+        parser.add_argument('--hot-polls', type=int, default=10, help='polls receiving HOT_SHARE of the votes (default 10)')
+        parser.add_argument('--hot-share', type=float, default=0.5, help='share of the votes on the hot polls (default 0.5)')
+        parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of the other votes over the polls, 0 for uniform (default 1)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows per INSERT (default 5000)')
+        parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed generates the same data')
+        parser.add_argument('--prefix', default='seed', help='username prefix of the generated users (default "seed")')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['choices'] < 1:
+            raise CommandError('At least one user and one choice per poll are needed.')
+
+        if not 0 <= options['hot_share'] <= 1:
+            raise CommandError('--hot-share must be between 0 and 1.')
+
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named "{prefix}..." exist already, pick another --prefix.')
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        user_ids = self.seed_users(options['users'], prefix)
+
+        poll_votes = votes_per_poll(
+            options['votes'], options['polls'], options['hot_polls'], options['hot_share'], options['skew'],
+            len(user_ids), self.rng
+        )
+        choice_votes = [split(count, [1] * options['choices'], self.rng) for count in poll_votes]
+
+        if sum(poll_votes) < options['votes']:
+            self.stdout.write(self.style.WARNING(
+                f'Only {sum(poll_votes)} votes fit: a poll gets at most one vote per user, add --users.'
+            ))
+
+        poll_ids = self.seed_polls(user_ids, poll_votes)
+        choice_ids = self.seed_choices(poll_ids, choice_votes)
+        self.seed_votes(user_ids, poll_ids, choice_ids, choice_votes)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(user_ids)} users, {len(poll_ids)} polls and {sum(poll_votes)} votes'
+        ))
+
+    def insert(self, label, model, objects):
+        """bulk_create a generator of objects in batches, in one transaction"""
+        start = time.perf_counter()
+        objects = iter(objects)
+        rows = 0
+
+        with transaction.atomic():
+            # slices of the generator, the objects are never all in memory
+            while batch := list(itertools.islice(objects, self.batch_size)):
+                model.objects.bulk_create(batch)
+                rows += len(batch)
+
+        self.stdout.write(f'{label:<8} {rows:>10} rows in {time.perf_counter() - start:.2f}s')
+
+    def seed_users(self, count, prefix):
+        # one hash for everybody, hashing a password per user would take hours
+        password = make_password(f'{prefix}-password')
+
+        self.insert('users', User, (
+            User(username=f'{prefix}{i}', email=f'{prefix}{i}@seed.test', password=password) for i in range(count)
+        ))
+
+        # bulk_create does not return the ids on every backend
+        user_ids = list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+        self.insert('tokens', Token, (Token(key=Token.generate_key(), user_id=user_id) for user_id in user_ids))
+
+        return user_ids
+
+    def seed_polls(self, user_ids, poll_votes):
+        poll_ids = [uuid.UUID(int=self.rng.getrandbits(128), version=4) for _ in poll_votes]
+
+        self.insert('polls', Poll, (
+            Poll(
+                id=poll_id,
+                question=f'Seeded poll {i}: which option do you prefer?',
+                creator_id=self.rng.choice(user_ids),
+                total_votes=votes
+            )
+            for i, (poll_id, votes) in enumerate(zip(poll_ids, poll_votes))
+        ))
+
+        return poll_ids
+
+    def seed_choices(self, poll_ids, choice_votes):
+        choice_ids = [[uuid.UUID(int=self.rng.getrandbits(128), version=4) for _ in counts] for counts in choice_votes]
+
+        self.insert('choices', Choice, (
+            Choice(id=choice_id, poll_id=poll_id, body=f'Option {i}', vote_count=votes)
+            for poll_id, ids, counts in zip(poll_ids, choice_ids, choice_votes)
+            for i, (choice_id, votes) in enumerate(zip(ids, counts))
+        ))
+
+        return choice_ids
+
+    def seed_votes(self, user_ids, poll_ids, choice_ids, choice_votes):
+        def votes():
+            for poll_id, ids, counts in zip(poll_ids, choice_ids, choice_votes):
+                # distinct voters per poll (unique_vote_per_poll_voter)
+                voters = iter(self.rng.sample(user_ids, sum(counts)))
+
+                for choice_id, count in zip(ids, counts):
+                    for voter_id in itertools.islice(voters, count):
+                        vote_id = uuid.UUID(int=self.rng.getrandbits(128), version=4)
+                        yield Vote(id=vote_id, poll_id=poll_id, choice_id=choice_id, voter_id=voter_id)
+
+        self.insert('votes', Vote, votes())
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_vote_counters(apps, schema_editor):
+    """Backfill the new counters from the existing Vote rows"""
+    Poll = apps.get_model('polls', 'Poll')
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+
+    choice_votes = Vote.objects.filter(choice=OuterRef('pk')).order_by().values('choice').annotate(n=Count('pk')).values('n')
+    poll_votes = Vote.objects.filter(poll=OuterRef('pk')).order_by().values('poll').annotate(n=Count('pk')).values('n')
+
+    Choice.objects.update(vote_count=Coalesce(Subquery(choice_votes), 0))
+    Poll.objects.update(total_votes=Coalesce(Subquery(poll_votes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Vote Count'),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='total_votes',
+            field=models.PositiveIntegerField(default=0, verbose_name='Total Votes'),
+        ),
+        migrations.RunPython(populate_vote_counters, migrations.RunPython.noop),
+    ]
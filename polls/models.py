@@ -2,33 +2,83 @@ from django.db import models
 from django.contrib.auth.models import User
 import uuid
 
+
+class PollManager(models.Manager):
+    """The polls that are not deleted, see polls.deletion"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Poll(models.Model):
     id = models.UUIDField(default=uuid.uuid4, primary_key=True)
     question = models.CharField(max_length=200, verbose_name='Poll Question', help_text='Enter the poll question')
-    creator = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='polls')
+    # indexed by poll_creator_id_idx below
+    creator = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='polls', db_index=False)
     pub_date = models.DateTimeField(auto_now_add=True, verbose_name='Publishded Date and Time')
     modified_date = models.DateTimeField(auto_now=True, verbose_name='Last modified Date Time')
 
+    # denormalized counter, kept in sync by polls.services
+    total_votes = models.PositiveIntegerField(default=0, verbose_name='Total Votes')
+
+    # set when the poll is deleted, its rows are purged afterwards (polls.deletion)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = PollManager()
+    # deleted polls included
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the polls list (polls.pagination.PollCursorPagination)
+            models.Index(fields=['pub_date', 'id'], name='poll_pub_date_id_idx'),
+
+            # polls of a user and "does the user own this poll" checks, covering for both
+            models.Index(fields=['creator', 'id'], name='poll_creator_id_idx'),
+
+            # deleted polls still to purge, only those rows are indexed
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='poll_deleted_at_idx'),
+        ]
+
     def __str__(self):
         return self.question
     
 
 class Choice(models.Model): 
     id = models.UUIDField(default=uuid.uuid4, primary_key=True)
-    poll = models.ForeignKey(to=Poll, on_delete=models.CASCADE, related_name='choices')
+    # indexed by choice_poll_id_idx below
+    poll = models.ForeignKey(to=Poll, on_delete=models.CASCADE, related_name='choices', db_index=False)
     body = models.CharField(max_length=100, verbose_name='Choice Text')
 
+    # denormalized counter, kept in sync by polls.services
+    vote_count = models.PositiveIntegerField(default=0, verbose_name='Vote Count')
+
+    class Meta:
+        indexes = [
+            # choices of a poll (nested serialization, results, cascades) and their keyset pagination
+            models.Index(fields=['poll', 'id'], name='choice_poll_id_idx'),
+        ]
+
     def __str__(self): 
         return self.body
 
 class Vote(models.Model): 
     id = models.UUIDField(default=uuid.uuid4, primary_key=True)
-    choice = models.ForeignKey(to=Choice, on_delete=models.CASCADE, related_name='votes')
-    poll = models.ForeignKey(to=Poll, on_delete=models.CASCADE, related_name='votes')
+    # choice and poll are indexed by vote_choice_id_idx and unique_vote_per_poll_voter below
+    choice = models.ForeignKey(to=Choice, on_delete=models.CASCADE, related_name='votes', db_index=False)
+    poll = models.ForeignKey(to=Poll, on_delete=models.CASCADE, related_name='votes', db_index=False)
     voter = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name='votes')
 
     class Meta: 
-        unique_together = ['poll', 'voter']
+        constraints = [
+            # one vote per user and poll, the conflict target of the vote upserts (polls.services)
+            models.UniqueConstraint(fields=['poll', 'voter'], name='unique_vote_per_poll_voter'),
+        ]
+
+        indexes = [
+            # votes of a choice (cascades, counter rebuilds) and their keyset pagination
+            models.Index(fields=['choice', 'id'], name='vote_choice_id_idx'),
+        ]
     
     def __str__(self):
         return f"{self.voter} voted for {self.choice}"
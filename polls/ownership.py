@@ -0,0 +1,82 @@
+"""
+"Does user U own poll P", the authorization check of every choice write.
+
+The ids of the polls of a user are cached as one set per user in the
+response cache (polls.cache.get_cache), so the check usually costs no query
+and never loads a Poll row. Creating or deleting a poll drops the set of its
+creator once the transaction commits. Ids missing from the set are confirmed
+with an exists() on (id, creator_id), answered from poll_creator_id_idx alone,
+which also covers users with more than POLLS_OWNERSHIP_CACHE['MAX_SIZE'] polls
+and sets that are missing a poll created meanwhile.
+"""
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import get_cache
+from .models import Poll
+
+DEFAULTS = {
+    'MAX_SIZE': 5000,
+    'TTL': 300,
+}
+
+# cached instead of the set for users owning more than MAX_SIZE polls
+TOO_MANY = 'too-many'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_OWNERSHIP_CACHE', {})}
+
+
+def owned_polls_key(user_id):
+    return f'polls:user:{user_id}:owned-polls'
+
+
+def owned_poll_ids(user_id):
+    """The ids (str) of the polls of the user, None when they are too many to cache"""
+    config = get_config()
+    cache = get_cache()
+    key = owned_polls_key(user_id)
+
+    owned = cache.get(key)
+
+    if owned is None:
+        ids = Poll.objects.filter(creator_id=user_id).values_list('id', flat=True)[:config['MAX_SIZE'] + 1]
+        ids = [str(poll_id) for poll_id in ids]
+
+        owned = TOO_MANY if len(ids) > config['MAX_SIZE'] else frozenset(ids)
+        cache.add(key, owned, timeout=config['TTL'])
+
+    return None if owned == TOO_MANY else owned
+
+
+def user_owns_poll(user_id, poll_id):
+    """Whether the poll exists and was created by the user"""
+    if user_id is None:
+        return False
+
+    try:
+        poll_id = uuid.UUID(str(poll_id))
+    except ValueError:
+        return False
+
+    owned = owned_poll_ids(user_id)
+    if owned is not None and str(poll_id) in owned:
+        return True
+
+    return Poll.objects.filter(pk=poll_id, creator_id=user_id).exists()
+
+
+def forget_owned_polls(user_id):
+    get_cache().delete(owned_polls_key(user_id))
+
+
+def poll_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: forget_owned_polls(instance.creator_id))
+
+
+def poll_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_owned_polls(instance.creator_id))
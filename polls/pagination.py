@@ -0,0 +1,31 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PollCursorPagination(CursorPagination):
+    """
+    Cursor pagination ordered by (pub_date, id), newest polls first, served by
+    the matching composite index and without a COUNT. DRF's cursor positions
+    on pub_date only and skips the rows sharing the cursor's pub_date with an
+    OFFSET, so a page is a range scan plus the timestamp ties (usually none);
+    async_views.poll_list uses a true (pub_date, id) cursor.
+    The page size defaults to REST_FRAMEWORK['PAGE_SIZE'] and can be lowered or raised
+    per request with `?page_size=` up to `max_page_size`.
+    """
+
+    ordering = ('-pub_date', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ChoiceCursorPagination(PollCursorPagination):
+    """Keyset pagination over the choices of a poll"""
+
+    ordering = ('id',)
+
+
+class VotePagination(PollCursorPagination):
+    """Keyset pagination for the (potentially huge) list of votes of a choice"""
+
+    ordering = ('id',)
+    page_size = 100
+    max_page_size = 1000
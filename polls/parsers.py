@@ -0,0 +1,43 @@
+"""
+FastJSONParser parses request bodies with orjson when it is installed and
+gives the same result (and rejects the same input) as DRF's JSONParser.
+"""
+import codecs
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# a run of 19 digits may be an integer beyond 64 bits; translating digits to b'0'
+# (anything else to a space) and searching for LONG_NUMBER finds such runs much
+# faster than a regular expression
+DIGITS = bytes(ord('0') if chr(i).isdigit() and i < 128 else ord(' ') for i in range(256))
+LONG_NUMBER = b'0' * 19
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser using orjson when available"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        data = stream.read()
+
+        # orjson turns integers beyond 64 bits into floats, json keeps them exact
+        if LONG_NUMBER not in data.translate(DIGITS):
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass
+
+        # let json accept the body or raise the usual ParseError
+        return super().parse(io.BytesIO(data), media_type, parser_context)
@@ -1,7 +1,8 @@
-from django.shortcuts import get_object_or_404
 from rest_framework import permissions
+from rest_framework.exceptions import NotFound
 
 from .models import Poll
+from .ownership import user_owns_poll
 
 
 class IsPollCreator(permissions.BasePermission):
@@ -18,22 +19,26 @@ class IsPollCreator(permissions.BasePermission):
 
             return True
     
+        # only the pol creator can create/list choices
+        if user_owns_poll(request.user.pk, poll_id):
+            return True
+
         # 404 if poll doesn't exist
-        poll = get_object_or_404(Poll, pk=poll_id)
+        if not Poll.objects.filter(pk=poll_id).exists():
+            raise NotFound('No Poll matches the given query.')
 
-        # only the pol creator can create/list choices
-        return request.user == poll.creator
+        return False
 
     # Used in the details view
     def has_object_permission(self, request, view, obj):
-        poll = getattr(obj, 'poll', None)
+        poll_id = getattr(obj, 'poll_id', None)
         
-        if not poll: 
+        if not poll_id: 
             # for object without poll attribute(property)
             return True
     
 
-        return request.user == poll.creator
+        return user_owns_poll(request.user.pk, poll_id)
 
 
     """
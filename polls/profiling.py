@@ -0,0 +1,282 @@
+"""
+Sampling profiler for production requests (optional, POLLS_PROFILING).
+
+ProfilingMiddleware runs cProfile over a random SAMPLE_RATE share of the
+requests, and over every request sent with the HEADER (`X-Polls-Profile: 1`)
+by a staff user, to catch the rare pathological request that aggregate metrics
+only show as a slow tail. A header-tagged request is only profiled when its
+token (through the token cache) or session belongs to a staff user, so anybody
+else sending the header costs nothing; its profile is kept only when the
+request turned out to be authenticated as staff.
+
+Profiles are written in the pstats format (`python -m pstats`, snakeviz, ...)
+to DIRECTORY, a ring buffer of at most MAX_PROFILES profiles: the oldest ones
+are removed as new ones arrive. Each profile has a JSON sidecar describing the
+request. views.ProfileList and views.ProfileDetail list and download them.
+
+cProfile profiles one request of a process at a time (since Python 3.12 the
+profiler hooks are process wide), a request arriving while another one is
+profiled is not. An unsampled request costs one random number and a header
+lookup; when disabled the middleware removes itself at startup.
+
+The middleware is sync and async capable. The profile of an async request
+also holds what other requests ran on the event loop meanwhile.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from importlib import import_module
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedTokenAuthentication
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.001,
+    'HEADER': 'X-Polls-Profile',
+    'DIRECTORY': os.path.join(tempfile.gettempdir(), 'polls-profiles'),
+    'MAX_PROFILES': 100,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_PROFILING', {})}
+
+
+PROFILE_ID = re.compile(r'^[0-9]{19,}-[0-9a-f]{8}$')
+
+
+class ProfileStore:
+    """Profiles on disk, at most `max_profiles` of them, the oldest go first"""
+
+    def __init__(self, directory, max_profiles):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def path(self, profile_id, suffix='.prof'):
+        if not PROFILE_ID.match(profile_id):
+            raise KeyError(profile_id)
+
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def save(self, profiler, meta):
+        # ids sort by creation time
+        profile_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+        os.makedirs(self.directory, exist_ok=True)
+
+        # written under a temporary name first, so readers never see a partial file
+        for suffix, write in (('.prof', profiler.dump_stats), ('.json', lambda path: self._write_meta(path, meta))):
+            path = self.path(profile_id, suffix)
+            write(path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        self.evict()
+
+        return profile_id
+
+    @staticmethod
+    def _write_meta(path, meta):
+        with open(path, 'w') as file:
+            json.dump(meta, file)
+
+    def ids(self):
+        """Profile ids, the newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted((name[:-5] for name in names if name.endswith('.prof') and PROFILE_ID.match(name[:-5])), reverse=True)
+
+    def evict(self):
+        with self._lock:
+            for profile_id in self.ids()[self.max_profiles:]:
+                for suffix in ('.prof', '.json'):
+                    try:
+                        os.remove(self.path(profile_id, suffix))
+                    except FileNotFoundError:
+                        pass
+
+    def list(self):
+        profiles = []
+
+        for profile_id in self.ids():
+            try:
+                with open(self.path(profile_id, '.json')) as file:
+                    meta = json.load(file)
+            except (FileNotFoundError, ValueError):
+                # evicted or being written meanwhile
+                continue
+
+            profiles.append({'id': profile_id, **meta})
+
+        return profiles
+
+    def open(self, profile_id):
+        """The profile file opened for reading (binary), KeyError if there is no such profile"""
+        try:
+            return open(self.path(profile_id), 'rb')
+        except FileNotFoundError:
+            raise KeyError(profile_id)
+
+    def text(self, profile_id, limit=50):
+        """The `limit` most expensive functions by cumulative time, as pstats prints them"""
+        output = io.StringIO()
+
+        with self.open(profile_id):
+            stats = pstats.Stats(self.path(profile_id), stream=output)
+
+        stats.sort_stats('cumulative').print_stats(limit)
+        return output.getvalue()
+
+
+def get_store():
+    config = get_config()
+    return ProfileStore(config['DIRECTORY'], config['MAX_PROFILES'])
+
+
+# one profiled request per process at a time
+_profiling = threading.Lock()
+
+
+def is_staff_request(request):
+    """
+    Whether the request carries the credentials of a staff user, checked before
+    the authentication middleware and DRF run: the token the way DRF will look
+    it up (the token cache), else the user of the session cookie
+    """
+    auth = get_authorization_header(request).split()
+
+    if auth and auth[0].lower() == CachedTokenAuthentication.keyword.lower().encode():
+        try:
+            user, _ = CachedTokenAuthentication().authenticate_credentials(auth[1].decode())
+        except (IndexError, UnicodeError, AuthenticationFailed):
+            return False
+
+        return user.is_staff
+
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return False
+
+    user_id = import_module(settings.SESSION_ENGINE).SessionStore(session_key).get(SESSION_KEY)
+    if user_id is None:
+        return False
+
+    return get_user_model()._default_manager.filter(pk=user_id, is_staff=True, is_active=True).exists()
+
+
+class ProfilingMiddleware:
+    """Profile sampled and header-tagged requests, see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+        self.header = 'HTTP_' + config['HEADER'].upper().replace('-', '_')
+        self.store = ProfileStore(config['DIRECTORY'], config['MAX_PROFILES'])
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        sampled = random.random() < self.sample_rate
+        tagged = not sampled and request.META.get(self.header) == '1' and is_staff_request(request)
+
+        if not (sampled or tagged) or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler (a debugger, coverage) holds the hooks
+                return self.get_response(request)
+
+            start = time.perf_counter()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+
+            duration = time.perf_counter() - start
+        finally:
+            _profiling.release()
+
+        self.keep(request, response, profiler, duration, sampled)
+
+        return response
+
+    async def __acall__(self, request):
+        sampled = random.random() < self.sample_rate
+        tagged = (
+            not sampled and request.META.get(self.header) == '1'
+            and await sync_to_async(is_staff_request)(request)
+        )
+
+        if not (sampled or tagged) or not _profiling.acquire(blocking=False):
+            return await self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+
+            try:
+                profiler.enable()
+            except ValueError:
+                return await self.get_response(request)
+
+            start = time.perf_counter()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+
+            duration = time.perf_counter() - start
+        finally:
+            _profiling.release()
+
+        await sync_to_async(self.keep)(request, response, profiler, duration, sampled)
+
+        return response
+
+    def keep(self, request, response, profiler, duration, sampled):
+        """Save the profile of a sampled request, or of a tagged one authenticated as staff"""
+        # DRF hands the authenticated user back to the Django request
+        user = getattr(request, 'user', None)
+        if not (sampled or getattr(user, 'is_staff', False)):
+            return
+
+        self.store.save(profiler, {
+            'created': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'sampled': sampled,
+        })
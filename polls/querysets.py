@@ -0,0 +1,64 @@
+"""
+Build querysets that load everything a serializer is going to read up front.
+
+Walking the serializer tree once gives the relations that have to be joined
+(`select_related`) or batch loaded (`prefetch_related`), so serializing a page
+costs a constant number of queries instead of one per row.
+"""
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+
+
+def related_lookups(serializer, prefix='', in_prefetch=False):
+    """
+    Return the (select_related, prefetch_related) lookups needed by `serializer`.
+
+    Nested single objects are joined, nested lists are prefetched. Anything
+    below a prefetched relation has to be prefetched as well.
+    """
+    select, prefetch = [], []
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        lookup = prefix + field.source.replace('.', '__')
+
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(lookup)
+            child_select, child_prefetch = related_lookups(field.child, lookup + '__', in_prefetch=True)
+
+        elif isinstance(field, serializers.BaseSerializer):
+            (prefetch if in_prefetch else select).append(lookup)
+            child_select, child_prefetch = related_lookups(field, lookup + '__', in_prefetch)
+
+        elif isinstance(field, ManyRelatedField):
+            prefetch.append(lookup)
+            continue
+
+        elif isinstance(field, RelatedField) and not isinstance(field, PrimaryKeyRelatedField):
+            # slug/string related fields read the related object itself,
+            # a primary key field only needs the local foreign key column
+            (prefetch if in_prefetch else select).append(lookup)
+            continue
+
+        else:
+            continue
+
+        select.extend(child_select)
+        prefetch.extend(child_prefetch)
+
+    return select, prefetch
+
+
+def optimize_for_serializer(queryset, serializer_class, context=None):
+    """Apply the select_related/prefetch_related lookups `serializer_class` needs"""
+    select, prefetch = related_lookups(serializer_class(context=context or {}))
+
+    if select:
+        queryset = queryset.select_related(*select)
+
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+
+    return queryset
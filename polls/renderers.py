@@ -0,0 +1,137 @@
+"""
+Renderers of the API.
+
+FastJSONRenderer renders with orjson when it is installed (it is optional,
+`pip install orjson`) and falls back to DRF's JSONRenderer otherwise. The
+output is the same bytes JSONRenderer produces: values orjson would format
+differently (datetimes, decimals, lazy strings, ...) go through DRF's
+JSONEncoder, and U+2028/U+2029 are escaped the same way. Two corner cases
+differ: floats small enough for exponent notation (`1e-7` instead of `1e-07`)
+and NaN/Infinity (rendered as null instead of raising). Pretty printed
+output (`; indent=` in the Accept header, the browsable API) and the
+non-default UNICODE_JSON/COMPACT_JSON settings are left to JSONRenderer.
+"""
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer using orjson when available"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, let json report or handle it
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # escape U+2028/U+2029 like JSONRenderer, keeping the output a strict javascript subset
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+        return ret
+
+
+def format_event(event, data):
+    """One Server-Sent Event with a JSON payload"""
+    payload = json.dumps(data, cls=JSONEncoder, separators=(',', ':'))
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets `Accept: text/event-stream` through content negotiation. The streams
+    themselves are StreamingHttpResponses; what gets rendered here are the
+    error responses (401, 404, ...), sent as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return format_event('error', data).encode(self.charset)
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Lets an export format through content negotiation (`?format=` or the
+    Accept header). Exports are StreamingHttpResponses of stream(); render()
+    only handles the error responses (401, 403, 404, ...).
+    """
+    charset = 'utf-8'
+
+    def stream(self, columns, batches):
+        """The encoded export: a header, if the format has one, then a chunk per batch of row tuples"""
+        raise NotImplementedError
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if not isinstance(data, dict):
+            data = {'detail': data}
+
+        return self.encode([list(data), [str(value) for value in data.values()]])
+
+    def encode(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode(self.charset)
+
+    def stream(self, columns, batches):
+        yield self.encode([columns])
+
+        for rows in batches:
+            yield self.encode(rows)
+
+
+class NDJSONRenderer(ExportRenderer):
+    """Newline delimited JSON, an object per row"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return json.dumps(data, cls=JSONEncoder, separators=(',', ':')).encode(self.charset) + b'\n'
+
+    def stream(self, columns, batches):
+        if orjson is not None:
+            # orjson writes UUIDs like DRF's JSONEncoder
+            dumps = orjson.dumps
+        else:
+            encoder = JSONEncoder(separators=(',', ':'))
+
+            def dumps(row):
+                return encoder.encode(row).encode(self.charset)
+
+        for rows in batches:
+            yield b''.join(dumps(dict(zip(columns, row))) + b'\n' for row in rows)
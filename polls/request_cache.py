@@ -0,0 +1,23 @@
+"""
+Request-scoped cache of the objects a request works on.
+
+Views of one request may look up the same row more than once, e.g.
+PollViewSets.update/destroy before and within DRF's update()/destroy().
+cached_object() loads it once and hands the same instance to every later
+caller within the request; nothing outlives the request.
+"""
+from rest_framework.generics import get_object_or_404
+
+
+def cached_object(request, queryset, pk):
+    """
+    `get_object_or_404(queryset, pk=pk)`, run once per request, model and pk.
+    The queryset of the first lookup decides what is joined or prefetched.
+    """
+    objects = request.__dict__.setdefault('_object_cache', {})
+    key = (queryset.model._meta.label, str(pk))
+
+    if key not in objects:
+        objects[key] = get_object_or_404(queryset, pk=pk)
+
+    return objects[key]
@@ -0,0 +1,70 @@
+"""
+Poll results (vote counts and percentages per choice).
+
+Results are computed from the denormalized counters with a single query,
+however many polls are asked for: polls are LEFT JOINed with their choices
+so polls without choices are still found.
+"""
+from .models import Poll
+
+
+def percentage(votes, total):
+    return round(100 * votes / total, 2) if total else 0.0
+
+
+def build_results(poll_id, question, choices):
+    """Results payload of a poll from its (choice id, body, vote count) rows"""
+    total = sum(votes for _, _, votes in choices)
+
+    return {
+        'poll': str(poll_id),
+        'question': question,
+        'total_votes': total,
+        'choices': [
+            {
+                'id': str(choice_id),
+                'body': body,
+                'votes': votes,
+                'percentage': percentage(votes, total),
+            }
+            for choice_id, body, votes in choices
+        ],
+    }
+
+
+def results_rows(poll_ids):
+    """The (poll, choice) rows behind the results of the polls, one query"""
+    return (
+        Poll.objects.filter(pk__in=poll_ids)
+        .order_by('id', 'choices__id')
+        .values_list('id', 'question', 'modified_date', 'choices__id', 'choices__body', 'choices__vote_count')
+    )
+
+
+def collect_results(rows):
+    """Return {poll id: (results, modified date)} from the rows of results_rows()"""
+    polls = {}
+
+    for poll_id, question, modified_date, choice_id, body, votes in rows:
+        poll = polls.setdefault(poll_id, {'question': question, 'modified_date': modified_date, 'choices': []})
+
+        if choice_id is not None:
+            poll['choices'].append((choice_id, body, votes))
+
+    return {
+        poll_id: (build_results(poll_id, poll['question'], poll['choices']), poll['modified_date'])
+        for poll_id, poll in polls.items()
+    }
+
+
+def get_results(poll_ids):
+    """
+    Return {poll id: (results, modified date)} for the polls that exist,
+    computed with one query
+    """
+    return collect_results(results_rows(poll_ids))
+
+
+async def aget_results(poll_ids):
+    """Async version of get_results()"""
+    return collect_results([row async for row in results_rows(poll_ids)])
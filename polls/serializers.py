@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 from .models import Poll, Choice, Vote
+from . import services
 
 class VoteSerializer(serializers.ModelSerializer):
 	class Meta: 
@@ -20,20 +23,55 @@ class VoteSerializer(serializers.ModelSerializer):
 			}
 		}
 
-class ChoiceSerializer(serializers.ModelSerializer):
-	votes = VoteSerializer(many=True, required=False, read_only=True)
+class CounterSafeModelSerializer(serializers.ModelSerializer):
+	"""
+	update() saves every column but the denormalized vote counters (Meta.counter_fields):
+	those only change through F() updates, the value read with the instance would undo
+	the votes committed since
+	"""
+
+	def update(self, instance, validated_data):
+		serializers.raise_errors_on_nested_writes('update', self, validated_data)
+
+		for attr, value in validated_data.items():
+			setattr(instance, attr, value)
+
+		counters = set(self.Meta.counter_fields)
+		instance.save(update_fields=[
+			field.name for field in instance._meta.concrete_fields
+			if not field.primary_key and field.name not in counters
+		])
+
+		return instance
+
+class ChoiceSerializer(CounterSafeModelSerializer):
+	# Individual votes are served by the paginated ChoiceVotesList view,
+	# the choice itself only exposes the denormalized counter
+	vote_count = serializers.IntegerField(read_only=True)
 
 	# Only use poll field for read operations, write will be handled by view
 	poll = serializers.PrimaryKeyRelatedField(
 		read_only=True
 	)
 
+	# nested on request only, with ?expand=votes (?expand=choices.votes on polls)
+	expandable_fields = {
+		'votes': VoteSerializer
+	}
+
 	class Meta:
 		model = Choice
 		fields = '__all__'
+		counter_fields = ['vote_count']
+
+class NestedChoiceSerializer(ChoiceSerializer):
+	# In a poll the id names an existing choice of that poll, checked by PollSerializer.validate_choices
+	id = serializers.UUIDField(required=False)
 
-class PollSerializer(serializers.ModelSerializer):
-	choices = ChoiceSerializer(many=True, required=False, read_only=True)
+
+class PollSerializer(CounterSafeModelSerializer):
+	# Writable: choices sent with a poll are written in bulk (see create/update below)
+	choices = NestedChoiceSerializer(many=True, required=False)
 
 	pub_date = serializers.DateTimeField(
 	format='%d-%m-%Y',
@@ -45,10 +83,13 @@ class PollSerializer(serializers.ModelSerializer):
 	read_only=True
 	)
 
+	total_votes = serializers.IntegerField(read_only=True)
+
 
 	class Meta: 
 		model = Poll 
-		fields = '__all__'
+		exclude = ['deleted_at']
+		counter_fields = ['total_votes']
 
 		extra_kwargs = {
 			'creator': {
@@ -56,6 +97,52 @@ class PollSerializer(serializers.ModelSerializer):
 			}
 		}
 
+	def validate_choices(self, choices):
+		max_items = getattr(settings, 'POLLS_BULK_CHOICES_MAX_ITEMS', 100)
+
+		if len(choices) > max_items:
+			raise serializers.ValidationError(f'At most {max_items} choices per request.')
+
+		ids = [choice['id'] for choice in choices if 'id' in choice]
+
+		if len(ids) != len(set(ids)):
+			raise serializers.ValidationError('A choice can only be listed once.')
+
+		# ids name existing choices of this poll (the view has prefetched them)
+		known = set() if self.instance is None else {choice.id for choice in self.instance.choices.all()}
+		unknown = [str(choice_id) for choice_id in ids if choice_id not in known]
+
+		if unknown:
+			raise serializers.ValidationError(f'Unknown choice id(s): {", ".join(unknown)}.')
+
+		return choices
+
+	def create(self, validated_data):
+		choices = validated_data.pop('choices', None)
+
+		with transaction.atomic():
+			poll = super().create(validated_data)
+
+			if choices:
+				services.create_choices(poll.pk, choices)
+
+		return poll
+
+	def update(self, instance, validated_data):
+		"""
+		With `choices` in the data the poll gets exactly these choices: listed ids are
+		updated, new ones created and the others deleted (see services.replace_choices)
+		"""
+		choices = validated_data.pop('choices', None)
+
+		with transaction.atomic():
+			poll = super().update(instance, validated_data)
+
+			if choices is not None:
+				services.replace_choices(poll.pk, choices)
+
+		return poll
+
 
 
 
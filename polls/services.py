@@ -0,0 +1,357 @@
+"""
+Vote bookkeeping.
+
+`Choice.vote_count` and `Poll.total_votes` are denormalized copies of the
+Vote table. Every code path that adds or removes votes goes through the
+helpers below so the counters are updated with `F()` expressions in the same
+transaction as the vote rows themselves.
+
+Any change to a poll, its choices or its votes also moves
+`Poll.modified_date` forward and, once the transaction commits, bumps the
+poll version of the response cache (see polls.cache).
+"""
+import uuid
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Now
+
+from .models import Poll, Choice, Vote
+from .db import write_transaction
+from .cache import bump_poll_version
+from . import live
+
+
+def invalidate_poll(poll_id):
+    """
+    Drop the cached responses of the poll and push its live results
+    once the current transaction commits
+    """
+    def changed():
+        bump_poll_version(poll_id)
+        live.publish(poll_id)
+
+    transaction.on_commit(changed)
+
+
+def touch_poll(poll_id):
+    """Record a change to the poll (or one of its choices)"""
+    Poll.objects.filter(pk=poll_id).update(modified_date=Now())
+    invalidate_poll(poll_id)
+
+
+# outcomes of cast_vote()
+VOTE_CREATED = 'created'
+VOTE_CHANGED = 'changed'
+VOTE_UNCHANGED = 'unchanged'
+
+
+def upsert_votes(votes, batch_size=None):
+    """
+    Insert the votes, replacing the choice of any existing vote of the same
+    (poll, voter) with INSERT ... ON CONFLICT DO UPDATE where the backend
+    supports it.
+    """
+    connection = connections[router.db_for_write(Vote)]
+
+    if connection.features.supports_update_conflicts_with_target:
+        Vote.objects.bulk_create(
+            votes,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['poll', 'voter'],
+            update_fields=['choice'],
+        )
+        return
+
+    for vote in votes:
+        Vote.objects.update_or_create(
+            poll_id=vote.poll_id,
+            voter_id=vote.voter_id,
+            defaults={'choice_id': vote.choice_id},
+            create_defaults={'id': vote.id, 'choice_id': vote.choice_id},
+        )
+
+
+def cast_vote(poll_id, choice_id, voter_id):
+    """
+    Record a vote for the choice, replacing the voter's earlier vote on the poll.
+
+    The vote row and both counters are written in one transaction:
+    the earlier vote (if any) is read, locked and moved to the choice, a first
+    vote is upserted on (poll, voter) and the counters are moved with F() expressions.
+    Raise Choice.DoesNotExist when the choice is not part of the poll.
+    Return a (vote, outcome) tuple, `vote` is None when nothing changed.
+    """
+    with write_transaction():
+        previous_id, previous_choice_id = (
+            Vote.objects.select_for_update()
+            .filter(poll_id=poll_id, voter_id=voter_id)
+            .values_list('id', 'choice_id')
+            .first()
+        ) or (None, None)
+
+        if previous_choice_id is not None and str(previous_choice_id) == str(choice_id):
+            return None, VOTE_UNCHANGED
+
+        # counts the vote and checks that the choice belongs to the poll at the same time
+        if not Choice.objects.filter(pk=choice_id, poll_id=poll_id, poll__deleted_at__isnull=True).update(vote_count=F('vote_count') + 1):
+            raise Choice.DoesNotExist('Choice does not belong to the poll')
+
+        if previous_id is not None:
+            # the locked row keeps its id, the vote returned is that row
+            vote = Vote(id=previous_id, poll_id=poll_id, choice_id=choice_id, voter_id=voter_id)
+            Vote.objects.filter(pk=previous_id).update(choice_id=choice_id)
+
+            Choice.objects.filter(pk=previous_choice_id).update(vote_count=F('vote_count') - 1)
+            touch_poll(poll_id)
+
+            return vote, VOTE_CHANGED
+
+        vote = Vote(poll_id=poll_id, choice_id=choice_id, voter_id=voter_id)
+        upsert_votes([vote])
+
+        # Only count the vote on the poll when our row was inserted. If a
+        # concurrent first vote of the same voter won the race, the upsert
+        # replaced its choice without us knowing which one, recount the poll.
+        if not Poll.objects.filter(pk=poll_id, votes=vote.pk).update(total_votes=F('total_votes') + 1, modified_date=Now()):
+            rebuild_vote_counters([poll_id])
+            vote = Vote.objects.get(poll_id=poll_id, voter_id=voter_id)
+
+            return vote, VOTE_CHANGED
+
+        invalidate_poll(poll_id)
+
+        return vote, VOTE_CREATED
+
+
+# extra per-item outcomes of cast_votes()
+VOTE_SUPERSEDED = 'superseded'
+VOTE_INVALID = 'invalid'
+
+
+def cast_votes(poll_id, items, chunk_size=1000):
+    """
+    Cast many votes on a poll at once.
+
+    `items` is a sequence of (voter_id, choice_id) pairs. Choice membership is
+    validated with a single query (voters in chunks), only the last vote of
+    every voter is applied (earlier ones are `superseded`), and the votes are
+    upserted chunk by chunk, each chunk in its own transaction together with
+    its counter updates.
+    Return one {'status': ..., 'error': ...} dict per item, in input order.
+    """
+    results = [{'status': None} for _ in items]
+    parsed = {}
+
+    for index, (voter_id, choice_id) in enumerate(items):
+        try:
+            parsed[index] = (int(voter_id), uuid.UUID(str(choice_id)))
+        except (TypeError, ValueError):
+            results[index] = {'status': VOTE_INVALID, 'error': 'Malformed voter or choice id.'}
+
+    valid_choices = set(
+        Choice.objects.filter(
+            poll_id=poll_id,
+            poll__deleted_at__isnull=True,
+            pk__in={choice_id for _, choice_id in parsed.values()}
+        ).values_list('pk', flat=True)
+    )
+
+    # chunked, SQLite caps the number of variables of a statement
+    voter_ids = list({voter_id for voter_id, _ in parsed.values()})
+    valid_voters = set()
+
+    for start in range(0, len(voter_ids), chunk_size):
+        valid_voters.update(
+            get_user_model().objects.filter(
+                pk__in=voter_ids[start:start + chunk_size]
+            ).values_list('pk', flat=True)
+        )
+
+    # last write wins
+    latest = {}
+
+    for index, (voter_id, choice_id) in parsed.items():
+        if choice_id not in valid_choices:
+            results[index] = {'status': VOTE_INVALID, 'error': 'No such choice in this poll.'}
+        elif voter_id not in valid_voters:
+            results[index] = {'status': VOTE_INVALID, 'error': 'No such voter.'}
+        else:
+            if voter_id in latest:
+                results[latest[voter_id]] = {'status': VOTE_SUPERSEDED}
+
+            latest[voter_id] = index
+
+    pending = sorted(latest.values())
+
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+
+        for index, outcome in zip(chunk, _cast_vote_chunk(poll_id, [parsed[i] for i in chunk])):
+            results[index] = {'status': outcome}
+
+    return results
+
+
+def _cast_vote_chunk(poll_id, items):
+    """Upsert a chunk of validated votes of distinct voters, return their outcomes"""
+    with write_transaction():
+        previous = dict(
+            Vote.objects.select_for_update()
+            .filter(poll_id=poll_id, voter_id__in=[voter_id for voter_id, _ in items])
+            .values_list('voter_id', 'choice_id')
+        )
+
+        outcomes, votes, new_votes = [], [], []
+        deltas = {}
+
+        for voter_id, choice_id in items:
+            previous_choice_id = previous.get(voter_id)
+
+            if previous_choice_id == choice_id:
+                outcomes.append(VOTE_UNCHANGED)
+                continue
+
+            vote = Vote(poll_id=poll_id, choice_id=choice_id, voter_id=voter_id)
+            votes.append(vote)
+            deltas[choice_id] = deltas.get(choice_id, 0) + 1
+
+            if previous_choice_id is None:
+                new_votes.append(vote)
+                outcomes.append(VOTE_CREATED)
+            else:
+                deltas[previous_choice_id] = deltas.get(previous_choice_id, 0) - 1
+                outcomes.append(VOTE_CHANGED)
+
+        if not votes:
+            return outcomes
+
+        upsert_votes(votes)
+
+        for choice_id, delta in deltas.items():
+            if delta:
+                Choice.objects.filter(pk=choice_id).update(vote_count=F('vote_count') + delta)
+
+        Poll.objects.filter(pk=poll_id).update(total_votes=F('total_votes') + len(new_votes), modified_date=Now())
+        invalidate_poll(poll_id)
+
+        # Votes inserted concurrently for one of these voters were replaced
+        # by the upsert without being taken off their choice, recount the poll.
+        if new_votes and Vote.objects.filter(pk__in=[vote.pk for vote in new_votes]).count() != len(new_votes):
+            rebuild_vote_counters([poll_id])
+
+    return outcomes
+
+
+def release_votes(votes):
+    """
+    Take the votes of a queryset off the counters, before they are deleted
+    (by the caller, or by a cascade such as the deletion of their voter)
+    """
+    with write_transaction():
+        choices = Counter()
+        polls = Counter()
+
+        for choice_id, poll_id in votes.values_list('choice_id', 'poll_id'):
+            choices[choice_id] += 1
+            polls[poll_id] += 1
+
+        for choice_id, count in choices.items():
+            Choice.objects.filter(pk=choice_id).update(vote_count=F('vote_count') - count)
+
+        for poll_id, count in polls.items():
+            Poll.all_objects.filter(pk=poll_id).update(total_votes=F('total_votes') - count, modified_date=Now())
+            invalidate_poll(poll_id)
+
+
+def delete_votes(votes):
+    """Delete the votes of a queryset and take them off the counters"""
+    with write_transaction():
+        release_votes(votes)
+        votes.delete()
+
+
+def voter_deleted(sender, instance, **kwargs):
+    """pre_delete receiver for users: their votes cascade away with them"""
+    release_votes(Vote.objects.filter(voter_id=instance.pk))
+
+
+def delete_choice(choice):
+    """
+    Delete a choice (its votes cascade) and take its votes off the poll total.
+    The current counter value is read inside the UPDATE so a vote committed
+    after the choice was loaded is not lost.
+    """
+    with transaction.atomic():
+        current_count = Choice.objects.filter(pk=choice.pk).values('vote_count')
+        Poll.objects.filter(pk=choice.poll_id).update(
+            total_votes=F('total_votes') - Coalesce(Subquery(current_count), 0),
+            modified_date=Now()
+        )
+        choice.delete()
+        invalidate_poll(choice.poll_id)
+
+
+def create_choices(poll_id, items):
+    """Add choices to the poll in one INSERT, `items` are dicts of Choice fields"""
+    return Choice.objects.bulk_create(Choice(poll_id=poll_id, **item) for item in items)
+
+
+def replace_choices(poll_id, items):
+    """
+    Make the choices of the poll match `items`: items with an `id` update that
+    choice, the others are created and the choices left out are deleted, their
+    votes taken off the poll total. A constant number of queries for any number of choices.
+    """
+    kept = {item['id']: item for item in items if 'id' in item}
+
+    with transaction.atomic():
+        removed = Choice.objects.filter(poll_id=poll_id).exclude(pk__in=list(kept))
+        # read inside the UPDATE like delete_choice() does
+        removed_count = removed.order_by().values('poll_id').annotate(votes=Sum('vote_count')).values('votes')
+
+        Poll.objects.filter(pk=poll_id).update(
+            total_votes=F('total_votes') - Coalesce(Subquery(removed_count), 0),
+            modified_date=Now()
+        )
+        removed.delete()
+
+        Choice.objects.bulk_update(
+            [Choice(pk=choice_id, poll_id=poll_id, body=item['body']) for choice_id, item in kept.items()],
+            ['body']
+        )
+        choices = create_choices(poll_id, [item for item in items if 'id' not in item])
+
+        invalidate_poll(poll_id)
+
+    return choices
+
+
+def rebuild_vote_counters(poll_ids=None):
+    """
+    Recompute the counters from the Vote table.
+    Restrict the work to `poll_ids` when given, otherwise rebuild every poll.
+    Return the number of (polls, choices) updated.
+    """
+    polls = Poll.objects.all()
+    choices = Choice.objects.all()
+
+    if poll_ids is not None:
+        polls = polls.filter(pk__in=poll_ids)
+        choices = choices.filter(poll__in=poll_ids)
+
+    choice_votes = Vote.objects.filter(choice=OuterRef('pk')).order_by().values('choice').annotate(n=Count('pk')).values('n')
+    poll_votes = Vote.objects.filter(poll=OuterRef('pk')).order_by().values('poll').annotate(n=Count('pk')).values('n')
+
+    with transaction.atomic():
+        updated_choices = choices.update(vote_count=Coalesce(Subquery(choice_votes), 0))
+        updated_polls = polls.update(total_votes=Coalesce(Subquery(poll_votes), 0))
+
+        # a full rebuild leaves cached responses to expire on their own
+        for poll_id in poll_ids or ():
+            invalidate_poll(poll_id)
+
+    return updated_polls, updated_choices
@@ -0,0 +1,64 @@
+"""
+Streaming responses under WSGI and ASGI.
+
+Under ASGI Django drains a synchronous iterator given to StreamingHttpResponse
+(`sync_to_async(list)`) before sending anything, so a never ending stream
+never starts. Streaming views hand it an asynchronous iterator when the
+request came in through ASGI, aiterate() turns a synchronous one (a
+database cursor) into one.
+
+The ASGI handler closes the iterator it reads, but that is a wrapper Django
+puts around an asynchronous iterator: the iterator itself is only closed
+once it is garbage collected. ClosingStreamingHttpResponse releases what a
+stream holds (a live results subscription, a cursor) when the handler
+closes the response instead.
+"""
+import itertools
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+
+def is_asgi(request):
+    """Whether the (Django or DRF) request is served by the ASGI handler"""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+class ClosingStreamingHttpResponse(StreamingHttpResponse):
+    """StreamingHttpResponse that calls `on_close()` when it is closed, however it was streamed"""
+
+    def __init__(self, *args, on_close=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    def close(self):
+        try:
+            if self.on_close is not None:
+                self.on_close()
+        finally:
+            super().close()
+
+
+def chunked(iterable, size):
+    """Lists of `size` items of the iterable, the last one may be shorter"""
+    iterator = iter(iterable)
+
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+async def aiterate(iterator):
+    """
+    The items of a synchronous iterator for ASGI, each one read in the thread
+    sync_to_async runs the request's database work in, and the iterator closed
+    there at the end
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    done = object()
+
+    try:
+        while (item := await step(iterator, done)) is not done:
+            yield item
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=True)()
@@ -1,10 +1,59 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
 from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient, APITestCase, APIRequestFactory
 from rest_framework.authtoken.models import Token
 
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import marshal
+import os
+import re
+import shutil
+import tempfile
+import threading
 import uuid
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
+from .models import Poll, Choice, Vote
+from .pagination import PollCursorPagination
+from .results import get_results
+from .serializers import ChoiceSerializer, PollSerializer, VoteSerializer
+from .fast_serializers import FastReadSerializer
+from .cache import bump_poll_version
+from .db import write_transaction
+from .db_routers import ReadReplicaRouter, read_from_replica
+from . import authentication
+from . import deletion
+from . import hashing
+from . import profiling
+from . import instrumentation
+from . import ownership
+from . import live
+from . import parsers
+from . import renderers
+from . import services
+from . import vote_buffer
 from .views import PollViewSets
 
 class PollTest(APITestCase):
@@ -62,9 +111,9 @@ class PollTest(APITestCase):
         )
 
         self.assertEqual(
-            isinstance(response.data, list), 
+            isinstance(response.data['results'], list), 
             True,
-            f"Expected response was list, received {type(response.data)} instead"
+            f"Expected response results was list, received {type(response.data['results'])} instead"
         )
 
     def test_create_poll(self):
@@ -276,3 +325,2012 @@ class PollTest(APITestCase):
             status.HTTP_403_FORBIDDEN
         )
 
+
+
+class AuthenticatedAPITestCase(APITestCase):
+    """A test user (PollTest.get_user) and a client authenticated with their token"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = PollTest.get_user()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+
+class VoteCounterTest(AuthenticatedAPITestCase):
+    """Test the denormalized vote counters and the paginated votes list"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+
+    def vote(self, choice, client=None):
+        client = client or self.client
+        return client.post(f'/api/polls/{self.poll.id}/choices/{choice.id}/vote/')
+
+    def test_vote_increments_counters(self):
+        response = self.vote(self.choice1)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.choice1.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual(self.choice1.vote_count, 1)
+        self.assertEqual(self.poll.total_votes, 1)
+
+    def test_changing_vote_moves_counter(self):
+        self.vote(self.choice1)
+        response = self.vote(self.choice2)
+
+        # the changed vote is the existing row
+        self.assertEqual(response.data['id'], str(Vote.objects.get(poll=self.poll, voter=self.user).pk))
+
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual(self.choice1.vote_count, 0)
+        self.assertEqual(self.choice2.vote_count, 1)
+        self.assertEqual(self.poll.total_votes, 1)
+
+    def test_edits_keep_concurrent_votes(self):
+        # loaded before the vote commits, saved after it
+        poll = Poll.objects.get(pk=self.poll.pk)
+        choice = Choice.objects.get(pk=self.choice1.pk)
+        self.vote(self.choice1)
+
+        serializer = PollSerializer(poll, data={'question': 'Edited'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        serializer = ChoiceSerializer(choice, data={'body': 'Edited'})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.poll.refresh_from_db()
+        self.choice1.refresh_from_db()
+        self.assertEqual((self.poll.question, self.poll.total_votes), ('Edited', 1))
+        self.assertEqual((self.choice1.body, self.choice1.vote_count), ('Edited', 1))
+
+    def test_deleting_choice_releases_its_votes(self):
+        self.vote(self.choice1)
+
+        response = self.client.delete(f'/api/polls/{self.poll.id}/choices/{self.choice1.id}/')
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 0)
+
+    def test_deleting_voter_releases_their_votes(self):
+        voter = get_user_model().objects.create_user(username='voter', password='test')
+        self.vote(self.choice1)
+        services.cast_vote(self.poll.id, self.choice2.id, voter.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            voter.delete()
+
+        self.choice2.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual((self.choice2.vote_count, self.poll.total_votes), (0, 1))
+
+    def test_delete_votes(self):
+        voter = get_user_model().objects.create_user(username='voter', password='test')
+        self.vote(self.choice1)
+        services.cast_vote(self.poll.id, self.choice1.id, voter.pk)
+
+        services.delete_votes(Vote.objects.filter(voter=voter))
+
+        self.choice1.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual((self.choice1.vote_count, self.poll.total_votes, self.poll.votes.count()), (1, 1, 1))
+
+    def test_poll_detail_exposes_counts_not_votes(self):
+        self.vote(self.choice1)
+
+        response = self.client.get(f'/api/polls/{self.poll.id}/')
+
+        self.assertEqual(response.data['total_votes'], 1)
+        choice = next(c for c in response.data['choices'] if c['id'] == str(self.choice1.id))
+        self.assertEqual(choice['vote_count'], 1)
+        self.assertNotIn('votes', choice)
+
+    def test_votes_list_is_paginated(self):
+        self.vote(self.choice1)
+
+        response = self.client.get(
+            f'/api/polls/{self.poll.id}/choices/{self.choice1.id}/votes/',
+            {'page_size': 1}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['voter'], self.user.id)
+        self.assertIsNone(response.data['next'])
+
+    def test_rebuild_vote_counts_command(self):
+        Vote.objects.create(poll=self.poll, choice=self.choice2, voter=self.user)
+        Choice.objects.filter(pk=self.choice1.pk).update(vote_count=7)
+
+        call_command('rebuild_vote_counts', stdout=StringIO())
+
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual(self.choice1.vote_count, 0)
+        self.assertEqual(self.choice2.vote_count, 1)
+        self.assertEqual(self.poll.total_votes, 1)
+
+
+def count_queries(captured):
+    """Number of captured SQL statements, leaving out the savepoints of the test transaction"""
+    return len([q for q in captured if 'SAVEPOINT' not in q['sql']])
+
+
+class QueryBudgetMixin:
+    """
+    Assert that an endpoint runs a fixed number of SQL queries regardless of data size.
+    The request is captured once, more data is added and the request is captured again.
+    """
+
+    def assertQueryBudget(self, budget, make_request, add_data):
+        # the first request also fills the token cache, keep it out of the count
+        make_request()
+
+        with CaptureQueriesContext(connection) as before:
+            response = make_request()
+
+        self.assertLess(response.status_code, 400, f'Request failed with status code {response.status_code}')
+
+        add_data()
+
+        with CaptureQueriesContext(connection) as after:
+            make_request()
+
+        self.assertLessEqual(
+            len(before),
+            budget,
+            f'Expected at most {budget} queries, ran {len(before)}:\n' + '\n'.join(q['sql'] for q in before)
+        )
+
+        self.assertEqual(
+            len(before),
+            len(after),
+            'Query count grew with the data:\n' + '\n'.join(q['sql'] for q in after)
+        )
+
+
+class QueryBudgetTest(QueryBudgetMixin, AuthenticatedAPITestCase):
+    """Test that reading polls and choices does not run N+1 queries"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.poll = self.add_poll()
+
+    def add_poll(self, choices=3):
+        poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        Choice.objects.bulk_create(Choice(poll=poll, body=f'Choice {i}') for i in range(choices))
+
+        return poll
+
+    def add_polls(self):
+        for _ in range(5):
+            self.add_poll()
+
+    def add_choices(self):
+        Choice.objects.bulk_create(Choice(poll=self.poll, body='Extra') for _ in range(5))
+        bump_poll_version(self.poll.id)
+
+    def test_poll_list_query_budget(self):
+        self.assertQueryBudget(2, lambda: self.client.get('/api/polls/'), self.add_polls)
+
+    def get_uncached_detail(self):
+        # measure the queries behind the response cache
+        cache.clear()
+        return self.client.get(f'/api/polls/{self.poll.id}/')
+
+    def test_poll_detail_query_budget(self):
+        self.assertQueryBudget(
+            2,
+            self.get_uncached_detail,
+            self.add_choices
+        )
+
+    def test_choice_list_query_budget(self):
+        self.assertQueryBudget(
+            3,
+            lambda: self.client.get(f'/api/polls/{self.poll.id}/choices/'),
+            lambda: Choice.objects.bulk_create(Choice(poll=self.poll, body='Extra') for _ in range(5))
+        )
+
+
+class PaginationTest(AuthenticatedAPITestCase):
+    """Test the cursor pagination of the polls and choices lists"""
+
+    def setUp(self):
+        super().setUp()
+
+    def test_walk_poll_pages(self):
+        polls = [Poll.objects.create(question=f'Poll {i}', creator=self.user) for i in range(5)]
+
+        seen = []
+        response = self.client.get('/api/polls/', {'page_size': 2})
+
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(poll['id'] for poll in response.data['results'])
+
+            if not response.data['next']:
+                break
+
+            response = self.client.get(response.data['next'])
+
+        # newest first, every poll exactly once
+        self.assertEqual(seen, [str(poll.id) for poll in reversed(polls)])
+
+    def test_page_size_is_capped(self):
+        for i in range(3):
+            Poll.objects.create(question=f'Poll {i}', creator=self.user)
+
+        with patch.object(PollCursorPagination, 'max_page_size', 2):
+            response = self.client.get('/api/polls/', {'page_size': 1000})
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_choice_list_is_paginated(self):
+        poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        Choice.objects.bulk_create(Choice(poll=poll, body=f'Choice {i}') for i in range(3))
+
+        response = self.client.get(f'/api/polls/{poll.id}/choices/', {'page_size': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+        response = self.client.get(response.data['next'])
+
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class PollCacheTest(AuthenticatedAPITestCase):
+    """Test the cached, conditional poll detail responses"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.url = f'/api/polls/{self.poll.id}/'
+
+    def test_detail_is_served_from_cache(self):
+        first = self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+
+        self.assertEqual(second.data, first.data)
+        # the token lookup is cached as well
+        self.assertEqual(len(queries), 0)
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_vote_invalidates_cached_detail(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{self.url}choices/{self.choice.id}/vote/')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_votes'], 1)
+
+    def test_choice_and_poll_writes_invalidate_cached_detail(self):
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{self.url}choices/', {'body': 'Choice 2'})
+
+        self.assertEqual(len(self.client.get(self.url).data['choices']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(self.url, {'question': 'Updated'}, format='json')
+
+        self.assertEqual(self.client.get(self.url).data['question'], 'Updated')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(self.url)
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CastVoteTest(AuthenticatedAPITestCase):
+    """Test vote casting through the upsert in services.cast_vote"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+
+    def vote_url(self, choice, poll=None):
+        return f'/api/polls/{(poll or self.poll).id}/choices/{choice.id}/vote/'
+
+    def test_queries_per_vote(self):
+        with CaptureQueriesContext(connection) as first_vote:
+            self.client.post(self.vote_url(self.choice1))
+
+        with CaptureQueriesContext(connection) as changed_vote:
+            self.client.post(self.vote_url(self.choice2))
+
+        with CaptureQueriesContext(connection) as same_vote:
+            response = self.client.post(self.vote_url(self.choice2))
+
+        # token lookup + earlier vote + choice counter + upsert + poll counter
+        self.assertEqual(count_queries(first_vote), 5)
+        # earlier vote + choice counter + vote update + old choice counter + poll touch (the token is cached now)
+        self.assertEqual(count_queries(changed_vote), 5)
+        # earlier vote
+        self.assertEqual(count_queries(same_vote), 1)
+        self.assertEqual(response.data, {'details': 'vote already exists'})
+
+        self.assertEqual(Vote.objects.get(voter=self.user).choice_id, self.choice2.id)
+
+    def test_vote_for_choice_of_another_poll(self):
+        other_poll = Poll.objects.create(question='Other Poll', creator=self.user)
+
+        response = self.client.post(self.vote_url(self.choice1, poll=other_poll))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Vote.objects.exists())
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.vote_count, 0)
+
+    def test_concurrent_first_votes_keep_counters_exact(self):
+        upsert_votes = services.upsert_votes
+
+        def racing_upsert(votes):
+            # another request of the same voter commits its first vote in between
+            Vote.objects.create(poll=self.poll, choice=self.choice1, voter=self.user)
+            Choice.objects.filter(pk=self.choice1.id).update(vote_count=F('vote_count') + 1)
+            Poll.objects.filter(pk=self.poll.id).update(total_votes=F('total_votes') + 1)
+
+            upsert_votes(votes)
+
+        with patch.object(services, 'upsert_votes', racing_upsert):
+            vote, outcome = services.cast_vote(self.poll.id, self.choice2.id, self.user.pk)
+
+        self.assertEqual(outcome, services.VOTE_CHANGED)
+        self.assertEqual(vote.choice_id, self.choice2.id)
+
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual((self.choice1.vote_count, self.choice2.vote_count, self.poll.total_votes), (0, 1, 1))
+
+
+class BulkVoteTest(APITestCase):
+    """Test the bulk vote ingestion endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(username='admin', password='test', is_staff=True)
+        self.token = Token.objects.create(user=self.admin)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        get_user_model().objects.bulk_create(
+            get_user_model()(username=f'voter{i}') for i in range(3)
+        )
+        self.voters = list(get_user_model().objects.filter(username__startswith='voter').order_by('id'))
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.admin)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+        self.url = f'/api/polls/{self.poll.id}/votes/bulk/'
+
+    def test_bulk_votes(self):
+        other_choice = Choice.objects.create(
+            poll=Poll.objects.create(question='Other Poll', creator=self.admin),
+            body='Other'
+        )
+        Vote.objects.create(poll=self.poll, choice=self.choice1, voter=self.voters[2])
+        services.rebuild_vote_counters()
+
+        votes = [
+            {'voter': self.voters[0].pk, 'choice': str(self.choice1.id)},
+            {'voter': self.voters[1].pk, 'choice': str(self.choice1.id)},
+            {'voter': self.voters[0].pk, 'choice': str(self.choice2.id)},
+            {'voter': self.voters[2].pk, 'choice': str(self.choice2.id)},
+            {'voter': self.voters[1].pk, 'choice': str(other_choice.id)},
+            {'voter': 'nobody', 'choice': str(self.choice1.id)},
+        ]
+
+        response = self.client.post(self.url, {'votes': votes}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['superseded', 'created', 'created', 'changed', 'invalid', 'invalid']
+        )
+
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.poll.refresh_from_db()
+        self.assertEqual((self.choice1.vote_count, self.choice2.vote_count, self.poll.total_votes), (1, 2, 3))
+        self.assertEqual(Vote.objects.get(voter=self.voters[0]).choice_id, self.choice2.id)
+
+    def test_bulk_votes_are_applied_in_chunks(self):
+        votes = [(voter.pk, self.choice1.id) for voter in self.voters]
+
+        with CaptureQueriesContext(connection) as queries:
+            results = services.cast_votes(self.poll.id, votes, chunk_size=2)
+
+        self.assertEqual([result['status'] for result in results], ['created'] * 3)
+        self.assertEqual(Vote.objects.filter(poll=self.poll).count(), 3)
+        # one upsert per chunk
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT INTO "polls_vote"')]), 2)
+
+    def test_bulk_votes_require_staff(self):
+        token = Token.objects.create(user=self.voters[0])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        response = self.client.post(
+            self.url,
+            {'votes': [{'voter': self.voters[0].pk, 'choice': str(self.choice1.id)}]},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class VoteBufferTest(APITestCase):
+    """Test the write-behind vote buffer and its flusher"""
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+
+        self.user = PollTest.get_user()
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+
+        get_user_model().objects.bulk_create(get_user_model()(username=f'voter{i}') for i in range(3))
+        self.voters = list(get_user_model().objects.filter(username__startswith='voter').order_by('id'))
+
+    def new_buffer(self):
+        buffer = vote_buffer.JournalVoteBuffer(self.journal_dir, fsync=False)
+        self.addCleanup(buffer.close)
+
+        return buffer
+
+    def test_flush_coalesces_votes_per_voter(self):
+        buffer = self.new_buffer()
+        buffer.put(self.poll.id, self.voters[0].pk, self.choice1.id)
+        buffer.put(self.poll.id, self.voters[1].pk, self.choice1.id)
+        buffer.put(self.poll.id, self.voters[0].pk, self.choice2.id)
+
+        self.assertEqual(buffer.stats()['depth'], 2)
+
+        flushed = vote_buffer.VoteFlusher(buffer).flush()
+
+        self.assertEqual(flushed, 2)
+        self.assertEqual(buffer.stats()['depth'], 0)
+        self.assertEqual(Vote.objects.get(voter=self.voters[0]).choice_id, self.choice2.id)
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 2)
+
+    def test_no_votes_lost_across_flusher_restarts(self):
+        buffer = self.new_buffer()
+        flusher = vote_buffer.VoteFlusher(buffer, batch_size=1)
+
+        for voter in self.voters:
+            buffer.put(self.poll.id, voter.pk, self.choice1.id)
+
+        # a batch is in flight when the process dies
+        buffer.take(1)
+        flusher.flush()
+        buffer.close()
+
+        restarted = self.new_buffer()
+
+        # the vote in flight and the pending one, not the one flushed
+        self.assertEqual(restarted.stats()['adopted_votes'], 2)
+
+        vote_buffer.VoteFlusher(restarted).drain()
+
+        self.assertEqual(Vote.objects.filter(poll=self.poll).count(), 3)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.vote_count, 3)
+        # the adopted journal is gone, nothing is flushed twice by a third buffer
+        self.assertEqual(self.new_buffer().stats()['adopted_votes'], 0)
+
+    def test_flushed_votes_are_not_replayed(self):
+        buffer = self.new_buffer()
+        buffer.put(self.poll.id, self.voters[0].pk, self.choice1.id)
+        buffer.put(self.poll.id, self.voters[1].pk, self.choice1.id)
+        vote_buffer.VoteFlusher(buffer, batch_size=1).flush()
+
+        # the voter changes the flushed vote directly, then the process dies with the other vote pending
+        services.cast_vote(self.poll.id, self.choice2.id, self.voters[0].pk)
+        buffer.close()
+
+        restarted = self.new_buffer()
+        self.assertEqual(restarted.stats()['adopted_votes'], 1)
+
+        vote_buffer.VoteFlusher(restarted).drain()
+
+        self.assertEqual(Vote.objects.get(voter=self.voters[0]).choice_id, self.choice2.id)
+        self.assertEqual(Vote.objects.get(voter=self.voters[1]).choice_id, self.choice1.id)
+
+    def test_vote_put_while_in_flight_survives_the_ack(self):
+        buffer = self.new_buffer()
+        buffer.put(self.poll.id, self.voters[0].pk, self.choice1.id)
+        batch = buffer.take(1)
+        buffer.put(self.poll.id, self.voters[0].pk, self.choice2.id)
+        buffer.ack(batch)
+        buffer.close()
+
+        self.assertEqual(self.new_buffer().take(10), [(str(self.poll.id), self.voters[0].pk, str(self.choice2.id))])
+
+    def test_failed_flush_keeps_votes_buffered(self):
+        buffer = self.new_buffer()
+        flusher = vote_buffer.VoteFlusher(buffer)
+        buffer.put(self.poll.id, self.voters[0].pk, self.choice1.id)
+
+        with patch.object(services, 'cast_votes', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError), self.assertLogs('polls.vote_buffer', level='ERROR'):
+                flusher.flush()
+
+        self.assertEqual(buffer.stats()['depth'], 1)
+        self.assertEqual(flusher.stats()['failed_batches'], 1)
+
+        flusher.flush()
+
+        self.assertTrue(Vote.objects.filter(voter=self.voters[0]).exists())
+
+    def test_create_vote_is_buffered(self):
+        buffer = self.new_buffer()
+        token = Token.objects.create(user=self.voters[0])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        with override_settings(POLLS_VOTE_BUFFER={'ENABLED': True}), \
+                patch.object(vote_buffer, 'get_vote_buffer', return_value=buffer):
+            response = client.post(f'/api/polls/{self.poll.id}/choices/{self.choice1.id}/vote/')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Vote.objects.exists())
+
+        vote_buffer.VoteFlusher(buffer).flush()
+
+        self.assertEqual(Vote.objects.get().voter, self.voters[0])
+
+
+class PollResultsTest(AuthenticatedAPITestCase):
+    """Test the poll results endpoints"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1', vote_count=1)
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2', vote_count=2)
+
+    def test_results(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/polls/{self.poll.id}/results/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_votes'], 3)
+        self.assertEqual(
+            sorted((choice['body'], choice['votes'], choice['percentage']) for choice in response.data['choices']),
+            [('Choice 1', 1, 33.33), ('Choice 2', 2, 66.67)]
+        )
+        # token lookup + results
+        self.assertEqual(len(queries), 2)
+        self.assertIn('ETag', response)
+
+    def test_results_of_missing_poll(self):
+        response = self.client.get(f'/api/polls/{uuid.uuid4()}/results/')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_results(self):
+        empty_poll = Poll.objects.create(question='No choices yet', creator=self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/polls/results/',
+                {'ids': f'{empty_poll.id},{uuid.uuid4()},{self.poll.id}'}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(result['poll'], result['total_votes']) for result in response.data['results']],
+            [(str(empty_poll.id), 0), (str(self.poll.id), 3)]
+        )
+        self.assertEqual(len(queries), 2)
+
+    def test_batch_results_rejects_bad_ids(self):
+        response = self.client.get('/api/polls/results/', {'ids': 'not-a-poll'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class QueryPlanTest(AuthenticatedAPITestCase):
+    """Test that no endpoint query has to scan the whole vote table"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+        self.admin = get_user_model().objects.create_user(username='admin', password='test', is_staff=True)
+        self.admin_token = Token.objects.create(user=self.admin)
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+
+    def exercise_endpoints(self):
+        poll_url = f'/api/polls/{self.poll.id}/'
+        choice_url = f'{poll_url}choices/{self.choice1.id}/'
+        admin = {'HTTP_AUTHORIZATION': f'Token {self.admin_token.key}'}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get('/api/polls/')
+            self.client.get(poll_url)
+            self.client.get(f'{poll_url}results/')
+            self.client.get('/api/polls/results/', {'ids': str(self.poll.id)})
+            self.client.get(f'{poll_url}choices/')
+            self.client.post(f'{choice_url}vote/')
+            self.client.post(f'{poll_url}choices/{self.choice2.id}/vote/')
+            self.client.post(f'{poll_url}choices/{self.choice2.id}/vote/')
+            self.client.get(f'{choice_url}votes/')
+            self.client.put(choice_url, {'body': 'Updated'}, format='json')
+            self.client.post(f'{poll_url}votes/bulk/', {'votes': [{'voter': self.user.pk, 'choice': str(self.choice1.id)}]}, format='json', **admin)
+            self.client.delete(f'{poll_url}choices/{self.choice2.id}/')
+            self.client.delete(poll_url)
+
+    def test_no_full_scan_of_votes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.exercise_endpoints()
+
+        statements = {q['sql'] for q in queries if 'polls_vote' in q['sql'] and 'SAVEPOINT' not in q['sql']}
+        self.assertTrue(statements)
+
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+
+                # subqueries refer to the table through aliases (U0, U1, ...)
+                names = {'polls_vote', *re.findall(r'"polls_vote" (\w+)', sql)}
+                full_scans = [step for step in plan if re.match(r'SCAN (\w+)', step) and step.split()[1] in names]
+                self.assertFalse(full_scans, f'Full scan of polls_vote:\n{sql}\n' + '\n'.join(plan))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class SqlitePragmaTest(APITestCase):
+    """Test the pragmas applied to new SQLite connections"""
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_file_database_uses_wal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        other = connection.copy()
+        other.settings_dict['NAME'] = f'{directory}/polls.sqlite3'
+        other.settings_dict['OPTIONS'] = {}
+        try:
+            with other.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+        finally:
+            other.close()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'BEGIN IMMEDIATE is SQLite syntax')
+class WriteTransactionTest(TransactionTestCase):
+    """Test that only the transactions that read, then write take the SQLite write lock up front"""
+
+    def test_begin_immediate(self):
+        with CaptureQueriesContext(connection) as queries:
+            with write_transaction():
+                Poll.objects.exists()
+
+            with transaction.atomic():
+                Poll.objects.exists()
+
+            with write_transaction():
+                # nested, a savepoint
+                with write_transaction():
+                    Poll.objects.exists()
+
+        self.assertEqual([q['sql'] for q in queries if q['sql'].startswith('BEGIN')], ['BEGIN IMMEDIATE', 'BEGIN', 'BEGIN IMMEDIATE'])
+        # the connection keeps the configured mode for the other transactions
+        self.assertIsNone(connection.transaction_mode)
+
+
+class ReadReplicaTest(AuthenticatedAPITestCase):
+    """Test the routing of read-only requests to the read replica"""
+
+    def setUp(self):
+        super().setUp()
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.router = ReadReplicaRouter()
+
+    def test_router(self):
+        with patch.dict(settings.DATABASES, {'replica': {}}):
+            self.assertIsNone(self.router.db_for_read(Poll))
+
+            with read_from_replica():
+                self.assertEqual(self.router.db_for_read(Poll), 'replica')
+                self.assertIsNone(self.router.db_for_write(Poll))
+
+            self.assertIsNone(self.router.db_for_read(Poll))
+
+        # no replica configured
+        with read_from_replica():
+            self.assertIsNone(self.router.db_for_read(Poll))
+
+        self.assertFalse(self.router.allow_migrate('replica', 'polls'))
+        self.assertTrue(self.router.allow_migrate('default', 'polls'))
+
+    def routed_reads(self, method, url, **kwargs):
+        """Return whether the reads made while handling the request were routed to the replica"""
+        routed = []
+        db_for_read = ReadReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            with patch.dict(settings.DATABASES, {'replica': {}}):
+                routed.append(db_for_read(router, model, **hints) == 'replica')
+            return None
+
+        with patch.object(ReadReplicaRouter, 'db_for_read', record):
+            response = getattr(self.client, method)(url, **kwargs)
+
+        self.assertLess(response.status_code, 400)
+        self.assertTrue(routed)
+        return set(routed)
+
+    def test_reads_routed_to_replica(self):
+        self.assertEqual(self.routed_reads('get', '/api/polls/'), {True})
+        self.assertEqual(self.routed_reads('get', f'/api/polls/{self.poll.id}/choices/'), {True})
+
+    def test_cached_responses_built_from_primary(self):
+        # a lagging replica must not fill the cache under the new version
+        cache.clear()
+
+        routed = []
+        db_for_read = ReadReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            with patch.dict(settings.DATABASES, {'replica': {}}):
+                routed.append((model, db_for_read(router, model, **hints) == 'replica'))
+            return None
+
+        with patch.object(ReadReplicaRouter, 'db_for_read', record):
+            for url in (f'/api/polls/{self.poll.id}/', f'/api/polls/{self.poll.id}/results/'):
+                self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.assertEqual({replica for model, replica in routed if model in (Poll, Choice)}, {False})
+
+    def test_writes_stay_on_primary(self):
+        self.assertEqual(
+            self.routed_reads('post', f'/api/polls/{self.poll.id}/choices/', data={'body': 'Choice'}),
+            {False}
+        )
+
+
+class CachedTokenAuthenticationTest(AuthenticatedAPITestCase):
+    """Test the token -> user lookup cache"""
+
+    def setUp(self):
+        authentication.reset_token_cache()
+        self.addCleanup(authentication.reset_token_cache)
+
+        super().setUp()
+
+    def test_lookup_is_cached(self):
+        self.client.get('/api/polls/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/polls/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q['sql'] for q in queries if 'authtoken_token' in q['sql']])
+        self.assertEqual(authentication.stats()['hits'], 1)
+        self.assertEqual(authentication.stats()['misses'], 1)
+
+    def test_deleted_token_is_evicted(self):
+        self.assertEqual(self.client.get('/api/polls/').status_code, status.HTTP_200_OK)
+
+        self.token.delete()
+
+        self.assertEqual(self.client.get('/api/polls/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(authentication.stats()['size'], 0)
+
+    def test_deactivated_user_is_evicted(self):
+        self.assertEqual(self.client.get('/api/polls/').status_code, status.HTTP_200_OK)
+
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.client.get('/api/polls/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_lru_and_ttl(self):
+        now = [0]
+        token_cache = authentication.TokenCache(max_size=2, ttl=10, clock=lambda: now[0])
+        other = get_user_model().objects.create_user(username='other', password='other')
+
+        token_cache.set('a', self.user, None)
+        token_cache.set('b', other, None)
+        token_cache.get('a')
+        token_cache.set('c', self.user, None)
+
+        # 'b' was the least recently used
+        self.assertIsNone(token_cache.get('b'))
+        self.assertEqual(token_cache.get('a'), (self.user, None))
+
+        now[0] = 10
+        self.assertIsNone(token_cache.get('a'))
+        self.assertEqual(token_cache.stats()['evictions'], 1)
+
+    def test_lookup_racing_an_eviction_is_not_cached(self):
+        token_cache = authentication.TokenCache(max_size=10, ttl=10)
+
+        generation = token_cache.generation
+        token_cache.evict(self.token.key)
+        token_cache.set(self.token.key, self.user, self.token, generation)
+
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_stats_endpoint(self):
+        self.assertEqual(self.client.get('/api/account/token-cache/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get('/api/account/token-cache/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_ratio', response.data)
+
+
+class AsyncViewsTest(AuthenticatedAPITestCase):
+    """Test the ASGI-native endpoints against their DRF counterparts"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.headers = {'Authorization': f'Token {self.token.key}'}
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+
+    async def test_requires_token(self):
+        response = await self.async_client.get('/api/async/polls/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get('/api/async/polls/', headers={'Authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+    async def test_detail_and_results_match_sync_views(self):
+        for path in (f'/api/polls/{self.poll.id}/', f'/api/polls/{self.poll.id}/results/'):
+            expected = await sync_to_async(self.client.get)(path)
+            response = await self.async_client.get(path.replace('/api/', '/api/async/'), headers=self.headers)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, expected.content)
+            self.assertEqual(response['ETag'], expected['ETag'])
+
+            response = await self.async_client.get(
+                path.replace('/api/', '/api/async/'), headers={**self.headers, 'If-None-Match': expected['ETag']}
+            )
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = await self.async_client.get(f'/api/async/polls/{uuid.uuid4()}/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_walk_poll_pages(self):
+        for i in range(4):
+            await Poll.objects.acreate(question=f'Poll {i}', creator=self.user)
+
+        expected = (await sync_to_async(self.client.get)('/api/polls/')).json()['results']
+
+        results = []
+        url = '/api/async/polls/?page_size=2'
+        while url:
+            response = await self.async_client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results += response.json()['results']
+            url = response.json()['next']
+
+        self.assertEqual(results, expected)
+
+    async def test_vote(self):
+        url = f'/api/async/polls/{self.poll.id}/choices/{self.choice1.id}/vote/'
+
+        response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['choice'], str(self.choice1.id))
+
+        response = await self.async_client.post(url, headers=self.headers)
+        self.assertEqual(response.json(), {'details': 'vote already exists'})
+
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        other_poll = await Poll.objects.acreate(question='Other', creator=self.user)
+        response = await self.async_client.post(
+            f'/api/async/polls/{other_poll.id}/choices/{self.choice1.id}/vote/', headers=self.headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual((await Poll.objects.aget(pk=self.poll.pk)).total_votes, 1)
+
+
+@override_settings(POLLS_LIVE_RESULTS={'HEARTBEAT': 0.01})
+class LiveResultsTest(AuthenticatedAPITestCase):
+    """Test the live results stream and its fan-out hub"""
+
+    def setUp(self):
+        super().setUp()
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, body='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, body='Choice 2')
+
+        # a hub without its thread, refreshed by the tests
+        self.backend = live.MemoryBackend()
+        self.hub = live.LiveResultsHub(self.backend)
+        self.addCleanup(self.hub.close)
+
+        for name, value in (('get_backend', self.backend), ('get_hub', self.hub)):
+            patcher = patch.object(live, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def read_event(self, stream):
+        chunk = next(stream)
+        while chunk.startswith(b':'):
+            chunk = next(stream)
+
+        event, data = chunk.decode().strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    def vote(self, choice):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/polls/{self.poll.id}/choices/{choice.id}/vote/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_snapshot_then_deltas(self):
+        response = self.client.get(f'/api/polls/{self.poll.id}/results/stream/', HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = iter(response.streaming_content)
+        event, snapshot = self.read_event(stream)
+        self.assertEqual(event, 'snapshot')
+        self.assertEqual(snapshot['total_votes'], 0)
+
+        self.vote(self.choice1)
+        self.hub.refresh()
+
+        event, delta = self.read_event(stream)
+        self.assertEqual(event, 'delta')
+        self.assertEqual(delta['total_votes'], 1)
+        self.assertEqual([(choice['id'], choice['votes']) for choice in delta['choices']], [(str(self.choice1.id), 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/polls/{self.poll.id}/')
+        self.hub.refresh()
+
+        self.assertEqual(self.read_event(stream)[0], 'deleted')
+        response.close()
+        self.assertEqual(self.hub._feeds, {})
+
+    async def aread_event(self, stream):
+        chunk = await anext(stream)
+        while chunk.startswith(b':'):
+            chunk = await anext(stream)
+
+        event, data = chunk.decode().strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    async def test_asgi_stream(self):
+        # under ASGI the events are sent as they come, not collected first
+        response = await self.async_client.get(
+            f'/api/polls/{self.poll.id}/results/stream/',
+            headers={'Authorization': f'Token {self.token.key}', 'Accept': 'text/event-stream'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+
+        stream = aiter(response.streaming_content)
+        event, snapshot = await self.aread_event(stream)
+        self.assertEqual((event, snapshot['total_votes']), ('snapshot', 0))
+
+        await sync_to_async(self.vote)(self.choice1)
+        await sync_to_async(self.hub.refresh)()
+
+        event, delta = await self.aread_event(stream)
+        self.assertEqual((event, delta['total_votes']), ('delta', 1))
+
+        # as the ASGI handler does once the client is gone
+        await stream.aclose()
+        await sync_to_async(response.close)()
+        self.assertEqual(self.hub._feeds, {})
+
+    def test_missing_poll(self):
+        response = self.client.get(f'/api/polls/{uuid.uuid4()}/results/stream/', HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.hub._feeds, {})
+
+    def test_one_computation_for_all_subscribers(self):
+        subscriptions = [self.hub.subscribe(self.poll.id) for _ in range(5)]
+
+        for choice in (self.choice1, self.choice2, self.choice2):
+            with self.captureOnCommitCallbacks(execute=True):
+                services.cast_vote(self.poll.id, choice.id, get_user_model().objects.create(username=str(uuid.uuid4())).pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.hub.refresh(), 1)
+
+        self.assertEqual(len(queries), 1)
+
+        # the three votes are coalesced into one delta per subscriber
+        for subscription in subscriptions:
+            delta = subscription.get(timeout=0)
+            self.assertEqual(delta['total_votes'], 3)
+            self.assertEqual(sorted(choice['votes'] for choice in delta['choices']), [1, 2])
+            self.assertIsNone(subscription.get(timeout=0))
+
+        # nothing changed since
+        self.assertEqual(self.hub.refresh(), 0)
+
+    def test_pending_deltas_are_merged(self):
+        first = {'poll': 'p', 'total_votes': 1, 'choices': [{'id': 'a', 'votes': 1}], 'removed': []}
+        second = {'poll': 'p', 'total_votes': 3, 'choices': [{'id': 'b', 'votes': 2}], 'removed': ['a']}
+
+        self.assertEqual(
+            live.merge_deltas(first, second),
+            {'poll': 'p', 'total_votes': 3, 'choices': [{'id': 'b', 'votes': 2}], 'removed': ['a']}
+        )
+
+    def test_cache_version_backend(self):
+        backend = live.CacheVersionBackend()
+
+        self.assertEqual(backend.poll({self.poll.id}), set())
+        bump_poll_version(self.poll.id)
+        self.assertEqual(backend.poll({self.poll.id}), {self.poll.id})
+        self.assertEqual(backend.poll({self.poll.id}), set())
+
+
+class FastJSONTest(APITestCase):
+    """Test that the fast renderer and parser match DRF's JSON renderer and parser"""
+
+    def setUp(self):
+        self.user = PollTest.get_user()
+        poll = Poll.objects.create(question='Quoted "question" \\ with\nnewline, é, 😀 and \u2028\u2029', creator=self.user)
+        Choice.objects.create(poll=poll, body='Choice \x01', vote_count=2)
+        Choice.objects.create(poll=poll, body='Choice 2', vote_count=1)
+
+    def assertRendersLikeDRF(self, data, accepted_media_type=None):
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(data, accepted_media_type, {}),
+            JSONRenderer().render(data, accepted_media_type, {})
+        )
+
+    def test_render_payloads(self):
+        polls = Poll.objects.prefetch_related('choices')
+
+        self.assertRendersLikeDRF(PollSerializer(polls, many=True).data)
+        self.assertRendersLikeDRF(ChoiceSerializer(Choice.objects.all(), many=True).data)
+        self.assertRendersLikeDRF([results for results, _ in get_results(polls.values_list('id', flat=True)).values()])
+
+    def test_render_values(self):
+        self.assertRendersLikeDRF({
+            'uuid': uuid.uuid4(),
+            'datetime': timezone.now(),
+            'naive': datetime.datetime(2024, 1, 2, 3, 4, 5, 678901),
+            'date': datetime.date(2024, 1, 2),
+            'time': datetime.time(3, 4, 5, 678901),
+            'timedelta': datetime.timedelta(seconds=90),
+            'decimal': decimal.Decimal('1.50'),
+            'lazy': gettext_lazy('Invalid token.'),
+            'int_keys': {1: 'a'},
+            'big': 2 ** 70,
+            'float': 33.33,
+            'none': None,
+        })
+        self.assertRendersLikeDRF(None)
+        self.assertRendersLikeDRF({'a': [1, 2]}, 'application/json; indent=4')
+
+    def test_fallback_without_orjson(self):
+        with patch.object(renderers, 'orjson', None):
+            self.assertRendersLikeDRF({'uuid': uuid.uuid4()})
+
+    def test_parse(self):
+        for body in (b'{"votes": [{"voter": 1, "choice": "a"}], "text": "\\u00e9\xc3\xa9"}', b'[1, 2.5, null]', b'123456789012345678901234567890'):
+            self.assertEqual(
+                parsers.FastJSONParser().parse(BytesIO(body), 'application/json', {}),
+                JSONParser().parse(BytesIO(body), 'application/json', {})
+            )
+
+        for body in (b'{"a": NaN}', b'{"a": ', b'\xff'):
+            with self.assertRaises(ParseError):
+                parsers.FastJSONParser().parse(BytesIO(body), 'application/json', {})
+
+    def test_api_response(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        response = self.client.get('/api/polls/')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class FastReadSerializerTest(AuthenticatedAPITestCase):
+    """Test that the values() based read path gives the ModelSerializer output"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+        self.polls = [Poll.objects.create(question=f'Poll {i}', creator=self.user) for i in range(3)]
+        self.choices = [Choice.objects.create(poll=self.polls[0], body=f'Choice {i}', vote_count=i) for i in range(3)]
+        services.cast_vote(self.polls[0].id, self.choices[1].id, self.user.pk)
+
+    def assertSameJSON(self, fast_data, serializer_data):
+        self.assertEqual(JSONRenderer().render(fast_data), JSONRenderer().render(serializer_data))
+
+    def test_same_output_as_model_serializers(self):
+        for serializer_class, queryset in (
+            (PollSerializer, Poll.objects.order_by('id').prefetch_related('choices')),
+            (ChoiceSerializer, Choice.objects.order_by('id')),
+            (VoteSerializer, Vote.objects.order_by('id')),
+        ):
+            fast = FastReadSerializer(serializer_class)
+
+            self.assertSameJSON(
+                fast.to_representation(fast.values(queryset.prefetch_related(None))),
+                serializer_class(queryset, many=True).data
+            )
+
+    def test_endpoints(self):
+        poll = Poll.objects.get(pk=self.polls[0].pk)
+
+        response = self.client.get('/api/polls/')
+        self.assertSameJSON(
+            response.data['results'],
+            PollSerializer(Poll.objects.order_by('-pub_date', '-id'), many=True).data
+        )
+
+        response = self.client.get(f'/api/polls/{poll.id}/')
+        self.assertSameJSON(response.data, PollSerializer(poll).data)
+
+        response = self.client.get(f'/api/polls/{poll.id}/choices/')
+        self.assertSameJSON(response.data['results'], ChoiceSerializer(Choice.objects.order_by('id'), many=True).data)
+
+        response = self.client.get(f'/api/polls/{poll.id}/choices/{self.choices[1].id}/votes/')
+        self.assertSameJSON(response.data['results'], VoteSerializer(Vote.objects.all(), many=True).data)
+
+        self.assertEqual(self.client.get('/api/polls/not-a-uuid/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_field_selection(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/polls/', {'fields': 'question,id'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([list(poll) for poll in response.data['results']], [['id', 'question']] * 3)
+        self.assertFalse([q for q in queries if 'polls_choice' in q['sql']])
+
+        # the detail is cached per field selection
+        url = f'/api/polls/{self.polls[0].id}/'
+        self.assertEqual(list(self.client.get(url, {'fields': 'id,choices'}).data), ['id', 'choices'])
+        self.assertEqual(list(self.client.get(url, {'fields': 'question'}).data), ['question'])
+        self.assertIn('choices', self.client.get(url).data)
+
+        response = self.client.get('/api/polls/', {'fields': 'id,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expand(self):
+        url = f'/api/polls/{self.polls[0].id}/'
+        # fill the token cache
+        self.client.get(url)
+
+        # without choices.votes the votes are not even queried
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/polls/', {'fields': 'id', 'expand': ''})
+        self.assertEqual([list(poll) for poll in response.data['results']], [['id']] * 3)
+        self.assertEqual(count_queries(queries), 1)
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id', 'expand': 'choices.votes'})
+
+        self.assertEqual(count_queries(queries), 3)
+        self.assertEqual(list(response.data), ['id', 'choices'])
+        self.assertEqual(list(response.data['choices'][0]), [*ChoiceSerializer().fields, 'votes'])
+        self.assertSameJSON(
+            [vote for choice in response.data['choices'] for vote in choice['votes']],
+            VoteSerializer(Vote.objects.all(), many=True).data
+        )
+
+        # expansions are cached apart from the default payload
+        self.assertNotIn('votes', self.client.get(url, {'fields': 'id,choices'}).data['choices'][0])
+        self.assertNotIn('choices', self.client.get(url, {'expand': ''}).data)
+
+        choice_url = f'{url}choices/{self.choices[1].id}/'
+        response = self.client.get(choice_url, {'fields': 'id,body', 'expand': 'votes'})
+        self.assertEqual(response.data, {
+            'id': str(self.choices[1].id),
+            'body': 'Choice 1',
+            'votes': VoteSerializer(Vote.objects.all(), many=True).data,
+        })
+        self.assertSameJSON(self.client.get(choice_url).data, ChoiceSerializer(Choice.objects.get(pk=self.choices[1].pk)).data)
+
+        for params in ({'expand': 'votes'}, {'expand': 'choices.voters'}):
+            self.assertEqual(self.client.get('/api/polls/', params).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RequestObjectCacheTest(AuthenticatedAPITestCase):
+    """Test that permissions and views of a request load the poll at most once"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choice = Choice.objects.create(poll=self.poll, body='Choice')
+
+        # fill the token cache and the poll ownership cache
+        self.client.get('/api/polls/')
+        ownership.owned_poll_ids(self.user.pk)
+
+    def assertPollLookups(self, expected, make_request, expected_status):
+        with CaptureQueriesContext(connection) as queries:
+            response = make_request()
+
+        self.assertEqual(response.status_code, expected_status)
+
+        lookups = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "polls_poll"' in q['sql']]
+        self.assertEqual(len(lookups), expected, '\n'.join(lookups))
+
+    def test_choice_endpoints(self):
+        url = f'/api/polls/{self.poll.id}/choices/'
+
+        # the creator check is answered by the ownership cache
+        self.assertPollLookups(0, lambda: self.client.get(url), status.HTTP_200_OK)
+        self.assertPollLookups(0, lambda: self.client.post(url, {'body': 'New'}), status.HTTP_201_CREATED)
+        self.assertPollLookups(0, lambda: self.client.get(f'{url}{self.choice.id}/'), status.HTTP_200_OK)
+        self.assertPollLookups(
+            0,
+            lambda: self.client.put(f'{url}{self.choice.id}/', {'body': 'Changed'}),
+            status.HTTP_200_OK
+        )
+        self.assertPollLookups(0, lambda: self.client.delete(f'{url}{self.choice.id}/'), status.HTTP_204_NO_CONTENT)
+
+    def test_poll_endpoints(self):
+        url = f'/api/polls/{self.poll.id}/'
+
+        self.assertPollLookups(1, lambda: self.client.put(url, {'question': 'Changed'}, format='json'), status.HTTP_200_OK)
+        # deletion marks the poll without loading it (polls.deletion)
+        self.assertPollLookups(0, lambda: self.client.delete(url), status.HTTP_204_NO_CONTENT)
+
+    def test_other_users_are_denied(self):
+        other = get_user_model().objects.create_user(username='other', password='secret')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}')
+
+        url = f'/api/polls/{self.poll.id}/'
+        self.assertEqual(self.client.put(url, {'question': 'Changed'}, format='json').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(f'{url}choices/{self.choice.id}/').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(f'/api/polls/{uuid.uuid4()}/choices/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PollOwnershipTest(APITestCase):
+    """Test the cached poll ownership checks"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = PollTest.get_user()
+        self.other = get_user_model().objects.create_user(username='other', password='secret')
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+
+    def test_owned_polls_are_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(ownership.user_owns_poll(self.user.pk, self.poll.id))
+            self.assertTrue(ownership.user_owns_poll(self.user.pk, str(self.poll.id)))
+
+        self.assertEqual(count_queries(queries), 1)
+
+        self.assertFalse(ownership.user_owns_poll(self.other.pk, self.poll.id))
+        self.assertFalse(ownership.user_owns_poll(None, self.poll.id))
+        self.assertFalse(ownership.user_owns_poll(self.user.pk, 'not-a-uuid'))
+
+    def test_create_and_delete_drop_the_set(self):
+        self.assertEqual(ownership.owned_poll_ids(self.user.pk), {str(self.poll.id)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            poll = Poll.objects.create(question='Another Poll', creator=self.user)
+        self.assertEqual(ownership.owned_poll_ids(self.user.pk), {str(self.poll.id), str(poll.id)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poll.delete()
+        self.assertEqual(ownership.owned_poll_ids(self.user.pk), {str(poll.id)})
+        self.assertFalse(ownership.user_owns_poll(self.user.pk, self.poll.id))
+
+    def test_polls_missing_from_the_set_are_checked(self):
+        ownership.owned_poll_ids(self.user.pk)
+
+        # created without invalidating the cached set
+        poll = Poll.objects.bulk_create([Poll(question='Bulk Poll', creator=self.user)])[0]
+        self.assertTrue(ownership.user_owns_poll(self.user.pk, poll.id))
+
+    @override_settings(POLLS_OWNERSHIP_CACHE={'MAX_SIZE': 1})
+    def test_too_many_polls(self):
+        Poll.objects.create(question='Another Poll', creator=self.user)
+
+        self.assertIsNone(ownership.owned_poll_ids(self.user.pk))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(ownership.user_owns_poll(self.user.pk, self.poll.id))
+
+        self.assertEqual(count_queries(queries), 1)
+        # an exists() on (id, creator_id), not a load of the user's polls
+        self.assertIn('"polls_poll"."creator_id" = ', queries[0]['sql'])
+        self.assertTrue(queries[0]['sql'].endswith('LIMIT 1'))
+
+
+class BulkChoicesTest(AuthenticatedAPITestCase):
+    """Test writing choices in bulk, nested in the poll or as a list"""
+
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+        # fill the token cache
+        self.client.get('/api/polls/')
+
+    def create_poll(self, choices):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/polls/',
+                {'question': 'Test Poll', 'choices': [{'body': f'Choice {i}'} for i in range(choices)]},
+                format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+        return response, count_queries(queries)
+
+    def test_create_poll_with_choices(self):
+        response, queries = self.create_poll(3)
+
+        self.assertEqual(sorted(choice['body'] for choice in response.data['choices']), ['Choice 0', 'Choice 1', 'Choice 2'])
+        self.assertEqual(Choice.objects.filter(poll_id=response.data['id']).count(), 3)
+
+        # one request and the same queries for any number of choices
+        self.assertEqual(self.create_poll(20)[1], queries)
+
+        response = self.client.post('/api/polls/', {'question': 'No choices'}, format='json')
+        self.assertEqual(response.data['choices'], [])
+
+    def test_replace_choices(self):
+        poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        kept, removed = [Choice.objects.create(poll=poll, body=f'Choice {i}') for i in range(2)]
+
+        other = get_user_model().objects.create_user(username='other', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            services.cast_vote(poll.id, removed.id, self.user.pk)
+            services.cast_vote(poll.id, kept.id, other.pk)
+
+        response = self.client.put(
+            f'/api/polls/{poll.id}/',
+            {'question': 'Changed', 'choices': [{'id': str(kept.id), 'body': 'Kept'}, {'body': 'New'}]},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(sorted(choice['body'] for choice in response.data['choices']), ['Kept', 'New'])
+        self.assertFalse(Choice.objects.filter(pk=removed.pk).exists())
+
+        poll.refresh_from_db()
+        self.assertEqual(poll.total_votes, 1)
+        self.assertEqual(Choice.objects.get(pk=kept.pk).vote_count, 1)
+
+        # without choices the choices are left alone
+        response = self.client.put(f'/api/polls/{poll.id}/', {'question': 'Again'}, format='json')
+        self.assertEqual(len(response.data['choices']), 2)
+
+        # ids of other polls' choices are refused
+        foreign = Choice.objects.create(poll=Poll.objects.create(question='Other', creator=self.user), body='Other')
+        response = self.client.put(
+            f'/api/polls/{poll.id}/',
+            {'question': 'Again', 'choices': [{'id': str(foreign.id), 'body': 'Stolen'}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Choice.objects.get(pk=foreign.pk).body, 'Other')
+
+    def test_choice_list_accepts_an_array(self):
+        poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        url = f'/api/polls/{poll.id}/choices/'
+
+        def post(choices):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, [{'body': f'Choice {i}'} for i in range(choices)], format='json')
+
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+            self.assertEqual(len(response.data), choices)
+
+            return count_queries(queries)
+
+        # the first request also fills the ownership cache
+        post(1)
+        self.assertEqual(post(2), post(20))
+        self.assertEqual(Choice.objects.filter(poll=poll).count(), 23)
+
+        self.assertEqual(self.client.post(url, [], format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(url, [{'body': ''}], format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.settings(POLLS_BULK_CHOICES_MAX_ITEMS=2):
+            response = self.client.post(url, [{'body': 'A'}, {'body': 'B'}, {'body': 'C'}], format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PasswordHashingTest(APITestCase):
+    """Test sign-up and login with the pooled password hashers"""
+
+    signup = {'username': 'newuser', 'email': 'new@test.com', 'password': 'Xk2!pollsapp', 'password2': 'Xk2!pollsapp'}
+
+    def test_hashing_runs_on_the_pool(self):
+        self.assertTrue(hashing.get_pool().run(lambda: threading.current_thread().name).startswith('password-hashing'))
+
+        response = self.client.post('/api/account/user/', self.signup, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+        user = get_user_model().objects.get(username='newuser')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+        response = self.client.post('/api/account/login/', {'username': 'newuser', 'password': 'Xk2!pollsapp'})
+        self.assertEqual(response.data['token'], user.auth_token.key)
+
+    @override_settings(PASSWORD_HASHERS=['polls.hashing.ScryptPasswordHasher', 'polls.hashing.PBKDF2PasswordHasher'])
+    def test_scrypt(self):
+        # existing PBKDF2 hashes still verify
+        self.assertTrue(check_password('secret', hashing.PBKDF2PasswordHasher().encode('secret', 'salt')))
+
+        user = get_user_model()(username='new')
+        user.set_password('secret')
+        self.assertTrue(user.password.startswith('scrypt$131072$'))
+        self.assertTrue(user.check_password('secret'))
+
+    def test_saturated_pool(self):
+        pool = hashing.HashingPool(workers=1, max_pending=0, timeout=5)
+        started, release = threading.Event(), threading.Event()
+
+        def busy():
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=pool.run, args=(busy,))
+        worker.start()
+        started.wait()
+
+        try:
+            with self.assertRaises(hashing.HashingUnavailable):
+                pool.run(lambda: None)
+
+            with patch.object(hashing, 'get_pool', return_value=pool):
+                response = self.client.post('/api/account/login/', {'username': 'nobody', 'password': 'secret'})
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        finally:
+            release.set()
+            worker.join()
+
+        try:
+            self.assertIsNone(pool.run(lambda: None))
+        finally:
+            pool.shutdown()
+
+    def test_duplicate_email(self):
+        self.client.post('/api/account/user/', self.signup, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/account/user/', {**self.signup, 'username': 'other'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('email', response.data)
+        # no lookup by email ahead of the insert
+        self.assertEqual(len([q for q in queries if '"auth_user"."email" =' in q['sql']]), 1)
+
+        # users without an email are not affected
+        for username in ('first', 'second'):
+            response = self.client.post('/api/account/user/', {**self.signup, 'username': username, 'email': ''}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+
+class SeedPollsTest(APITestCase):
+    """Test the seed_polls management command"""
+
+    def seed(self, **options):
+        call_command('seed_polls', users=30, polls=20, choices=3, votes=200, hot_polls=2, stdout=StringIO(), **options)
+
+    def test_seed(self):
+        self.seed()
+
+        self.assertEqual(get_user_model().objects.filter(username__startswith='seed').count(), 30)
+        self.assertEqual(Token.objects.count(), 30)
+        self.assertEqual(Poll.objects.count(), 20)
+        self.assertEqual(Choice.objects.count(), 60)
+
+        # the counters match the votes
+        counters = {poll.id: poll.total_votes for poll in Poll.objects.all()}
+        self.assertEqual(sum(counters.values()), Vote.objects.count())
+        services.rebuild_vote_counters()
+        self.assertEqual({poll.id: poll.total_votes for poll in Poll.objects.all()}, counters)
+
+        # the hot polls get half of the votes, at most one per user
+        self.assertEqual(sorted(counters.values())[-2:], [30, 30])
+
+        # the same seed gives the same data
+        votes = sorted(Vote.objects.values_list('id', flat=True))
+        Vote.objects.all().delete()
+        Poll.objects.all().delete()
+        get_user_model().objects.filter(username__startswith='seed').delete()
+        self.seed()
+        self.assertEqual(sorted(Vote.objects.values_list('id', flat=True)), votes)
+
+    def test_existing_prefix(self):
+        self.seed()
+
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+@override_settings(POLLS_INSTRUMENTATION={'ENABLED': True})
+class InstrumentationTest(AuthenticatedAPITestCase):
+    """Test the per-request instrumentation"""
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.registry.clear()
+        super().setUp()
+
+        Poll.objects.create(question='Test Poll', creator=self.user)
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs('polls.instrumentation', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/polls/')
+
+        timing = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(list(timing), ['db', 'serialize', 'render', 'total'])
+        self.assertIn(f'desc="{count_queries(queries)} queries"', timing['db'])
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(
+            {key: line[key] for key in ('method', 'route', 'status', 'queries')},
+            {'method': 'GET', 'route': 'polls-list', 'status': 200, 'queries': count_queries(queries)}
+        )
+        self.assertLessEqual(line['db_ms'], line['total_ms'])
+
+    async def test_async_views(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        # no sync_to_async in front of the async views
+        self.assertTrue(iscoroutinefunction(instrumentation.InstrumentationMiddleware(get_response)))
+
+        # the test connection was opened before the middleware was loaded (on the event loop's thread)
+        await sync_to_async(instrumentation.install_query_recorder)(connection)
+
+        with self.assertLogs('polls.instrumentation', 'INFO') as logs:
+            response = await self.async_client.get('/api/async/polls/', headers={'Authorization': f'Token {self.token.key}'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        # the async ORM's queries run on another thread, they are counted all the same
+        self.assertGreater(json.loads(logs.records[0].getMessage())['queries'], 0)
+
+    def test_metrics_endpoint(self):
+        with self.assertLogs('polls.instrumentation', 'INFO'):
+            for _ in range(3):
+                self.client.get('/api/polls/')
+
+            self.assertEqual(self.client.get('/api/metrics/').status_code, status.HTTP_403_FORBIDDEN)
+
+            self.user.is_staff = True
+            self.user.save()
+            response = self.client.get('/api/metrics/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        text = response.content.decode()
+        self.assertIn('# TYPE polls_request_duration_seconds histogram', text)
+        self.assertIn('polls_request_duration_seconds_bucket{method="GET",route="polls-list",le="+Inf"} 3', text)
+        self.assertIn('polls_request_queries_count{method="GET",route="polls-list"} 3', text)
+
+    def test_disabled(self):
+        with self.settings(POLLS_INSTRUMENTATION={'ENABLED': False}):
+            response = APIClient().get('/api/polls/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+
+class VotesExportTest(APITestCase):
+    """Test the streaming export of a poll's votes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = PollTest.get_user()
+        self.client.force_authenticate(self.user)
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choices = [Choice.objects.create(poll=self.poll, body=f'Choice, "{i}"') for i in range(2)]
+
+        get_user_model().objects.bulk_create(get_user_model()(username=f'voter{i}') for i in range(5))
+        voters = get_user_model().objects.filter(username__startswith='voter').order_by('id')
+        Vote.objects.bulk_create(
+            Vote(poll=self.poll, choice=self.choices[i % 2], voter=voter) for i, voter in enumerate(voters)
+        )
+
+        self.url = f'/api/polls/{self.poll.id}/votes/export/'
+        self.expected = [
+            {'id': str(vote.id), 'choice': str(vote.choice_id), 'choice_body': vote.choice.body, 'voter': vote.voter_id}
+            for vote in Vote.objects.select_related('choice').order_by('voter_id')
+        ]
+
+    def test_csv(self):
+        with self.settings(POLLS_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+
+            # the header, then a chunk per 2 votes
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="poll-{self.poll.id}-votes.csv"')
+
+        rows = list(csv.DictReader(StringIO(b''.join(chunks).decode())))
+        self.assertEqual(rows, [{**row, 'voter': str(row['voter'])} for row in self.expected])
+
+    def test_ndjson(self):
+        response = self.client.get(self.url, {'format': 'ndjson'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.expected)
+
+    def test_gzip(self):
+        plain = b''.join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    async def test_asgi(self):
+        # under ASGI the rows are sent chunk by chunk as the cursor reads them
+        token, _ = await Token.objects.aget_or_create(user=self.user)
+
+        with self.settings(POLLS_EXPORT_CHUNK_SIZE=2):
+            response = await self.async_client.get(self.url, headers={'Authorization': f'Token {token.key}'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.is_async)
+
+            chunks = [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(len(chunks), 4)
+        rows = list(csv.DictReader(StringIO(b''.join(chunks).decode())))
+        self.assertEqual(rows, [{**row, 'voter': str(row['voter'])} for row in self.expected])
+
+    def test_one_query(self):
+        response = self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(response.streaming_content)
+
+        self.assertEqual(count_queries(queries), 1)
+
+    def test_creator_only(self):
+        self.client.force_authenticate(get_user_model().objects.get(username='voter0'))
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertTrue(response.content.startswith(b'detail\r\n'))
+
+        response = self.client.get(f'/api/polls/{uuid.uuid4()}/votes/export/', {'format': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(response.content), {'detail': 'No Poll matches the given query.'})
+
+
+class PollDeletionTest(APITestCase):
+    """Test deleting polls by marking them and purging their rows in batches"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = PollTest.get_user()
+        self.client.force_authenticate(self.user)
+
+        self.poll = Poll.objects.create(question='Test Poll', creator=self.user)
+        self.choices = [Choice.objects.create(poll=self.poll, body=f'Choice {i}') for i in range(3)]
+
+        get_user_model().objects.bulk_create(get_user_model()(username=f'voter{i}') for i in range(5))
+        self.voters = list(get_user_model().objects.filter(username__startswith='voter').order_by('id'))
+        Vote.objects.bulk_create(
+            Vote(poll=self.poll, choice=self.choices[i % 2], voter=voter) for i, voter in enumerate(self.voters)
+        )
+
+        # untouched by the deletion
+        self.other = Poll.objects.create(question='Other Poll', creator=self.user)
+        other_choice = Choice.objects.create(poll=self.other, body='Other')
+        Vote.objects.create(poll=self.other, choice=other_choice, voter=self.voters[0])
+
+        self.url = f'/api/polls/{self.poll.id}/'
+
+    def assertPurged(self):
+        self.assertFalse(Poll.all_objects.filter(pk=self.poll.id).exists())
+        self.assertFalse(Choice.objects.filter(poll_id=self.poll.id).exists())
+        self.assertFalse(Vote.objects.filter(poll_id=self.poll.id).exists())
+        self.assertEqual((Choice.objects.filter(poll=self.other).count(), self.other.votes.count()), (1, 1))
+
+    def test_delete(self):
+        with self.settings(POLLS_POLL_DELETION={'BATCH_SIZE': 2}):
+            # the purge runs once the marking commits
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                response = self.client.delete(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertPurged()
+
+        # 5 votes and 3 choices in batches of 2, nothing loaded through the Collector
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len([sql for sql in deletes if sql.startswith('DELETE FROM "polls_vote"') and '"poll_id"' in sql]), 3)
+        self.assertEqual(len([sql for sql in deletes if sql.startswith('DELETE FROM "polls_choice"')]), 2)
+        self.assertFalse([query for query in queries if 'FROM "polls_choice"' in query['sql'] and 'body' in query['sql']])
+
+    def test_marked_poll_is_hidden(self):
+        # marked, not purged yet
+        with self.settings(POLLS_POLL_DELETION={'ASYNC': True}), patch.object(deletion, 'get_purger'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertTrue(Poll.all_objects.filter(pk=self.poll.id, deleted_at__isnull=False).exists())
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual([poll['id'] for poll in self.client.get('/api/polls/').data['results']], [str(self.other.id)])
+        self.assertEqual(self.client.get(f'{self.url}choices/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(f'{self.url}choices/{self.choices[0].id}/votes/').data['results'], [])
+
+        self.client.force_authenticate(self.voters[4])
+        response = self.client.post(f'{self.url}choices/{self.choices[2].id}/vote/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_marked_poll_takes_no_buffered_votes(self):
+        await sync_to_async(Poll.objects.filter(pk=self.poll.id).update)(deleted_at=timezone.now())
+        token = await Token.objects.acreate(user=self.voters[4])
+
+        with self.settings(POLLS_VOTE_BUFFER={'ENABLED': True}), patch.object(vote_buffer, 'get_vote_buffer') as get_buffer:
+            response = await self.async_client.post(
+                f'/api/async/polls/{self.poll.id}/choices/{self.choices[2].id}/vote/',
+                headers={'Authorization': f'Token {token.key}'}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        get_buffer.assert_not_called()
+
+    def test_creator_only(self):
+        self.client.force_authenticate(self.voters[0])
+
+        self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(Poll.objects.filter(pk=self.poll.id).exists())
+
+    def test_async(self):
+        with self.settings(POLLS_POLL_DELETION={'ASYNC': True}), patch.object(deletion, 'get_purger') as get_purger:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.delete(self.url).status_code, status.HTTP_204_NO_CONTENT)
+
+        get_purger.return_value.submit.assert_called_once_with(str(self.poll.id))
+        self.assertEqual(Vote.objects.filter(poll_id=self.poll.id).count(), 5)
+
+        # what the background purge (or the command after a restart) does
+        output = StringIO()
+        call_command('purge_deleted_polls', batch_size=2, stdout=output)
+
+        self.assertIn('Purged 1 deleted poll(s)', output.getvalue())
+        self.assertPurged()
+
+    def test_purge_poll(self):
+        Poll.objects.filter(pk=self.poll.id).update(deleted_at=timezone.now())
+
+        self.assertEqual(deletion.purge_poll(self.poll.id, batch_size=2), (5, 3))
+        self.assertPurged()
+
+    def test_purge_needs_mark(self):
+        deletion.purge_poll(self.poll.id)
+
+        # the votes and choices of a live poll are gone, the poll itself stays
+        self.assertTrue(Poll.objects.filter(pk=self.poll.id).exists())
+
+
+class ProfilingTest(AuthenticatedAPITestCase):
+    """Test the sampling request profiler and its endpoints"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+        super().setUp()
+        Poll.objects.create(question='Test Poll', creator=self.user)
+
+    def profiled_client(self, token=True, **config):
+        config = {'ENABLED': True, 'SAMPLE_RATE': 0, 'DIRECTORY': self.directory, **config}
+
+        # the middleware reads its settings when the client loads it, on the first request
+        with self.settings(POLLS_PROFILING=config):
+            client = APIClient()
+            if token:
+                client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            client.get('/api/polls/')
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return client
+
+    def profiles(self):
+        return profiling.ProfileStore(self.directory, 100).list()
+
+    def test_sampled_requests(self):
+        client = self.profiled_client(SAMPLE_RATE=1)
+        client.get('/api/polls/')
+
+        [profile] = self.profiles()
+        self.assertEqual(
+            {key: profile[key] for key in ('method', 'path', 'status', 'sampled')},
+            {'method': 'GET', 'path': '/api/polls/', 'status': 200, 'sampled': True}
+        )
+
+    def test_unsampled_requests(self):
+        self.profiled_client().get('/api/polls/')
+
+        self.assertEqual(self.profiles(), [])
+
+    async def test_async_requests(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        with self.settings(POLLS_PROFILING={'ENABLED': True, 'SAMPLE_RATE': 1, 'DIRECTORY': self.directory}):
+            middleware = profiling.ProfilingMiddleware(get_response)
+
+        # no sync_to_async in front of the async views
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        response = await middleware(APIRequestFactory().get('/api/async/polls/'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        [profile] = self.profiles()
+        self.assertEqual((profile['path'], profile['sampled']), ('/api/async/polls/', True))
+
+    def test_header_needs_staff(self):
+        client = self.profiled_client()
+
+        client.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+        self.assertEqual(self.profiles(), [])
+
+        self.user.is_staff = True
+        self.user.save()
+        client.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+
+        [profile] = self.profiles()
+        self.assertFalse(profile['sampled'])
+
+    def test_header_needs_staff_credentials(self):
+        client = self.profiled_client()
+        anonymous = self.profiled_client(token=False)
+        session = self.profiled_client(token=False)
+        session.force_login(self.user)
+
+        # tagged requests without staff credentials are not even profiled
+        with patch.object(profiling, '_profiling') as lock:
+            client.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+            session.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+            anonymous.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+            anonymous.get('/api/polls/', HTTP_X_POLLS_PROFILE='1', HTTP_AUTHORIZATION='Token nope')
+
+            lock.acquire.assert_not_called()
+
+        self.user.is_staff = True
+        self.user.save()
+
+        with patch.object(profiling, '_profiling') as lock:
+            lock.acquire.return_value = False
+
+            client.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+            session.get('/api/polls/', HTTP_X_POLLS_PROFILE='1')
+
+            self.assertEqual(lock.acquire.call_count, 2)
+
+    def test_ring_buffer(self):
+        client = self.profiled_client(SAMPLE_RATE=1, MAX_PROFILES=2)
+
+        for _ in range(3):
+            client.get('/api/polls/')
+
+        ids = [profile['id'] for profile in self.profiles()]
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+    def test_endpoints(self):
+        client = self.profiled_client(SAMPLE_RATE=1)
+
+        with self.settings(POLLS_PROFILING={'DIRECTORY': self.directory}):
+            client.get('/api/polls/')
+            self.assertEqual(client.get('/api/profiles/').status_code, status.HTTP_403_FORBIDDEN)
+
+            self.user.is_staff = True
+            self.user.save()
+
+            response = client.get('/api/profiles/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # the profile of the listing request itself comes after the response
+            profile_id = response.json()[0]['id']
+
+            response = client.get(f'/api/profiles/{profile_id}/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Disposition'], f'attachment; filename="{profile_id}.prof"')
+            self.assertIsInstance(marshal.loads(b''.join(response.streaming_content)), dict)
+
+            response = client.get(f'/api/profiles/{profile_id}/', {'top': 5})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Ordered by: cumulative time', response.content.decode())
+
+            self.assertEqual(client.get(f'/api/profiles/{profile_id}/', {'top': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(client.get('/api/profiles/1-2/').status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(client.get('/api/profiles/..%2Fsecret/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class HistogramTest(APITestCase):
+    def test_buckets(self):
+        histogram = instrumentation.Histogram([1, 5])
+
+        for value in (0, 1, 3, 7):
+            histogram.observe(value)
+
+        self.assertEqual(list(histogram.cumulative()), [(1, 2), (5, 3), (float('inf'), 4)])
+        self.assertEqual((histogram.sum, histogram.count), (11, 4))
@@ -1,17 +1,26 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from  .views import PollViewSets, ChoicesList, ChoiceDetail, CreateVote
-from .user_views import CreateUser, LoginUser
+from  .views import PollViewSets, ChoicesList, ChoiceDetail, ChoiceVotesList, PollVotesExport, CreateVote, BulkCreateVotes, VoteBufferStats, ResultsStream, RequestMetrics, ProfileList, ProfileDetail
+from .user_views import CreateUser, LoginUser, TokenCacheStats
 
 router = DefaultRouter()
 router.register(prefix='polls', viewset=PollViewSets, basename='polls')
 
 urlpatterns = [
+    path('polls/<uuid:pk>/results/stream/', ResultsStream.as_view(), name='results-stream'),
     path('polls/<uuid:poll_pk>/choices/', ChoicesList.as_view(), name='choices-list'),
     path('polls/<uuid:poll_pk>/choices/<uuid:choice_pk>/', ChoiceDetail.as_view(), name='choice-detail'),
+    path('polls/<uuid:poll_pk>/choices/<uuid:choice_pk>/votes/', ChoiceVotesList.as_view(), name='choice-votes'),
     path('polls/<uuid:poll_pk>/choices/<uuid:choice_pk>/vote/', CreateVote.as_view(), name='create-vote'),
+    path('polls/<uuid:poll_pk>/votes/export/', PollVotesExport.as_view(), name='votes-export'),
+    path('polls/<uuid:poll_pk>/votes/bulk/', BulkCreateVotes.as_view(), name='bulk-votes'),
+    path('votes/buffer/', VoteBufferStats.as_view(), name='vote-buffer-stats'),
+    path('metrics/', RequestMetrics.as_view(), name='request-metrics'),
+    path('profiles/', ProfileList.as_view(), name='profile-list'),
+    path('profiles/<str:profile_id>/', ProfileDetail.as_view(), name='profile-detail'),
     path('account/user/', CreateUser.as_view(), name='create-user'),
     path('account/login/', LoginUser.as_view(), name='login'),
+    path('account/token-cache/', TokenCacheStats.as_view(), name='token-cache-stats'),
 ]
 
 urlpatterns += router.urls
@@ -4,6 +4,7 @@ Contains a serializer to create a User
 """
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
@@ -28,14 +29,6 @@ class UserCreateSerializer(serializers.ModelSerializer):
         validate_password(value)
         return value
 
-    def validate_email(self, value): 
-        """ Check email uniqueness """
-
-        if User.objects.filter(email=value).exists(): 
-            raise serializers.ValidationError('A user with this email already exists')
-    
-        return value
-
     def validate(self, data):
         """Global validation method
             Validate if password and password2(Confirm password equal)
@@ -50,15 +43,23 @@ class UserCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = User(
             username=validated_data['username'], 
-            email=validated_data['email']
+            email=validated_data.get('email', '')
         )
 
+        # hashed on the password hashing pool (polls.hashing)
         user.set_password(validated_data['password'])
 
-        user.save()
-
-        # Create a token for the user
-        Token.objects.create(user=user)
+        # email uniqueness is checked by the user_email_unique index on insert
+        try:
+            with transaction.atomic():
+                user.save()
+
+                # Create a token for the user
+                Token.objects.create(user=user)
+        except IntegrityError:
+            if user.email and User.objects.filter(email=user.email).exists():
+                raise serializers.ValidationError({'email': 'A user with this email already exists'})
+            raise
 
         return user
 
@@ -3,8 +3,10 @@ from django.contrib.auth import authenticate
 from rest_framework.views import APIView
 from rest_framework import generics, status
 from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
 
 from .user_serializers import UserCreateSerializer
+from . import authentication
 
 class CreateUser(generics.CreateAPIView):
     """Create a new user """
@@ -25,6 +27,7 @@ class LoginUser(APIView):
         username = data['username']
         password = data['password']
 
+        # the password is verified on the hashing pool, a 503 when it is saturated (polls.hashing)
         user = authenticate(username=username, password=password)
 
         if not user: 
@@ -43,3 +46,9 @@ class LoginUser(APIView):
         )  
 
 
+class TokenCacheStats(APIView):
+    """Size and hit/miss counts of the token authentication cache of this process"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(authentication.stats())
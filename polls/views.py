@@ -1,53 +1,293 @@
+import re
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import router, transaction
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from rest_framework.request import Request
 from rest_framework import viewsets, status, generics
+from rest_framework.decorators import action
 from rest_framework.mixins import UpdateModelMixin, DestroyModelMixin
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.exceptions import NotFound
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 from .models import Poll, Vote, Choice
 from .serializers import PollSerializer, VoteSerializer, ChoiceSerializer
 from .permissions import IsPollCreator
-
-class PollViewSets(viewsets.ModelViewSet):
+from .pagination import ChoiceCursorPagination, VotePagination
+from .querysets import optimize_for_serializer
+from .fast_serializers import FastReadSerializer, requested_expand, requested_fields
+from .cache import cached_poll_response
+from .results import get_results
+from .renderers import CSVRenderer, EventStreamRenderer, NDJSONRenderer, format_event
+from .db_routers import read_from_replica
+from .request_cache import cached_object
+from .streaming import ClosingStreamingHttpResponse, aiterate, chunked, is_asgi
+from .ownership import user_owns_poll
+from .instrumentation import InstrumentedViewMixin
+from . import deletion
+from . import services
+from . import instrumentation
+from . import profiling
+from . import live
+from . import vote_buffer
+
+class ReadReplicaMixin:
+    """
+    Serve the read-only (safe method) requests from the read replica
+    """
+    replica_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in self.replica_methods:
+            return super().dispatch(request, *args, **kwargs)
+
+        with read_from_replica():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class FastReadMixin:
+    """
+    Serve reads through FastReadSerializer: `.values()` rows instead of
+    model instances, the same JSON; `?fields=` picks the top-level fields
+    and `?expand=` the nested relations
+    """
+
+    def get_fast_serializer(self):
+        return FastReadSerializer(
+            self.get_serializer_class(),
+            fields=requested_fields(self.request),
+            expand=requested_expand(self.request)
+        )
+
+    def get_fast_queryset(self, fast_serializer):
+        # the rows carry the columns the paginator orders (and cursors) by
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+
+        return fast_serializer.values(queryset, extra=[field.lstrip('-') for field in ordering])
+
+    def list(self, request, *args, **kwargs):
+        fast_serializer = self.get_fast_serializer()
+        queryset = self.get_fast_queryset(fast_serializer)
+
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(fast_serializer.to_representation(queryset))
+
+        return self.get_paginated_response(fast_serializer.to_representation(page))
+
+    def get_fast_object(self, fast_serializer, extra=()):
+        """The `values()` row of the object in the URL, 404 when there is none"""
+        queryset = fast_serializer.values(self.get_queryset().prefetch_related(None), extra=extra)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+
+        return generics.get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
+    def retrieve(self, request, *args, **kwargs):
+        fast_serializer = self.get_fast_serializer()
+        row = self.get_fast_object(fast_serializer)
+
+        return Response(fast_serializer.to_representation([row])[0])
+
+
+class PollViewSets(InstrumentedViewMixin, ReadReplicaMixin, FastReadMixin, viewsets.ModelViewSet):
     queryset = Poll.objects.all()
     serializer_class = PollSerializer
     http_method_names = ['get', 'post', 'put', 'delete', 'head', 'options']
 
+    def get_queryset(self):
+        # prefetch whatever the (nested) serializer reads to avoid N+1 queries
+        return optimize_for_serializer(super().get_queryset(), self.get_serializer_class())
+
+    def get_object(self):
+        # a 404 from check_creator() and DRF's update/destroy share the lookup
+        poll = cached_object(self.request, self.get_queryset(), self.kwargs['pk'])
+        self.check_object_permissions(self.request, poll)
+
+        return poll
+
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        services.invalidate_poll(serializer.instance.pk)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serve the poll from the response cache, with ETag/Last-Modified validators
+        """
+        fast_serializer = self.get_fast_serializer()
+        # every field selection and expansion is cached separately
+        variant = ':'.join(filter(None, ['detail', fast_serializer.variant]))
+
+        def build():
+            row = self.get_fast_object(fast_serializer, extra=['modified_date'])
+
+            return fast_serializer.to_representation([row])[0], row['modified_date']
+
+        return cached_poll_response(request, kwargs['pk'], variant, build)
+
+    @action(detail=True, methods=['get'])
+    def results(self, request, pk=None):
+        """
+        Vote counts and percentages per choice, computed from the vote counters
+        """
+        def build():
+            try:
+                poll_id = uuid.UUID(pk)
+                return get_results([poll_id])[poll_id]
+            except (KeyError, ValueError):
+                raise NotFound('No Poll matches the given query.')
+
+        return cached_poll_response(request, pk, 'results', build)
+
+    @action(detail=False, methods=['get'], url_path='results', url_name='results-batch')
+    def batch_results(self, request):
+        """
+        Results of several polls in one request and one query: ?ids=<poll id>,<poll id>,...
+        Unknown polls are left out.
+        """
+        max_ids = getattr(settings, 'POLLS_RESULTS_BATCH_MAX_IDS', 100)
+
+        try:
+            ids = [uuid.UUID(value) for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            raise ValidationError({'ids': 'Expected a comma separated list of poll ids.'})
+
+        if not ids:
+            raise ValidationError({'ids': 'This query parameter is required.'})
+
+        if len(ids) > max_ids:
+            raise ValidationError({'ids': f'At most {max_ids} polls per request.'})
+
+        results = get_results(ids)
+
+        return Response({'results': [results[poll_id][0] for poll_id in dict.fromkeys(ids) if poll_id in results]})
+
     def create(self, request, *args, **kwargs):
         # add missing data
         # request.data['creator'] = request.user.id
 
         return super().create(request, *args, **kwargs)
 
+    def check_creator(self, message):
+        if not user_owns_poll(self.request.user.pk, self.kwargs['pk']):
+            # 404 for polls that do not exist
+            self.get_object()
+            raise PermissionDenied(message)
+
     def destroy(self, request, *args, **kwargs):
-        poll = get_object_or_404(Poll, pk=kwargs['pk'])
+        self.check_creator('Access Denied: You can not delete the poll.')
 
-        if request.user != poll.creator: 
-            raise PermissionDenied('Access Denied: You can not delete the poll.') 
+        # marked deleted now, the votes and choices are purged in batches (see polls.deletion)
+        if not deletion.delete_poll(self.kwargs['pk'], request.user.pk):
+            raise NotFound('No Poll matches the given query.')
 
-        return super().destroy(request, *args, **kwargs)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     def update(self, request, *args, **kwargs):
-        poll = get_object_or_404(Poll, pk=kwargs['pk'])
-
-        if request.user != poll.creator: 
-            raise PermissionDenied('Access Denied: You can not update the poll.')
+        self.check_creator('Access Denied: You can not update the poll.')
         
         # add missing user Id
         request.data['creator'] = request.user.id
 
         return super().update(request, *args, **kwargs)
 
-class ChoicesList(generics.ListCreateAPIView): 
+class ResultsStream(APIView):
+    """
+    Live results of a poll as Server-Sent Events: a `snapshot` event with the
+    results, then a `delta` event whenever votes change them (see polls.live),
+    and a `deleted` event if the poll goes away
+    """
+    renderer_classes = [EventStreamRenderer]
+
+    def get(self, request, pk):
+        hub = live.get_hub()
+        subscription = hub.subscribe(pk)
+
+        try:
+            results = get_results([pk])
+        except Exception:
+            hub.unsubscribe(subscription)
+            raise
+
+        if pk not in results:
+            hub.unsubscribe(subscription)
+            raise NotFound('No Poll matches the given query.')
+
+        snapshot = results[pk][0]
+        hub.prime(pk, snapshot)
+
+        stream = self.astream if is_asgi(request) else self.stream
+        response = ClosingStreamingHttpResponse(
+            stream(hub, subscription, snapshot),
+            content_type='text/event-stream',
+            on_close=lambda: hub.unsubscribe(subscription)
+        )
+        response['Cache-Control'] = 'no-cache'
+        # keep proxies (nginx) from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+
+        return response
+
+    @staticmethod
+    def stream(hub, subscription, snapshot):
+        heartbeat = live.get_config()['HEARTBEAT']
+
+        try:
+            yield format_event('snapshot', snapshot)
+
+            while True:
+                delta = subscription.get(timeout=heartbeat)
+
+                if delta is not None:
+                    yield format_event('delta', delta)
+                elif subscription.closed:
+                    yield format_event('deleted', {'poll': snapshot['poll']})
+                    return
+                else:
+                    yield ': keep-alive\n\n'
+        finally:
+            hub.unsubscribe(subscription)
+
+    @staticmethod
+    async def astream(hub, subscription, snapshot):
+        """stream() for ASGI, waiting for the deltas on the event loop"""
+        heartbeat = live.get_config()['HEARTBEAT']
+
+        try:
+            yield format_event('snapshot', snapshot)
+
+            while True:
+                delta = await subscription.aget(timeout=heartbeat)
+
+                if delta is not None:
+                    yield format_event('delta', delta)
+                elif subscription.closed:
+                    yield format_event('deleted', {'poll': snapshot['poll']})
+                    return
+                else:
+                    yield ': keep-alive\n\n'
+        finally:
+            hub.unsubscribe(subscription)
+
+
+class ChoicesList(InstrumentedViewMixin, ReadReplicaMixin, FastReadMixin, generics.ListCreateAPIView): 
     serializer_class = ChoiceSerializer
+    pagination_class = ChoiceCursorPagination
     permission_classes = [IsAuthenticated, IsPollCreator]
 
     def get_queryset(self):
@@ -55,84 +295,280 @@ class ChoicesList(generics.ListCreateAPIView):
         Filter the choices to those belonging to the specific poll
         """
         poll_pk = self.kwargs['poll_pk']
-        return Choice.objects.filter(poll__pk=poll_pk)
+        queryset = Choice.objects.filter(poll__pk=poll_pk)
+
+        return optimize_for_serializer(queryset, self.get_serializer_class())
 
+    def get_serializer(self, *args, **kwargs):
+        # a JSON array creates several choices at once
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+
+        return super().get_serializer(*args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            max_items = getattr(settings, 'POLLS_BULK_CHOICES_MAX_ITEMS', 100)
+
+            if not request.data:
+                raise ValidationError('Expected a non-empty list of choices.')
+
+            if len(request.data) > max_items:
+                raise ValidationError(f'At most {max_items} choices per request.')
+
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer): # view hook
         """
         Add the poll foreign key during creation.
-        The authorization check is already performed in get_queryset (which is called before perform_create).
+        The authorization check is already performed by IsPollCreator, which also made sure the poll exists.
         """
         
         poll_pk = self.kwargs['poll_pk']
-        poll = get_object_or_404(Poll, pk=poll_pk)
 
-        # Save the choices with the current poll
-        serializer.save(poll=poll)
+        with transaction.atomic():
+            if isinstance(serializer.validated_data, list):
+                # a list of choices is written with one INSERT
+                serializer.instance = services.create_choices(poll_pk, serializer.validated_data)
+            else:
+                # Save the choices with the current poll
+                serializer.save(poll_id=poll_pk)
 
-class ChoiceDetail(generics.GenericAPIView, UpdateModelMixin, DestroyModelMixin): 
+            services.touch_poll(poll_pk)
+
+class ChoiceDetail(InstrumentedViewMixin, FastReadMixin, generics.GenericAPIView, UpdateModelMixin, DestroyModelMixin): 
     serializer_class = ChoiceSerializer
     permission_classes = [IsAuthenticated, IsPollCreator]
+    lookup_url_kwarg = 'choice_pk'
 
     def get_queryset(self): 
         poll_pk = self.kwargs['poll_pk']
+        queryset = Choice.objects.filter(poll__id=poll_pk)
 
-        return Choice.objects.filter(poll__id=poll_pk)
+        return optimize_for_serializer(queryset, self.get_serializer_class())
 
     def get_object(self): 
         choice_pk = self.kwargs['choice_pk']
-        choice = get_object_or_404(Choice, pk=choice_pk)
+        choice = cached_object(self.request, self.get_queryset(), choice_pk)
 
         self.check_object_permissions(self.request, choice)
 
         return choice
 
-    # Map put---update and delete---destroy methods
+    # Map get---retrieve, put---update and delete---destroy methods
+    def get(self, request, *args, **kwargs):
+        # IsPollCreator.has_permission has checked the poll already, the choice is looked up within it
+        return self.retrieve(request, *args, **kwargs)
+
     def put(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
     
     def delete(self, request, *args, **kwargs): 
         return self.destroy(self, request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        services.touch_poll(serializer.instance.poll_id)
+
+    def perform_destroy(self, instance):
+        # keep Poll.total_votes in step with the cascading vote deletion
+        services.delete_choice(instance)
+
 
-class CreateVote(generics.CreateAPIView):
+class ChoiceVotesList(InstrumentedViewMixin, FastReadMixin, generics.ListAPIView):
+    """
+    Paginated list of the votes cast on a choice.
+    Poll and choice payloads only carry the vote counters, individual votes are opt-in here.
+    """
     serializer_class = VoteSerializer
+    pagination_class = VotePagination
+
+    def get_queryset(self):
+        return Vote.objects.filter(
+            poll__id=self.kwargs['poll_pk'],
+            poll__deleted_at__isnull=True,
+            choice__id=self.kwargs['choice_pk']
+        )
 
-    def perform_create(self, serializer):
-        choice = get_object_or_404(Choice, pk=self.kwargs['choice_pk'])
 
-        serializer.save(choice=choice, poll=choice.poll, voter=self.request.user)
+accepts_gzip = re.compile(r'\bgzip\b')
 
 
+class PollVotesExport(InstrumentedViewMixin, ReadReplicaMixin, APIView):
+    """
+    Every vote of a poll as CSV (?format=csv, the default) or newline delimited
+    JSON (?format=ndjson), for the poll creator. The rows are streamed from a
+    database cursor chunk by chunk, so memory stays flat however many votes the
+    poll has; gzip compressed for clients sending `Accept-Encoding: gzip`.
+    """
+    permission_classes = [IsAuthenticated, IsPollCreator]
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+    columns = ['id', 'choice', 'choice_body', 'voter']
+
+    def get(self, request, poll_pk):
+        chunk_size = getattr(settings, 'POLLS_EXPORT_CHUNK_SIZE', 2000)
+
+        # the database is picked now (replica), the rows are only read once the response is sent
+        rows = (
+            Vote.objects.using(router.db_for_read(Vote))
+            .filter(poll_id=poll_pk)
+            # the order of unique_vote_per_poll_voter, nothing to sort
+            .order_by('voter_id')
+            .values_list('id', 'choice_id', 'choice__body', 'voter_id')
+            .iterator(chunk_size=chunk_size)
+        )
+
+        renderer = request.accepted_renderer
+        content = renderer.stream(self.columns, chunked(rows, chunk_size))
+        compress = accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+
+        if compress:
+            content = compress_sequence(content)
+
+        response = ClosingStreamingHttpResponse(
+            # under ASGI a synchronous iterator would be read to the end before anything is sent
+            aiterate(content) if is_asgi(request) else content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+            # the cursor, if the client went away mid-export
+            on_close=content.close
+        )
+        response['Content-Disposition'] = f'attachment; filename="poll-{poll_pk}-votes.{renderer.format}"'
+        patch_vary_headers(response, ['Accept-Encoding'])
+
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+
+        return response
+
+
+class CreateVote(InstrumentedViewMixin, generics.CreateAPIView):
+    serializer_class = VoteSerializer
+
     def create(self, request, *args, **kwargs): 
-        if self.delete_any_earlier_vote(request, **kwargs):
+        """
+        Cast the vote, replacing any earlier vote of the user on this poll.
+        Voting again for the same choice is a no-op.
+        With the vote buffer enabled the vote is only queued (see polls.vote_buffer).
+        """
+        if vote_buffer.is_enabled():
+            response = self.buffer_vote(request, **kwargs)
+
+            if response:
+                return response
+
+        try:
+            vote, outcome = services.cast_vote(kwargs['poll_pk'], kwargs['choice_pk'], request.user.pk)
+        except Choice.DoesNotExist:
+            raise NotFound('No such choice in this poll.')
+
+        if outcome == services.VOTE_UNCHANGED:
             return Response(data={"details": "vote already exists"})
 
-        return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(vote)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def delete_any_earlier_vote(self, request, **kwargs): 
+    def buffer_vote(self, request, **kwargs):
         """
-            Delete the existing vote made by current user on this poll \n
-            Return `True` if user has already voted in the same choice of the current poll otherwise `None` \n
-            Check if the user has already made a vote on any other choice in this poll
-            If yes delete the earlier vote
+        Queue the vote in the write-behind buffer, return None when the buffer
+        is full so the vote gets written right away instead
         """
-        existing_vote = None
-
-        try: 
-            existing_vote = Vote.objects.get(Q(poll__id=kwargs['poll_pk']) & Q(voter=request.user))
-        except Vote.DoesNotExist:
-            """ 
-            User is making vote in this pole for the first time
-            """
+        if not Choice.objects.filter(pk=kwargs['choice_pk'], poll_id=kwargs['poll_pk'], poll__deleted_at__isnull=True).exists():
+            raise NotFound('No such choice in this poll.')
+
+        try:
+            vote_buffer.get_vote_buffer().put(kwargs['poll_pk'], request.user.pk, kwargs['choice_pk'])
+        except vote_buffer.BufferFull:
             return None
-        
-        # It is guranteed that existing_vote will have vote object here
-        if existing_vote.choice.id == kwargs['choice_pk']: 
-            # user has already voted in this choice
-            # no need perform any vote
-            return True
 
+        return Response(data={"details": "vote accepted"}, status=status.HTTP_202_ACCEPTED)
+
+
+class VoteBufferStats(APIView):
+    """Queue depth, batch sizes and flush latency of the vote buffer of this process"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(vote_buffer.stats())
+
+
+class RequestMetrics(APIView):
+    """Per-route request histograms of this process in the Prometheus text format (see polls.instrumentation)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(instrumentation.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProfileList(APIView):
+    """The request profiles kept on disk, the newest first (see polls.profiling)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(profiling.get_store().list())
+
+
+class ProfileDetail(APIView):
+    """
+    Download a request profile (pstats format, `python -m pstats <file>`),
+    or with ?top=N read its N most expensive functions as text
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id, *args, **kwargs):
+        store = profiling.get_store()
+        top = request.query_params.get('top')
+
+        try:
+            if top is None:
+                return FileResponse(
+                    store.open(profile_id), as_attachment=True, filename=f'{profile_id}.prof',
+                    content_type='application/octet-stream'
+                )
+
+            if not top.isdigit() or not int(top):
+                raise ValidationError({'top': 'Expected a positive number of functions.'})
+
+            return HttpResponse(store.text(profile_id, int(top)), content_type='text/plain; charset=utf-8')
+        except KeyError:
+            raise NotFound('No profile matches the given id.')
+
+
+class BulkCreateVotes(InstrumentedViewMixin, APIView):
+    """
+    Cast many votes on a poll in one request, for vote ingestion during live events.
+    Expects {"votes": [{"voter": <user id>, "choice": <choice id>}, ...]}, the last vote of a voter wins.
+    The voters are named by the client, so only staff users (ingestion services) may use it.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        votes = request.data.get('votes') if isinstance(request.data, dict) else None
+        max_items = getattr(settings, 'POLLS_BULK_VOTES_MAX_ITEMS', 50000)
+
+        if not isinstance(votes, list) or not votes:
+            raise ValidationError({'votes': 'Expected a non-empty list of votes.'})
+
+        if len(votes) > max_items:
+            raise ValidationError({'votes': f'At most {max_items} votes per request.'})
+
+        poll = get_object_or_404(Poll, pk=kwargs['poll_pk'])
+
+        items = [
+            (vote.get('voter'), vote.get('choice')) if isinstance(vote, dict) else (None, None)
+            for vote in votes
+        ]
+
+        results = services.cast_votes(
+            poll.pk,
+            items,
+            chunk_size=getattr(settings, 'POLLS_BULK_VOTES_CHUNK_SIZE', 1000)
+        )
 
-        if existing_vote:
-            existing_vote.delete() 
+        return Response(
+            data={
+                'summary': Counter(result['status'] for result in results),
+                'results': [{'index': index, **result} for index, result in enumerate(results)],
+            },
+            status=status.HTTP_200_OK
+        )
@@ -0,0 +1,525 @@
+"""
+Write-behind buffering of votes.
+
+With POLLS_VOTE_BUFFER['ENABLED'], CreateVote does not write the vote to the
+database itself: the vote is appended to the buffer's journal (and fsync'ed)
+and acknowledged with `202 Accepted`. A background flusher then applies the
+buffered votes in batches through services.cast_votes, every
+FLUSH_INTERVAL_MS milliseconds or as soon as BATCH_SIZE votes are waiting.
+
+Votes are keyed by (poll, voter), so repeated votes of a voter between two
+flushes coalesce into the last one. Until a batch has been written to the
+database its votes stay in the journal, a written batch is then marked
+acknowledged there; a process that dies with votes in its buffer leaves its
+journal behind and the next buffer started on the same journal directory
+adopts and flushes the votes that were not acknowledged.
+
+The buffer class is pluggable (POLLS_VOTE_BUFFER['BACKEND']), any subclass of
+BaseVoteBuffer works, e.g. one backed by a shared store for multi-host setups.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.utils.module_loading import import_string
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BACKEND': 'polls.vote_buffer.JournalVoteBuffer',
+    'JOURNAL_DIR': None,
+    'FSYNC': True,
+    'FLUSH_INTERVAL_MS': 200,
+    'BATCH_SIZE': 1000,
+    'MAX_QUEUE_DEPTH': 100000,
+}
+
+
+class BufferFull(Exception):
+    """The buffer holds MAX_QUEUE_DEPTH votes already"""
+
+
+class BaseVoteBuffer:
+    """
+    Interface of a vote buffer.
+
+    Votes move from `pending` (taken by `take()`) to `in flight`, and leave the
+    buffer on `ack()` once they are in the database, or go back to pending on
+    `requeue()` when writing them failed.
+    """
+
+    def put(self, poll_id, voter_id, choice_id):
+        """Durably record the vote, raise BufferFull when the buffer is full"""
+        raise NotImplementedError
+
+    def take(self, max_items):
+        """Return up to `max_items` pending votes as (poll_id, voter_id, choice_id) tuples"""
+        raise NotImplementedError
+
+    def ack(self, batch):
+        """Forget a batch returned by take(), it has been written"""
+        raise NotImplementedError
+
+    def requeue(self, batch):
+        """Give a batch returned by take() back, it could not be written"""
+        raise NotImplementedError
+
+    def wait(self, min_items, timeout):
+        """Block until `min_items` votes are pending or `timeout` seconds passed"""
+        time.sleep(timeout)
+
+    def wake(self):
+        """Interrupt wait()"""
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class JournalVoteBuffer(BaseVoteBuffer):
+    """
+    In-process buffer backed by an append-only journal file.
+
+    Every buffer writes its own journal `votes-<id>.journal` in `journal_dir`
+    and holds an exclusive lock on it. Every vote line carries a sequence
+    number, ack() appends a line with the sequence numbers of the written
+    votes. On start it adopts the journals nobody holds a lock on (left behind
+    by processes that died) by copying their unacknowledged votes into its own
+    journal. The journal is truncated whenever the buffer runs empty and
+    compacted when it grows much larger than the buffer.
+
+    `_pending` and `_in_flight` map (poll_id, voter_id) to (choice_id, sequence number).
+    """
+
+    compact_threshold = 10000
+
+    def __init__(self, journal_dir, fsync=True, max_depth=None):
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.max_depth = max_depth
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = {}
+        self._in_flight = {}
+        self._journal_lines = 0
+        self._adopted = 0
+        self._seq = 0
+
+        self.path = self.journal_dir / f'votes-{uuid.uuid4().hex}.journal'
+        self._journal = self._open_locked(self.path)
+
+        self._adopt_orphans()
+
+    # journal file handling
+
+    @staticmethod
+    def _open_locked(path):
+        journal = open(path, 'ab')
+
+        if fcntl:
+            fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        return journal
+
+    def _sync(self, journal):
+        journal.flush()
+
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+    @staticmethod
+    def _encode(poll_id, voter_id, choice_id, seq):
+        return json.dumps([poll_id, voter_id, choice_id, seq]).encode() + b'\n'
+
+    @staticmethod
+    def _encode_ack(seqs):
+        return json.dumps({'ack': seqs}).encode() + b'\n'
+
+    @staticmethod
+    def _read(path):
+        """The votes of a journal that were not acknowledged, as (poll_id, voter_id, choice_id)"""
+        votes = {}
+        keys = {}
+
+        with open(path, 'rb') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+
+                    if isinstance(entry, dict):
+                        acked = entry['ack']
+                    else:
+                        poll_id, voter_id, choice_id, seq = entry
+                except (ValueError, KeyError, TypeError):
+                    # torn write of a process killed mid-append, never acknowledged
+                    continue
+
+                if isinstance(entry, dict):
+                    for seq in acked:
+                        key = keys.pop(seq, None)
+
+                        # a newer vote of the voter, put while the batch was in flight, stays
+                        if key in votes and votes[key][1] == seq:
+                            del votes[key]
+                else:
+                    votes[(poll_id, voter_id)] = (choice_id, seq)
+                    keys[seq] = (poll_id, voter_id)
+
+        for (poll_id, voter_id), (choice_id, _) in votes.items():
+            yield poll_id, voter_id, choice_id
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _adopt_orphans(self):
+        orphans = []
+
+        for path in sorted(self.journal_dir.glob('votes-*.journal')):
+            if path == self.path:
+                continue
+
+            try:
+                orphan = self._open_locked(path)
+            except (BlockingIOError, FileNotFoundError):
+                # still owned by a live buffer, or adopted by another one meanwhile
+                continue
+
+            orphans.append((path, orphan))
+
+            for poll_id, voter_id, choice_id in self._read(path):
+                self._pending[(poll_id, voter_id)] = (choice_id, self._next_seq())
+
+        if not orphans:
+            return
+
+        # the adopted votes are durable in our journal before the orphans go away
+        self._rewrite_journal()
+
+        for path, orphan in orphans:
+            path.unlink()
+            orphan.close()
+
+        self._adopted = len(self._pending)
+        logger.info('Adopted %d buffered votes from %d orphaned journal(s)', self._adopted, len(orphans))
+
+    def _rewrite_journal(self):
+        """Replace the journal with the votes still in the buffer"""
+        live = {**self._in_flight, **self._pending}
+        tmp_path = self.path.with_suffix('.compact')
+        tmp_path.unlink(missing_ok=True)
+
+        journal = self._open_locked(tmp_path)
+        journal.write(b''.join(self._encode(p, v, c, seq) for (p, v), (c, seq) in live.items()))
+        self._sync(journal)
+        os.replace(tmp_path, self.path)
+
+        self._journal.close()
+        self._journal = journal
+        self._journal_lines = len(live)
+
+    def _maybe_compact(self):
+        if not self._pending and not self._in_flight:
+            self._journal.truncate(0)
+            self._sync(self._journal)
+            self._journal_lines = 0
+
+        elif self._journal_lines > max(self.compact_threshold, 10 * (len(self._pending) + len(self._in_flight))):
+            self._rewrite_journal()
+
+    # buffer interface
+
+    def put(self, poll_id, voter_id, choice_id):
+        poll_id, choice_id = str(poll_id), str(choice_id)
+        key = (poll_id, voter_id)
+
+        with self._lock:
+            if self.max_depth and len(self._pending) >= self.max_depth and key not in self._pending:
+                raise BufferFull()
+
+            seq = self._next_seq()
+            self._journal.write(self._encode(poll_id, voter_id, choice_id, seq))
+            self._sync(self._journal)
+            self._journal_lines += 1
+
+            self._pending[key] = (choice_id, seq)
+            self._changed.notify_all()
+
+    def take(self, max_items):
+        with self._lock:
+            batch = []
+
+            for key in list(islice(self._pending, max_items)):
+                self._in_flight[key] = self._pending.pop(key)
+                batch.append((*key, self._in_flight[key][0]))
+
+            return batch
+
+    def _pop_in_flight(self, poll_id, voter_id, choice_id):
+        """Remove the vote from the in flight ones, return it if it was the one taken"""
+        vote = self._in_flight.get((poll_id, voter_id))
+
+        if vote is not None and vote[0] == choice_id:
+            return self._in_flight.pop((poll_id, voter_id))
+
+    def ack(self, batch):
+        with self._lock:
+            acked = [vote[1] for vote in (self._pop_in_flight(*item) for item in batch) if vote]
+
+            if self._pending or self._in_flight:
+                # an adopting buffer must not replay votes that are in the database
+                # already, they would overwrite votes cast since
+                self._journal.write(self._encode_ack(acked))
+                self._sync(self._journal)
+                self._journal_lines += 1
+
+            self._maybe_compact()
+
+    def requeue(self, batch):
+        with self._lock:
+            for poll_id, voter_id, choice_id in batch:
+                vote = self._pop_in_flight(poll_id, voter_id, choice_id)
+
+                # a vote put while the batch was in flight is newer, keep it
+                if vote:
+                    self._pending.setdefault((poll_id, voter_id), vote)
+
+            self._changed.notify_all()
+
+    def wait(self, min_items, timeout):
+        with self._lock:
+            self._changed.wait_for(lambda: len(self._pending) >= min_items, timeout)
+
+    def wake(self):
+        with self._lock:
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self._pending),
+                'in_flight': len(self._in_flight),
+                'journal_lines': self._journal_lines,
+                'adopted_votes': self._adopted,
+            }
+
+    def close(self):
+        with self._lock:
+            empty = not self._pending and not self._in_flight
+            self._journal.close()
+
+            if empty:
+                self.path.unlink(missing_ok=True)
+
+
+class VoteFlusher:
+    """
+    Write buffered votes to the database in batches.
+
+    `flush()` applies one batch synchronously; `start()` runs it from a
+    daemon thread whenever `batch_size` votes are pending or `flush_interval`
+    seconds have passed.
+    """
+
+    def __init__(self, buffer, batch_size=1000, flush_interval=0.2):
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'flushed_votes': 0,
+            'rejected_votes': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'last_flush_at': None,
+        }
+
+    def flush(self):
+        """Write one batch of buffered votes, return the number of votes taken from the buffer"""
+        from . import services
+
+        batch = self.buffer.take(self.batch_size)
+
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        by_poll = defaultdict(list)
+
+        for poll_id, voter_id, choice_id in batch:
+            by_poll[poll_id].append((voter_id, choice_id))
+
+        try:
+            results = []
+
+            for poll_id, items in by_poll.items():
+                results.extend(services.cast_votes(poll_id, items, chunk_size=self.batch_size))
+        except Exception:
+            self.buffer.requeue(batch)
+
+            with self._stats_lock:
+                self._stats['failed_batches'] += 1
+
+            logger.exception('Flushing %d buffered votes failed, they stay buffered', len(batch))
+            raise
+
+        self.buffer.ack(batch)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        rejected = sum(result['status'] == services.VOTE_INVALID for result in results)
+
+        with self._stats_lock:
+            self._stats['flushed_votes'] += len(batch) - rejected
+            self._stats['rejected_votes'] += rejected
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['last_flush_at'] = time.time()
+
+        logger.debug('Flushed %d buffered votes in %.1f ms', len(batch), elapsed_ms)
+
+        return len(batch)
+
+    def drain(self):
+        while self.flush():
+            pass
+
+    def run(self):
+        while not self._stop.is_set():
+            self.buffer.wait(self.batch_size, self.flush_interval)
+
+            try:
+                # keep going while full batches are waiting
+                while self.flush() >= self.batch_size and not self._stop.is_set():
+                    pass
+            except Exception:
+                connection.close()
+                self._stop.wait(self.flush_interval)
+            finally:
+                close_old_connections()
+
+        try:
+            self.drain()
+        except Exception:
+            pass
+        finally:
+            connection.close()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='vote-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the thread after writing what is left in the buffer"""
+        self._stop.set()
+        self.buffer.wake()
+
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, running=bool(self._thread and self._thread.is_alive()))
+
+
+# process wide buffer
+
+_lock = threading.Lock()
+_buffer = None
+_flusher = None
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'POLLS_VOTE_BUFFER', {})}
+
+
+def is_enabled():
+    return get_config()['ENABLED']
+
+
+def create_buffer(config):
+    journal_dir = config['JOURNAL_DIR'] or Path(settings.BASE_DIR) / 'var' / 'vote-journal'
+
+    return import_string(config['BACKEND'])(
+        journal_dir=journal_dir,
+        fsync=config['FSYNC'],
+        max_depth=config['MAX_QUEUE_DEPTH'],
+    )
+
+
+def get_vote_buffer():
+    """Return the buffer of this process, starting its flusher on first use"""
+    global _buffer, _flusher
+
+    if _buffer is None:
+        with _lock:
+            if _buffer is None:
+                config = get_config()
+                buffer = create_buffer(config)
+
+                _flusher = VoteFlusher(
+                    buffer,
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL_MS'] / 1000,
+                )
+                _flusher.start()
+                _buffer = buffer
+
+                atexit.register(shutdown)
+
+    return _buffer
+
+
+def shutdown():
+    """Flush what is buffered and stop the flusher"""
+    global _buffer, _flusher
+
+    with _lock:
+        if _flusher:
+            _flusher.stop()
+
+        if _buffer:
+            _buffer.close()
+
+        _buffer = _flusher = None
+
+
+def stats():
+    config = get_config()
+
+    return {
+        'enabled': config['ENABLED'],
+        'batch_size': config['BATCH_SIZE'],
+        'flush_interval_ms': config['FLUSH_INTERVAL_MS'],
+        'max_queue_depth': config['MAX_QUEUE_DEPTH'],
+        **(_buffer.stats() if _buffer else {}),
+        **(_flusher.stats() if _flusher else {}),
+    }
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -32,6 +33,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it sees the whole request (removes itself unless POLLS_INSTRUMENTATION['ENABLED'])
+    'polls.instrumentation.InstrumentationMiddleware',
+    # removes itself unless POLLS_PROFILING['ENABLED']
+    'polls.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,13 +69,229 @@ WSGI_APPLICATION = 'pollsAppApi.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# the profile is picked from the environment: POLLS_DB_ENGINE=sqlite (default)
+# or POLLS_DB_ENGINE=postgres, configured through the POLLS_DB_* variables below
+
+POLLS_DB_ENGINE = os.environ.get('POLLS_DB_ENGINE', 'sqlite')
+
+# keep connections open between requests instead of reconnecting every time
+POLLS_DB_CONN_MAX_AGE = int(os.environ.get('POLLS_DB_CONN_MAX_AGE', 60))
+
+if POLLS_DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POLLS_DB_NAME', 'polls'),
+            'USER': os.environ.get('POLLS_DB_USER', 'polls'),
+            'PASSWORD': os.environ.get('POLLS_DB_PASSWORD', ''),
+            'HOST': os.environ.get('POLLS_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('POLLS_DB_PORT', '5432'),
+            'CONN_MAX_AGE': POLLS_DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+
+    # Django's psycopg 3 connection pool (needs psycopg[pool]); a pooled
+    # connection is handed back after each request so CONN_MAX_AGE must be 0
+    if os.environ.get('POLLS_DB_POOL_MAX_SIZE'):
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('POLLS_DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ['POLLS_DB_POOL_MAX_SIZE']),
+            'timeout': int(os.environ.get('POLLS_DB_POOL_TIMEOUT', 10)),
+        }
+
+    if os.environ.get('POLLS_DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ['POLLS_DB_REPLICA_HOST'],
+            'PORT': os.environ.get('POLLS_DB_REPLICA_PORT', DATABASES['default']['PORT']),
+            'OPTIONS': dict(DATABASES['default']['OPTIONS']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': POLLS_DB_CONN_MAX_AGE,
+            # no 'transaction_mode': IMMEDIATE here would take the write lock in
+            # every atomic block, read-only ones included, and queue reads behind
+            # writers. Only the transactions that read, then write begin with
+            # BEGIN IMMEDIATE (polls.db.write_transaction).
+            'OPTIONS': {},
+        }
+    }
+
+    # a read-only connection to the same file, so replica routing can be
+    # exercised locally: a write routed to it fails instead of passing silently
+    if os.environ.get('POLLS_DB_REPLICA'):
+        DATABASES['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+            'CONN_MAX_AGE': POLLS_DB_CONN_MAX_AGE,
+            'OPTIONS': {'uri': True},
+            'TEST': {'MIRROR': 'default'},
+        }
+
+# applied to every new SQLite connection (see polls.db)
+POLLS_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+# read-only GET endpoints read from the 'replica' alias when one is configured
+DATABASE_ROUTERS = ['polls.db_routers.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Any backend works, use a shared one (redis, memcached) when running several workers
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Versioned response cache of the poll reads (polls.cache)
+POLLS_RESPONSE_CACHE_ALIAS = 'default'
+POLLS_RESPONSE_CACHE_TIMEOUT = 300
+
+# GET /api/polls/results/?ids=...
+POLLS_RESULTS_BATCH_MAX_IDS = 100
+
+
+# Bulk vote ingestion (POST /api/polls/<poll_pk>/votes/bulk/)
+POLLS_BULK_VOTES_MAX_ITEMS = 50000
+POLLS_BULK_VOTES_CHUNK_SIZE = 1000
+
+# Choices written in one request (nested in a poll, or a list posted to the choices endpoint)
+POLLS_BULK_CHOICES_MAX_ITEMS = 100
+
+# Poll deletion (polls.deletion): a deleted poll is hidden at once and its votes and
+# choices are removed BATCH_SIZE rows per DELETE, with ASYNC on a background thread
+# (`manage.py purge_deleted_polls` finishes purges cut short by a restart)
+POLLS_POLL_DELETION = {
+    'ASYNC': os.environ.get('POLLS_POLL_DELETION_ASYNC') == '1',
+    'BATCH_SIZE': 5000,
+}
+
+# Vote export (GET /api/polls/<poll_pk>/votes/export/): rows fetched per round trip,
+# through a server-side cursor on PostgreSQL
+POLLS_EXPORT_CHUNK_SIZE = 2000
+
+
+# Write-behind vote buffer (polls.vote_buffer)
+# When enabled, votes are journaled and acknowledged with 202, a background
+# flusher writes them in batches every FLUSH_INTERVAL_MS or BATCH_SIZE votes.
+# Every worker process keeps its own journal in JOURNAL_DIR.
+
+POLLS_VOTE_BUFFER = {
+    'ENABLED': False,
+    'BACKEND': 'polls.vote_buffer.JournalVoteBuffer',
+    'JOURNAL_DIR': BASE_DIR / 'var' / 'vote-journal',
+    'FSYNC': True,
+    'FLUSH_INTERVAL_MS': 200,
+    'BATCH_SIZE': 1000,
+    'MAX_QUEUE_DEPTH': 100000,
+}
+
+# Live results (polls.live): updates of the SSE results streams are sent at
+# most MAX_RATE times per second per process. BACKEND carries the "poll
+# changed" notifications: MemoryBackend within one process,
+# CacheVersionBackend across processes through a shared CACHES backend.
+
+POLLS_LIVE_RESULTS = {
+    'BACKEND': 'polls.live.MemoryBackend',
+    'MAX_RATE': 2,
+    'HEARTBEAT': 15,
+}
+
+# Token authentication cache (polls.authentication.CachedTokenAuthentication):
+# at most MAX_SIZE token -> user lookups are kept per process, each for TTL
+# seconds. Token deletion and user changes evict entries in the process that
+# made them; the TTL bounds how long other processes may still accept them.
+
+POLLS_TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+}
+
+# Poll ownership checks (polls.ownership.user_owns_poll): the ids of the polls
+# of a user are kept in the response cache for TTL seconds, for users with at
+# most MAX_SIZE polls; the others are answered with an indexed exists() query.
+
+POLLS_OWNERSHIP_CACHE = {
+    'MAX_SIZE': 5000,
+    'TTL': 300,
+}
+
+
+# Per-request instrumentation (polls.instrumentation): query count, DB,
+# serialization and render time as a Server-Timing header, a JSON log line on
+# the polls.instrumentation logger and per-route histograms at /api/metrics/.
+
+POLLS_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('POLLS_INSTRUMENTATION') == '1',
+    'SERVER_TIMING': True,
+    'LOG': True,
+}
+
+# cProfile a sample of the requests, and staff requests sent with `X-Polls-Profile: 1`
+POLLS_PROFILING = {
+    'ENABLED': os.environ.get('POLLS_PROFILING') == '1',
+    'SAMPLE_RATE': float(os.environ.get('POLLS_PROFILING_SAMPLE_RATE', '0.001')),
+    'DIRECTORY': os.environ.get('POLLS_PROFILING_DIRECTORY', str(BASE_DIR / 'var' / 'profiles')),
+    'MAX_PROFILES': 100,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'polls.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/5.2/topics/auth/passwords/
+#
+# Hashing runs on a bounded pool of worker threads (polls.hashing); sign-ups and
+# logins beyond WORKERS + MAX_PENDING at once get a 503 instead of starving the
+# other endpoints. POLLS_PASSWORD_HASHER=scrypt hashes new passwords with scrypt,
+# about the CPU cost of PBKDF2 but memory hard (128 MiB per hash, see
+# polls.hashing.ScryptPasswordHasher); existing hashes keep verifying either way.
+# Argon2 and bcrypt are left out, their packages are not in the requirements.
+
+POLLS_PASSWORD_HASHING = {
+    'WORKERS': int(os.environ.get('POLLS_PASSWORD_HASHING_WORKERS', 2)),
+    'MAX_PENDING': 64,
+    'TIMEOUT': 10,
+}
+
+PASSWORD_HASHERS = [
+    'polls.hashing.PBKDF2PasswordHasher',
+    'polls.hashing.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+if os.environ.get('POLLS_PASSWORD_HASHER') == 'scrypt':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -92,13 +313,29 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'polls.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
-    )
+    ),
+
+    # orjson based when orjson is installed, same output as DRF's JSON renderer/parser
+    'DEFAULT_RENDERER_CLASSES': (
+        'polls.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+
+    'DEFAULT_PARSER_CLASSES': (
+        'polls.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+
+    # keyset pagination, the page size can be changed per request with ?page_size= (capped)
+    'DEFAULT_PAGINATION_CLASS': 'polls.pagination.PollCursorPagination',
+    'PAGE_SIZE': 20,
 }
 
 # Internationalization